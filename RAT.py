@@ -1,4 +1,6 @@
 from functional_units import *
+from operands import *
+from tracing import channel, INFO, DEBUG
 
 
 class RegisterAliasTable:
@@ -14,15 +16,21 @@ class RegisterAliasTable:
         self.num_int_adders = 0
         self.num_fp_adders = 0
         self.num_fp_mults = 0
+        self.issue_width = 1         # instructions fetched, renamed and dispatched per cycle
 
         self.instr_queue = None      # reference to Instruction Buffer
         self.rob = None              # reference to Reorder Buffer
         self.func_units = {}         # reference to func units
         self.btb = None              # reference to Branch Translation Buffer
+        self.stall_reason = None     # "ROB" or the func_unit key the actv_instruction is blocked on
+        self.stall_counts = dict.fromkeys(["BTB", "ROB", "LSQ", "INT", "FPA", "FPM"], 0)  # cycles lost per cause
+        self.trace = channel("RAT")
 
         self.__init_registers__(register_qty)
 
-        self.rat_map_history = {}
+        self.rename_log = []  # (arf_reg, previous mapping) for every rename behind an unresolved branch
+        self.idle_fetches = 0  # fetch attempts in the last fast_forward() window, see fast_forward()
+        self.issue_row = None  # timing table row of the latest fetch, kept on its ROB entry for replays
 
 
     def __str__(self):
@@ -31,7 +39,7 @@ class RegisterAliasTable:
         output_string += "----------------------------------------\n"
         i = 1
         for key, value in self.rat_map.items():
-            output_string += "{}\t{}".format(key, value)
+            output_string += "{}\t{}".format(operand_name(key), operand_name(value))
             if i % 2 == 0:
                 output_string += "\n"
             else:
@@ -41,23 +49,46 @@ class RegisterAliasTable:
         return output_string
 
 
-    # fix me to handle PC correctly
     def tick(self, tracker):
+        """ Issues up to issue_width instructions in program order. Renaming one at a time through
+            rat_map resolves dependencies inside the group, and the group ends at the first
+            instruction that can't issue or at a branch
+        """
+        issued, fetched = self.__issue_slot__(tracker)
+        for _ in range(1, self.issue_width):
+            if issued is None or issued.op in ["Beq", "Bne", "NOP"] or self.func_units["BTB"].fetch_blocked():
+                break
+            if fetched:
+                self.func_units["BTB"].next_fetch()
+            issued, fetched = self.__issue_slot__(tracker, count_stalls=False)
+
+
+    # fix me to handle PC correctly
+    def __issue_slot__(self, tracker, count_stalls=True):
+        """ Fetches (or retries the held instruction), renames and dispatches one instruction.
+            Returns (the instruction if it issued else None, whether a new pc was fetched)
+        """
         hazard_flag = False
+        fetched = False
 
         # check for active stall and fetch
         work_instruction = self.actv_instruction
         if work_instruction is None:
             next_pc = self.func_units["BTB"].fetch_pc()
             if next_pc is None or next_pc >= self.instr_queue.total_instructions*4:
-                print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>> STALL or END <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<")
-                if next_pc is not None:
+                if self.trace.level >= DEBUG:
+                    self.trace.emit(DEBUG, "fetch_stall", pc=next_pc)
+                if next_pc is None:
+                    self.stall_counts["BTB"] += 1  # waiting on a branch
+                else:
                     self.instr_queue.out_of_bounds_hit = True # WE NEVER ACTUALLY VIOLATE THE Prog length. FORCE THE VALUE
                 hazard_flag = True
                 work_instruction = Instruction("NOP")  # Issue Nop
             else:
                 work_instruction = self.instr_queue.fetch(next_pc)
+                fetched = True
                 tracker.update("issue", work_instruction)
+                self.issue_row = len(tracker.tracked_instructions) - 1
                 self.actv_instruction = work_instruction
         else:
             self.func_units["BTB"].fetch_pc(f_stall=True)
@@ -85,7 +116,8 @@ class RegisterAliasTable:
                 if type(push_result) == Warning:
                     self.int_adder_counter = (self.int_adder_counter + 1) % (self.num_int_adders)
                     if self.int_adder_counter == starting_unit:
-                        print("ALL FUs ARE FULL!!!")
+                        if self.trace.level >= INFO:
+                            self.trace.emit(INFO, "all_full", unit=target_fu, pc=transformation.pc)
                         exit_flag = True
                 else:
                     self.int_adder_counter = (self.int_adder_counter + 1) % (self.num_int_adders)
@@ -98,7 +130,8 @@ class RegisterAliasTable:
                 if type(push_result) == Warning:
                     self.fp_adder_counter = (self.fp_adder_counter + 1) % (self.num_fp_adders)
                     if self.fp_adder_counter == starting_unit:
-                        print("ALL FP ADDERS ARE FULL!!!")
+                        if self.trace.level >= INFO:
+                            self.trace.emit(INFO, "all_full", unit=target_fu, pc=transformation.pc)
                         exit_flag = True
                 else:
                     self.fp_adder_counter = (self.fp_adder_counter + 1) % (self.num_fp_adders)
@@ -111,7 +144,8 @@ class RegisterAliasTable:
                 if type(push_result) == Warning:
                     self.fp_mult_counter = (self.fp_mult_counter + 1) % (self.num_fp_mults)
                     if self.fp_mult_counter == starting_unit:
-                        print("ALL FP MULTIPLIERS ARE FULL!!!")
+                        if self.trace.level >= INFO:
+                            self.trace.emit(INFO, "all_full", unit=target_fu, pc=transformation.pc)
                         exit_flag = True
                 else:
                     self.fp_mult_counter = (self.fp_mult_counter + 1) % (self.num_fp_mults)
@@ -122,6 +156,20 @@ class RegisterAliasTable:
             else:
                 push_result = self.func_units[target_fu].issue(transformation)
 
+        # remember what blocked the held instruction so idle cycles can be detected
+        if self.actv_instruction is None:
+            self.stall_reason = None
+        elif type(push_result) is Warning:
+            self.stall_reason = target_fu
+        elif hazard_flag and target_fu == "NOP":
+            self.stall_reason = "ROB"
+        else:
+            self.stall_reason = None
+        # the NOP held after the last fetch is the end of the program, not a stall.
+        #  Only the first slot of a cycle counts, the counts are cycles lost
+        if count_stalls and self.stall_reason is not None and self.actv_instruction.op != "NOP":
+            self.stall_counts[self.stall_reason] += 1
+
         # if pushed, clear the held instruction
         if type(push_result) is not Warning and hazard_flag == False:
             self.actv_instruction = None
@@ -134,8 +182,59 @@ class RegisterAliasTable:
             # Update timing table
             #print("!ISSUE: {}".format(transformation))
             #tracker.update("issue", transformation)
+            return transformation, fetched
+        return None, fetched
 
 
+    def idle_cycles(self):
+        """ Number of upcoming cycles in which tick() would neither fetch nor issue
+        """
+        btb = self.func_units["BTB"]
+        if self.actv_instruction is None:
+            if btb.fetch_blocked():
+                return IDLE_FOREVER  # fetch blocked until a branch resolves
+            if btb.new_pc >= self.instr_queue.total_instructions*4 and self.instr_queue.out_of_bounds_hit:
+                return IDLE_FOREVER  # program is fully issued
+            return 0
+
+        # a held instruction stays held as long as its resource stays full
+        if self.stall_reason == "ROB":
+            if (self.rob.rear + 1) % self.rob.num_entries == self.rob.front:
+                return IDLE_FOREVER
+        elif self.stall_reason == "LSQ":
+            if self.func_units["LSQ"].num_stats_free == 0:
+                return IDLE_FOREVER
+        elif self.stall_reason in ["INT", "FPA", "FPM"]:
+            units = self.func_units[self.stall_reason].values()
+            if all(unit.num_filled_stations >= unit.size for unit in units):
+                return IDLE_FOREVER
+        return 0
+
+    def fast_forward(self, cycles):
+        """ Idle cycles only poke the BTB fetch stall line (and count as stalls).
+            A fetch that gets nothing holds a NOP that the next tick clears, so with nothing to
+            fetch the ticks alternate between fetching (from None) and clearing (from the NOP)
+        """
+        btb = self.func_units["BTB"]
+        if self.actv_instruction is None or self.actv_instruction.op == "NOP":
+            phase = 0 if self.actv_instruction is None else 1
+            self.idle_fetches = (cycles + 1 - phase) // 2
+            if btb.fetch_blocked():
+                self.stall_counts["BTB"] += self.idle_fetches
+            if (phase + cycles) % 2 == 1:
+                self.actv_instruction = Instruction("NOP")
+                self.stall_reason = "ROB"
+                btb.f_stall = False
+            else:
+                self.actv_instruction = None
+                self.stall_reason = None
+                btb.f_stall = True
+        else:
+            self.idle_fetches = 0
+            btb.f_stall = True
+            if self.stall_reason is not None:
+                self.stall_counts[self.stall_reason] += cycles
+
     # called by ROB to alert that rob_reg is being commited so can be freed
     def commit_update(self, rob_reg):
         if rob_reg is None:
@@ -145,17 +244,41 @@ class RegisterAliasTable:
             if rob_reg == reg_ptr:
                 self.rat_map[arf_reg] = arf_reg
 
-    def save_state(self):
-        """ Saves a copy of the RAT. Needs to be called when a branch instruction is issued from
-        instruction buffer
+    def squash(self, mark):
+        """ Rolls the map back to a branch checkpoint by undoing the journaled renames after 'mark'.
+            A restored ROB tag that committed in the meantime maps back to the ARF register.
+            The held instruction is younger than any branch, so it goes too
         """
-        self.rat_map_history = self.rat_map.copy()
-
-    def rewind(self):
-        """ Used to reset the RAT back to the instruction before the branch occurred
+        while len(self.rename_log) > mark:
+            arf_reg, reg_ptr = self.rename_log.pop()
+            if reg_ptr & KIND_MASK == ROB_TAG and not self.rob.live(reg_ptr):
+                reg_ptr = arf_reg
+            self.rat_map[arf_reg] = reg_ptr
+        self.actv_instruction = None
+        self.sd_rob_ptr = None
+        self.stall_reason = None
+
+    def replay(self):
+        """ Load replay: the ROB dropped a load and everything younger, each register maps back to its
+            youngest writer still in the ROB, or to itself
         """
-        self.rat_map = self.rat_map_history.copy()
-        #self.actv_instruction = None
+        for arf_reg in self.rat_map:
+            self.rat_map[arf_reg] = arf_reg
+        i = self.rob.front
+        while i != -1:
+            entry = self.rob.rob[i]
+            if entry["op"] not in ["Sd", "Beq", "Bne"]:
+                self.rat_map[entry["dest"]] = entry["tag"]
+            i = -1 if i == self.rob.rear else (i + 1) % self.rob.num_entries
+        self.actv_instruction = None
+        self.sd_rob_ptr = None
+        self.stall_reason = None
+
+    def __remap__(self, arf_reg, reg_ptr):
+        # renames behind an unresolved branch are journaled so a mispredict can undo them
+        if len(self.func_units["BTB"].branches) > 0:
+            self.rename_log.append((arf_reg, self.rat_map[arf_reg]))
+        self.rat_map[arf_reg] = reg_ptr
 
 
     def __translate__(self, instr_raw):
@@ -166,81 +289,48 @@ class RegisterAliasTable:
         if instr_raw.type not in ["r", "i"]:
             return instr_raw
 
+        # prevents a stalled instruction from re-translation
+        if instr_raw.renamed:
+            return instr_raw
+
         # Some instructions store result to rd, others store to rt
         if instr_raw.op in ["Add","Add.d","Sub","Sub.d","Mult.d"]:
-            rob_dict = {"op":instr_raw.op, "dest":instr_raw.rd, "type":instr_raw.type, "instruction":instr_raw, "pc":instr_raw.pc}
+            rob_dict = {"op":instr_raw.op, "dest":instr_raw.rd, "type":instr_raw.type, "instruction":instr_raw, "pc":instr_raw.pc,
+                        "row":self.issue_row}
         elif instr_raw.op in ["Addi", "Ld", "Sd"]:
-            rob_dict = {"op":instr_raw.op, "dest":instr_raw.rt, "type":instr_raw.type, "instruction":instr_raw, "pc":instr_raw.pc}
+            rob_dict = {"op":instr_raw.op, "dest":instr_raw.rt, "type":instr_raw.type, "instruction":instr_raw, "pc":instr_raw.pc,
+                        "row":self.issue_row}
 
         if instr_raw.type == "i":
-            # prevents a stalled instruction from re-translation
-            if "ROB" in instr_raw.rt or self.sd_rob_ptr is not None:
-                return instr_raw
-
             if instr_raw.op in ["Bne", "Beq"]:
-                if "ROB" in instr_raw.rs: #only case where checking rt is in-sufficient
-                    return instr_raw
                 rs = self.rat_map[instr_raw.rs]
                 rt = self.rat_map[instr_raw.rt]
-                addr_imm = instr_raw.addr_imm
-                #print("[RAT] Translate >>> Output {}".format(Instruction([instr_raw.op, rs, rt, addr_imm], pc=instr_raw.pc)))
-                return Instruction([instr_raw.op, rs, rt, addr_imm], pc=instr_raw.pc)
+                rd = self.func_units["BTB"].reserve(instr_raw)  # tag the outcome is broadcast under
+                return instr_raw.rename(rd=rd, rs=rs, rt=rt)
             elif instr_raw.op == "Sd":
                 self.sd_rob_ptr = self.rob.enqueue(rob_dict)
                 if self.sd_rob_ptr is None:
                     return None
                 rs = self.rat_map[instr_raw.rs]
                 rt = self.rat_map[instr_raw.rt]
-                addr_imm = str(instr_raw.addr_imm)+"("+rs+")"
-                #print("[RAT] Translate >>> Output {}".format(Instruction([instr_raw.op, rt, addr_imm], pc=instr_raw.pc)))
-                return Instruction([instr_raw.op, rt, addr_imm], pc=instr_raw.pc)
-            elif instr_raw.op == "Addi":
-                # Only used for Addi & Ld
-                #print(self.rob)
+                return instr_raw.rename(rs=rs, rt=rt)
+            else:
+                # Addi & Ld, result goes to rt
                 rs = self.rat_map[instr_raw.rs]  #assign source register
                 rt = self.rob.enqueue(rob_dict)  #retrieve dest register
                 if rt is None:
                     return None
-                self.rat_map[instr_raw.rt] = rt # remap source register
-                addr_imm = instr_raw.addr_imm
-                #print("[RAT] Translate >>> Output {}".format(Instruction([instr_raw.op, rt, rs, addr_imm], pc=instr_raw.pc)))
-                return Instruction([instr_raw.op, rt, rs, addr_imm], pc=instr_raw.pc)
-            else:
-                # Only used for Ld bc Instruction args are different
-                #print(self.rob)
-                rs = self.rat_map[instr_raw.rs]
-                rt = self.rob.enqueue(rob_dict)
-                if rt is None:
-                    return None
-                self.rat_map[instr_raw.rt] = rt
-                addr_imm = instr_raw.addr_imm
-                imm_rs = str(addr_imm)+"("+rs+")"
-                #print("[RAT] Translate >>> Output {}".format(Instruction([instr_raw.op, rt, imm_rs], pc=instr_raw.pc)))
-                return Instruction([instr_raw.op, rt, imm_rs], pc=instr_raw.pc)
+                self.__remap__(instr_raw.rt, rt) # remap dest register
+                return instr_raw.rename(rs=rs, rt=rt)
 
         elif instr_raw.type == "r":
-            if "ROB" in instr_raw.rd:
-                # prevents a stalled instruction from re-translation
-                return instr_raw
-
             rd = self.rob.enqueue(rob_dict)
             rs = self.rat_map[instr_raw.rs]
             rt = self.rat_map[instr_raw.rt]
             if rd is None:
                 return None
-            self.rat_map[instr_raw.rd] = rd
-
-            """if instr_raw.rd != instr_raw.rt:
-                rt = self.rat_map[instr_raw.rt]
-            else:
-                rt = instr_raw.rt
-            if instr_raw.rd != instr_raw.rs:
-                rs = self.rat_map[instr_raw.rs]
-            else:
-                rs = instr_raw.rs
-            """
-            #print("[RAT] Translate >>> Output {}".format(Instruction([instr_raw.op, rd, rs, rt], pc=instr_raw.pc)))
-            return Instruction([instr_raw.op, rd, rs, rt], pc=instr_raw.pc)
+            self.__remap__(instr_raw.rd, rd)
+            return instr_raw.rename(rd=rd, rs=rs, rt=rt)
 
 
 
@@ -258,9 +348,9 @@ class RegisterAliasTable:
                            "BTB":None}
 
         for i in range(1,num_arf+1):
-            self.rat_map["R"+str(i)] = "R"+str(i)
-            self.rat_map["F"+str(i)] = "F"+str(i)
-        self.rat_map["R0"] = "R0"
+            self.rat_map[encode_operand("R"+str(i))] = encode_operand("R"+str(i))
+            self.rat_map[encode_operand("F"+str(i))] = encode_operand("F"+str(i))
+        self.rat_map[encode_operand("R0")] = encode_operand("R0")
 
 
 
@@ -0,0 +1,133 @@
+"""
+  Set-associative cache hierarchy between the LoadStoreQueue and Memory
+  - Timing only: values always live in Memory, the caches decide how long an access takes
+  - Each level has a size, associativity, line size (all in bytes of address space), a hit latency
+    and a write policy:
+      write-back     stores allocate a line and dirty it, a dirty victim is written to the next level
+      write-through  stores go on to the next level, a store miss doesn't allocate
+  - An access walks down the levels until one hits, paying each level's latency on the way, and
+    memory's latency (the LSQ "Cycles in Mem") when all of them miss. Missing levels are filled,
+    dirty victims go to the next level off the critical path (counted, not waited for)
+  - Tags live in flat arrays (one slot per way of each set), LRU by access stamp
+
+  Selected by optional header lines (on the blank lines of the header, ';' separated, see
+  parse_cache() in reading_input.py), e.g.
+    L1 cache = size=32K ways=8 line=64 latency=2; L2 cache = size=1M ways=16 line=64 latency=12 policy=write-back
+"""
+from array import array
+
+CACHE_LEVELS = ["L1", "L2"]
+WRITE_POLICIES = ["write-back", "write-through"]
+
+
+class CacheLevel:
+    def __init__(self, name, size, ways, line, latency, policy="write-back"):
+        self.name = name
+        self.ways = ways
+        self.line = line
+        self.sets = size // (ways * line)
+        self.latency = latency
+        self.write_back = policy == "write-back"
+        self.tags = array("q", [-1] * (self.sets * ways))  # line number held by each way, -1 = invalid
+        self.stamps = array("q", [0] * (self.sets * ways))  # last access, the smallest stamp in a set goes first
+        self.dirty = bytearray(self.sets * ways)
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0
+
+    def __find__(self, line_number):
+        first = (line_number % self.sets) * self.ways
+        for way in range(first, first + self.ways):
+            if self.tags[way] == line_number:
+                return way
+        return -1
+
+    def lookup(self, addr, write):
+        """ True on a hit, updates recency and the dirty bit
+        """
+        way = self.__find__(addr // self.line)
+        self.clock += 1
+        if way < 0:
+            self.misses += 1
+            return False
+        self.hits += 1
+        self.stamps[way] = self.clock
+        if write and self.write_back:
+            self.dirty[way] = 1
+        return True
+
+    def fill(self, addr, write):
+        """ Brings the line of addr in over the least recently used way. Returns the address of a dirty
+            victim that has to be written to the next level, or None
+        """
+        line_number = addr // self.line
+        first = (line_number % self.sets) * self.ways
+        victim = first
+        for way in range(first, first + self.ways):
+            if self.tags[way] == -1:
+                victim = way
+                break
+            if self.stamps[way] < self.stamps[victim]:
+                victim = way
+        evicted = None
+        if self.dirty[victim] and self.tags[victim] != -1:
+            evicted = self.tags[victim] * self.line
+            self.writebacks += 1
+        self.tags[victim] = line_number
+        self.stamps[victim] = self.clock
+        self.dirty[victim] = 1 if write and self.write_back else 0
+        return evicted
+
+    def counters(self):
+        return {"hits":self.hits, "misses":self.misses, "writebacks":self.writebacks}
+
+
+class CacheHierarchy:
+    def __init__(self, levels, memory_latency):
+        self.levels = levels  # closest to the LSQ first
+        self.memory_latency = memory_latency
+
+    def holds(self, addr):
+        """ True if the closest level has the line of addr, changes nothing
+        """
+        level = self.levels[0]
+        return level.__find__(addr // level.line) >= 0
+
+    def access(self, op, addr):
+        """ Cycles the LSQ waits for a Ld or Sd of addr
+        """
+        return self.__access__(0, addr, op == "Sd")
+
+    def __access__(self, depth, addr, write):
+        if depth == len(self.levels):
+            return self.memory_latency
+        level = self.levels[depth]
+        if level.lookup(addr, write):
+            if write and not level.write_back:
+                return level.latency + self.__access__(depth + 1, addr, write)
+            return level.latency
+        if write and not level.write_back:
+            return level.latency + self.__access__(depth + 1, addr, write)  # no allocate on a store miss
+        cycles = level.latency + self.__access__(depth + 1, addr, False)
+        evicted = level.fill(addr, write)
+        if evicted is not None:
+            self.__access__(depth + 1, evicted, True)
+        return cycles
+
+    def counters(self):
+        return {level.name:level.counters() for level in self.levels}
+
+    def __str__(self):
+        return "\n===Cache Counters===\n" + "\n".join(
+            "{}: {} hits, {} misses, {} writebacks".format(level.name, level.hits, level.misses, level.writebacks)
+            for level in self.levels) + "\n"
+
+
+def make_caches(configs, memory_latency):
+    """ CacheHierarchy for {"L1":config, "L2":config} (levels left out are skipped), None without any
+    """
+    levels = [CacheLevel(name, **configs[name]) for name in CACHE_LEVELS if configs.get(name) is not None]
+    if len(levels) == 0:
+        return None
+    return CacheHierarchy(levels, memory_latency)
@@ -2,17 +2,23 @@
 # Common Data Bus class: picks an available result and passes it to subscribers
 
 CDB Interface:
-|Sources| <--poll res_buf--  |Data Bus| -.read_cdb()--> |Subscribers|
+|Sources| --port.ready()--> |Data Bus| -.read_cdb()--> |Subscribers|
 |       |  --.deliver()--->  |        | <--.poll()----  |           |
 Sources must implement .deliver() so bus can pull in data to dist.
+Sources get a .cdb_port from the bus and call cdb_port.ready() after adding to their result_buffer
 Subscribers must implement .read_cdb() if they want automatic Delivery
 Subscribers call cdb.poll() to get available data on the cycle it's pulled
 
 
 Bus arbitration
-- Bus polls each source each cycle to detect an idle->ready tx.
-- If the tx is detected, the source is queued for delivery
-- Ties are arbitrated by order of access
+- A source signals its port when it buffers a result (an idle->ready tx), the bus
+  only looks at the signalled sources, never at all of them
+- The signalled sources are queued for delivery, one place in line per source
+- Ties are arbitrated by order of access, sources signalling in the same cycle by source order
+- With several buses up to that many sources deliver per cycle, one result each.
+  The policy picks them: "fifo" (the order above), "oldest" (oldest instruction first),
+  "round-robin" (rotating over the sources) or "priority FPM FPA LSQ INT" (by unit kind,
+  listed kinds first in that order)
 
 Delivery to bus
  - Bus calls source.deliver() to get the data out of the source result_buffer
@@ -24,70 +30,195 @@ Pick up from bus
  - Whatever data tuple was read from the bus, cdb will post to the sub
  - Subs can also use cdb.poll() to get the current bus data values
     -- data lives on the line for 1 cycle
+
+Tag wakeup
+ - Units holding operands that wait on a ROB tag register them with
+  cdb.wakeup_index.watch(tag, unit, station, field) instead of subscribing
+ - On a broadcast only the stations waiting on bus_data["dest"] are touched,
+  the bus calls unit.wakeup(station, field, value) for each of them
 """
+from collections import deque
+from functional_units import IDLE_FOREVER
+from operands import operand_name, rob_slot, KIND_MASK, ROB_TAG
+from tracing import channel, INFO
+
+POLICIES = ["fifo", "oldest", "round-robin", "priority"]
+SOURCE_KINDS = {"LoadStoreQueue":"LSQ", "IntegerAdder":"INT", "FPAdder":"FPA", "FPMultiplier":"FPM"}
+DEFAULT_PRIORITY = ["FPM", "FPA", "LSQ", "INT"]  # longest latency first
+
+# bits of a mask, lowest first
+def mask_bits(mask):
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+# a source's line to the arbiter
+class SourcePort:
+    def __init__(self, arbiter, index):
+        self.arbiter = arbiter
+        self.bit = 1 << index
+
+    def ready(self):
+        self.arbiter.signalled |= self.bit
+
 
 # arbitrates the collection actions of the bus.
 class Arbiter:
-    def __init__(self, cdb_ref):
-        self.output_q = []
-        self.source_states = None
+    def __init__(self, cdb_ref, policy="fifo"):
+        self.output_q = deque()
         self.cdb = cdb_ref
 
         if cdb_ref is None:
             raise TypeError("Arbiter was not given a reference to parent CBD")
 
-        self.source_states = [0] * len(self.cdb.sources) # init ready state arr
+        self.signalled = 0   # bit i set = source i buffered a result since the last arbitration
+        self.ready_mask = 0  # bit i set = source i is waiting for the bus
 
-    def reset(self):
-        self.source_states = [0] * len(self.cdb.sources)
+        fields = policy.split()
+        self.policy = fields[0].lower()
+        if self.policy not in POLICIES:
+            raise ValueError("Unknown CDB policy: {}".format(policy))
+        self.rr_ptr = 0  # round-robin: first source to look at next cycle
+        order = [kind.upper() for kind in fields[1:]] + DEFAULT_PRIORITY
+        self.by_priority = sorted(range(len(self.cdb.sources)),
+                                  key=lambda i: order.index(SOURCE_KINDS.get(type(self.cdb.sources[i]).__name__, "INT")))
 
-    def source_poll(self):
-        # determines state change of source in result buffer
-        for i in range(len(self.source_states)):
+    def reset(self):
+        self.output_q = deque()
+        self.signalled = 0
+        self.ready_mask = 0
+
+    def prune(self):
+        # sources whose buffered results got squashed give up their place in line
+        for i in mask_bits(self.ready_mask):
+            if len(self.cdb.sources[i].result_buffer) == 0:
+                self.ready_mask &= ~(1 << i)
+                if self.policy == "fifo":
+                    self.output_q.remove(i)
+
+    def take_signals(self):
+        # signalled sources not yet in line join it, in source order
+        for i in mask_bits(self.signalled & ~self.ready_mask):
             if len(self.cdb.sources[i].result_buffer) > 0:
-                ready_out = self.cdb.sources[i].result_buffer[0]
-            else:
-                ready_out = None
-
-            if ready_out is not None and self.source_states[i] == 0:
-                self.source_states[i] = 1
-                self.output_q.append(i)
-
-    def arbitrate(self):
-        # returns the next in line for CDB service or None if no data should tx
-        if len(self.output_q) > 0:
-            next_up = self.output_q[0]
+                self.ready_mask |= 1 << i
+                if self.policy == "fifo":
+                    self.output_q.append(i)
+        self.signalled = 0
+
+    def grant(self, i):
+        # i leaves the line and gets back in next cycle if it holds more than the result it now delivers
+        self.ready_mask &= ~(1 << i)
+        if len(self.cdb.sources[i].result_buffer) > 1:
+            self.signalled |= 1 << i
+
+    def arbitrate(self, count=1):
+        # returns the sources to serve this cycle, at most count of them
+        self.take_signals()
+        if self.policy == "fifo":
+            served = []
+            while len(served) < count and len(self.output_q) > 0:
+                served.append(self.output_q.popleft())
         else:
-            next_up = None
-
-        if next_up is not None:
-            self.source_states[next_up] = 0
+            served = self.pick(count)
+        for i in served:
+            self.grant(i)
+        return served
+
+    def pick(self, count):
+        ready = list(mask_bits(self.ready_mask))
+        if self.policy == "oldest":
+            ready.sort(key=lambda i: self.cdb.age(self.cdb.sources[i].result_buffer[0]))
+        elif self.policy == "round-robin":
+            ready.sort(key=lambda i: (i - self.rr_ptr) % len(self.cdb.sources))
+        elif self.policy == "priority":
+            ready.sort(key=self.by_priority.index)
+        served = ready[:count]
+        if self.policy == "round-robin" and len(served) > 0:
+            self.rr_ptr = (served[-1] + 1) % len(self.cdb.sources)
+        return served
+
+
+# indexes the stations waiting on each tag so a broadcast only visits its consumers
+class WakeupIndex:
+    def __init__(self):
+        self.waiting = {}  # tag -> [(unit, station, field), ...]
+
+    def watch(self, tag, unit, station, field):
+        if tag in self.waiting:
+            self.waiting[tag].append((unit, station, field))
+        else:
+            self.waiting[tag] = [(unit, station, field)]
+
+    def wake(self, bus_data):
+        consumers = self.waiting.pop(bus_data["dest"], None)
+        if consumers is None:
+            return
+        for unit, station, field in consumers:
+            unit.wakeup(station, field, bus_data["value"])
+
+    def forget(self, stations):
+        # drops the watches of squashed stations, which may be handed out again
+        gone = set(id(station) for station in stations)
+        for tag in list(self.waiting):
+            consumers = [consumer for consumer in self.waiting[tag] if id(consumer[1]) not in gone]
+            if len(consumers) > 0:
+                self.waiting[tag] = consumers
+            else:
+                del self.waiting[tag]
 
-        if len(self.output_q) > 0:
-            self.output_q.pop(0)
-        return next_up
+    def reset(self):
+        self.waiting = {}
 
 
 # Common Data Bus for transfering results to registers
 class CommonDataBus:
-    def __init__(self, sources, subscribers):
+    def __init__(self, sources, subscribers, buses=1, policy="fifo", rob=None):
         self.sources = sources # list of all FUs which feed the bus
         self.subscribers = subscribers # list of units reading the bus.
-        self.bus_data = None   # Available data for bus subscribers
-        self.arbiter = Arbiter(self)
+        self.buses = buses     # results broadcast per cycle
+        self.rob = rob         # for the age of a result, "oldest" policy only
+        self.bus_data = None   # Available data for bus subscribers (the first bus)
+        self.broadcasts = []   # everything broadcast this cycle, one entry per busy bus
+        self.arbiter = Arbiter(self, policy)
+        for i, source in enumerate(sources):
+            source.cdb_port = SourcePort(self.arbiter, i)
+        self.wakeup_index = WakeupIndex() # stations waiting on a tag
+        self.trace = channel("CDB")
 
     # standard heartbeat function
     def tick(self, tracker):
-        self.arbiter.source_poll()
-        target_fu = self.arbiter.arbitrate()
-
-        if target_fu is not None:
-            self.bus_data = self.sources[target_fu].deliver()
+        self.broadcasts = []
+        for target_fu in self.arbiter.arbitrate(self.buses):
+            bus_data = self.sources[target_fu].deliver()
+            if self.trace.level >= INFO:
+                self.trace.emit(INFO, "broadcast", dest=operand_name(bus_data["dest"]), value=bus_data["value"], op=bus_data["op"])
+            self.wakeup_index.wake(bus_data)
             for sub in self.subscribers:
-                sub.read_cdb(self.bus_data, tracker)
-
-        else:
-            self.bus_data = None
+                sub.read_cdb(bus_data, tracker)
+            self.broadcasts.append(bus_data)
+        self.bus_data = self.broadcasts[0] if len(self.broadcasts) > 0 else None
+
+    # program order of the instruction a result belongs to. Branch outcomes (not ROB tags) count as oldest
+    def age(self, result):
+        if result["dest"] & KIND_MASK != ROB_TAG:
+            return -1
+        return self.rob.rob[rob_slot(result["dest"])]["seq"]
+
+    # bus only moves when a source has something buffered for it
+    def idle_cycles(self):
+        if len(self.arbiter.output_q) > 0:
+            return 0
+        for src in self.sources:
+            if len(src.result_buffer) > 0:
+                return 0
+        return IDLE_FOREVER
+
+    # an idle bus carries nothing
+    def fast_forward(self, cycles):
+        self.bus_data = None
+        self.broadcasts = []
 
     # pickup function for subscriber units to call for data
     #  data lives on line for 1 cycle. If nothing is available, output is none
@@ -99,18 +230,23 @@ class CommonDataBus:
         if src_kill:
             self.sources = []
         self.bus_data = None
+        self.broadcasts = []
         self.arbiter.reset()
+        self.wakeup_index.reset()
 
-    # defined as a standard command, but bus does not hold state data
-    def rewind(self):
-        self.reset()
+    # branch mispredict: forget the squashed stations and their results
+    def squash(self, stations):
+        self.wakeup_index.forget(stations)
+        self.arbiter.prune()
 
     def __str__(self):
         val = None
         if self.bus_data is None:
             val = "No source requested transfer."
+        elif len(self.broadcasts) > 1:
+            val = [dict(data, dest=operand_name(data["dest"])) for data in self.broadcasts]
         else:
-            val = self.bus_data
+            val = dict(self.bus_data, dest=operand_name(self.bus_data["dest"]))
         return "\n>>> Common Data Bus - Broadcast >>> {}\n".format(val)
 
 # Debug class / script
@@ -1,9 +1,19 @@
 import os
 import sys
+import copy
+from collections import namedtuple
 from reading_input import *
+from operands import *
+from predictors import make_predictor, pack_branch
+from tracing import channel, INFO, DEBUG
+
+# Returned by idle_cycles() when a unit has nothing scheduled on its own and can
+#  only be woken up by another unit (issue, CDB broadcast, commit...)
+IDLE_FOREVER = float("inf")
 
 class Instruction():
     """ Basic class for the Instruction objects. Args formatted as [string op, string rs, string rt, string rd]
+        Register operands are stored encoded (see operands.py)
     """
     def __init__(self, *args, pc=None):
 
@@ -13,6 +23,7 @@ class Instruction():
         """
         # NOOP
         self.string = ""
+        self.renamed = False
         if args[0] == "NOP":
             self.op = "NOP"
             self.string = "NOP"
@@ -26,9 +37,9 @@ class Instruction():
             if args[0] in ["Add.d", "Add", "Sub", "Sub.d", "Mult.d"]:
                 self.type = "r"
                 self.op = args[0]
-                self.rd = args[1].strip(",")
-                self.rs = args[2].strip(",")
-                self.rt = args[3].strip(",")
+                self.rd = encode_operand(args[1].strip(","))
+                self.rs = encode_operand(args[2].strip(","))
+                self.rt = encode_operand(args[3].strip(","))
                 self.pc = pc
                 self.string = ""
                 for arg in args:
@@ -40,16 +51,16 @@ class Instruction():
                 self.type = "i"
                 self.op = args[0]
                 self.pc = pc
-                self.rt = args[1].strip(",")
+                self.rt = encode_operand(args[1].strip(","))
                 if args[0] in ["Bne", "Beq"]:
-                    self.rs = args[2].strip(",")
+                    self.rs = encode_operand(args[2].strip(","))
                     self.addr_imm = args[3].strip(",")
                 elif args[0] in ["Ld","Sd"]:
-                    self.rs = args[2].split("(")[1].strip(")")
+                    self.rs = encode_operand(args[2].split("(")[1].strip(")"))
                     self.addr_imm = float(args[2].split("(")[0])
                 elif args[0] in ["Addi"]:
-                    self.rt = args[2].strip(",")
-                    self.rs = args[3].strip(",")
+                    self.rt = encode_operand(args[2].strip(","))
+                    self.rs = encode_operand(args[3].strip(","))
                     self.addr_imm = args[3].strip(",")
                 self.string = ""
                 for arg in args:
@@ -59,8 +70,8 @@ class Instruction():
                 self.type = "i"
                 self.pc = pc
                 self.op = args[0]
-                self.rt = args[1].strip(",")
-                self.rs = args[2].strip(",")
+                self.rt = encode_operand(args[1].strip(","))
+                self.rs = encode_operand(args[2].strip(","))
                 self.addr_imm = args[3].strip(",")
                 self.string = ""
                 for arg in args:
@@ -69,28 +80,66 @@ class Instruction():
     def __str__(self):
         return self.string + "\tPC: {}".format(self.pc)
 
+    def rename(self, **operands):
+        """ Copy of this instruction with the given operand fields swapped for their renamed values.
+            The original string/pc/op/immediate are kept, no re-parsing
+        """
+        renamed = copy.copy(self)
+        renamed.__dict__.update(operands)
+        renamed.renamed = True
+        return renamed
+
+    @classmethod
+    def from_decoded(cls, decoded, pc=None):
+        """ Rebuild an Instruction from its DecodedInstruction record without touching the source text
+        """
+        instr = cls.__new__(cls)
+        for field, value in zip(decoded._fields, decoded):
+            if value is not None:
+                setattr(instr, field, value)
+        instr.pc = pc
+        instr.renamed = False
+        return instr
+
+
+# Compact, immutable form of one parsed program line. Fields an instruction type doesn't have are None
+DecodedInstruction = namedtuple("DecodedInstruction", ["op", "type", "rd", "rs", "rt", "addr_imm", "string"])
+
+
+def decode_instruction(line):
+    instr = Instruction(line.strip("\n").strip(",").split(" "))
+    return DecodedInstruction(*[getattr(instr, field, None) for field in DecodedInstruction._fields])
+
+
+def decode_program(lines):
+    """ Decodes the instruction section of an input file. Assume instructions always begin after line 10
+    """
+    return tuple(decode_instruction(inst) for inst in lines[11:])
+
+
 class InstructionBuffer:
     """ The InstructionBuffer class is a list of the instructions of a program.
     """
-    def __init__(self, filename):
-        # open text_file
-        readInput = open(filename, "r")
-        f = readInput.readlines()
-        # Assume instructions always begin after line 10
-        unparsed_instructions = f[11:]
-        self.instruction_list = [0]*len(unparsed_instructions)
-        for i, inst in enumerate(unparsed_instructions):
-            self.instruction_list[i] = Instruction(inst.strip("\n").strip(",").split(" "), pc=i*4)
+    def __init__(self, filename, program=None):
+        # program is the decoded form from decode_program(), decoded here if not handed in
+        if program is None:
+            readInput = open(filename, "r")
+            program = decode_program(readInput.readlines())
+        self.instruction_list = [0]*len(program)
+        for i, decoded in enumerate(program):
+            self.instruction_list[i] = Instruction.from_decoded(decoded, pc=i*4)
         self.index = 0
         self.total_instructions = len(self.instruction_list)
         self.out_of_bounds_hit = False
+        self.trace = channel("IBUF")
 
     def fetch(self, pc):
         """ Get the next instruction from the buffer
         """
         # If we reach the end of the instructions, return a NOP
         if pc == 4*len(self.instruction_list):
-            print("NO MORE INSTRUCTIONS!")
+            if self.trace.level >= INFO:
+                self.trace.emit(INFO, "end_of_program", pc=pc)
             self.out_of_bounds_hit = True
             return Instruction(["NOP"])
 
@@ -110,6 +159,45 @@ class InstructionBuffer:
     def __len__(self):
         return len(self.instruction_list)
 
+class ReservationStation:
+    """ One reservation station. Units build their stations once and reset them in place when freed
+    """
+    __slots__ = ("tag", "slot", "busy", "op", "vj", "vk", "qj", "qk", "value", "countdown", "dest", "instruction")
+
+    def __init__(self, tag, slot, countdown):
+        self.tag = tag
+        self.slot = slot
+        self.reset(countdown)
+
+    def reset(self, countdown):
+        """ Frees the station, same values as a freshly built one
+        """
+        self.busy = False
+        self.op = None
+        self.vj = None
+        self.vk = None
+        self.qj = None
+        self.qk = None
+        self.value = None
+        self.countdown = countdown
+        self.dest = None
+        self.instruction = None
+
+    def fill(self, instruction, qj, qk, dest, countdown):
+        """ Takes an instruction in. Operand values are requested by the unit afterwards
+        """
+        self.busy = True
+        self.op = instruction.op
+        self.vj = None
+        self.vk = None
+        self.qj = qj
+        self.qk = qk
+        self.value = None
+        self.countdown = countdown
+        self.dest = dest
+        self.instruction = instruction
+
+
 class FPMultiplier:
     """ The FPMultiplier class encapsulates all functionality of the parameterizable hardware Floating Point Multipler.
     """
@@ -117,25 +205,32 @@ class FPMultiplier:
     def __init__(self, num_reservations_stations, cycles_in_ex, fu_number, rob):
         """ Initialization function for the FPMultiplier to specify parameters.
         """
-        self.reservation_stations = {}
+        self.reservation_stations = []
         self.fu_number = fu_number
         self.cycles_in_ex = cycles_in_ex
         self.num_filled_stations = 0
-        self.last_issued = None
+        self.just_issued = set()  # stations filled this cycle, they start executing next cycle
         self.size = num_reservations_stations
         for i in range(num_reservations_stations):
             tag = "FPMULT_{}_{}".format(str(fu_number), str(i))
-            self.reservation_stations[tag] = {"busy":False, "op":None,"vj":None, "vk":None, "qj":None, "qk":None, "value":None, "countdown":self.cycles_in_ex, "dest":None}
+            self.reservation_stations.append(ReservationStation(tag, i, self.cycles_in_ex))
+        self.free_mask = (1 << num_reservations_stations) - 1  # bit i set = station i is free
 
         # This buffer keeps a history of results and their associated tags to send to CDB
         self.result_buffer = []
-
-        # This reserves a copy of our reservation station in case we need to backtrack
-        self.history = []
+        self.result_capacity = None  # results held for the CDB before the unit stalls, None = no limit
+        self.cdb_port = None  # set by the CDB, signalled whenever a result is buffered
+        self.initiation_interval = None  # cycles between starts when pipelined, None = stations execute in place
+        self.pipeline = []  # [cycles left, result] per instruction in flight when pipelined, oldest first
+        self.start_wait = 0  # cycles until the pipeline accepts another instruction
 
         # Register the rob to make requests
         self.rob = rob
 
+        # CDB wakeup index, registered by the processor. Without it read_cdb() scans every station
+        self.wakeup_index = None
+        self.trace = channel("FPM")
+
     def issue(self, instruction):
         """ Function to insert an instruction into the reservation station
         """
@@ -143,16 +238,17 @@ class FPMultiplier:
         if self.num_filled_stations >= self.size:
             return Warning("Reservation Station of FPMultiplier {} is full".format(self.fu_number))
         else:
-            # Generate tag and fill station
-            free_stations = [tag for tag, values in self.reservation_stations.items() if values["busy"] == False]
-            tag = free_stations[0]
-            self.last_issued = tag
-            self.reservation_stations[tag] = {"busy":True, "op":instruction.op, "qk":instruction.rs, "qj":instruction.rt, "vk":None, "vj":None, "countdown":self.cycles_in_ex, "value":None, "dest":instruction.rd, "instruction":instruction}
-            self.reservation_stations[tag]["vk"] = self.rob.request(instruction.rs)
-            self.reservation_stations[tag]["vj"] = self.rob.request(instruction.rt)
+            # Take the first free station and fill it
+            station = allocate_station(self)
+            self.just_issued.add(station)
+            station.fill(instruction, instruction.rt, instruction.rs, instruction.rd, self.cycles_in_ex)
+            station.vk = self.rob.request(instruction.rs)
+            station.vj = self.rob.request(instruction.rt)
+            watch_operands(self, station)
             self.num_filled_stations += 1
             if self.num_filled_stations == self.size:
-                print("FP Multiplier {} is now full!".format(self.fu_number))
+                if self.trace.level >= INFO:
+                    self.trace.emit(INFO, "stations_full", fu=self.fu_number)
         return None
 
     def deliver(self):
@@ -163,59 +259,77 @@ class FPMultiplier:
     def tick(self, tracker):
         """ Go forward once cycle and perform calculations. Add a waiting instruction to be executed. If a station is done, put result on output buffer
         """
+        if self.initiation_interval is not None:
+            pipeline_tick(self, tracker, first_ready_station(self), self.cycles_in_ex)
+            self.just_issued.clear()
+            return
         new_instruction_began = False
-        for tag, instruction in self.reservation_stations.items():
-            if self.last_issued != tag:
-                if instruction["vj"] != None and instruction["vk"] != None and instruction["countdown"] == self.cycles_in_ex and new_instruction_began != True:
-                    instruction["countdown"] -= 1
+        for station in self.reservation_stations:
+            if station not in self.just_issued:
+                if station.vj is not None and station.vk is not None and station.countdown == self.cycles_in_ex and new_instruction_began != True:
+                    station.countdown -= 1
                     new_instruction_began = True
-                    tracker.update("execute", {"pc":instruction["instruction"].pc})
-                elif self.last_issued == tag:
-                    self.last_issued = None
-                elif instruction["vj"] != None and instruction["vk"] != None and instruction["countdown"] < self.cycles_in_ex and instruction["countdown"] != 0:
-                    instruction["countdown"] -= 1
-                elif instruction["countdown"] == 0:
-                    answer = float(self.reservation_stations[tag]["vj"]) * float(self.reservation_stations[tag]["vk"])
-                    self.reservation_stations[tag]["value"] = answer
-                    self.result_buffer.append({"dest":self.reservation_stations[tag]["dest"],"value":answer,"op":self.reservation_stations[tag]["op"]})
-                    self.reservation_stations[tag] = {"busy":False, "op":None,"vj":None, "vk":None, "qj":None, "qk":None, "value":None, "countdown":self.cycles_in_ex, "dest":None}
+                    tracker.update("execute", {"pc":station.instruction.pc})
+                elif station.vj is not None and station.vk is not None and station.countdown < self.cycles_in_ex and station.countdown != 0:
+                    station.countdown -= 1
+                elif station.countdown == 0 and result_room(self):
+                    post_result(self, {"dest":station.dest,"value":self.compute(station),"op":station.op})
+                    release_station(self, station, self.cycles_in_ex)
                     self.num_filled_stations -= 1
-            else:
-                self.last_issued = None
+        self.just_issued.clear()
+
+    def compute(self, station):
+        return float(station.vj) * float(station.vk)
 
-    def save_state(self):
-        """ Saves a copy of the reservation stations. Needs to be called when a branch instruction is issued from
-        instruction buffer
+    def idle_cycles(self):
+        """ Number of upcoming cycles in which tick() would only count down executing stations
         """
-        self.history = self.reservation_stations.copy()
+        if self.initiation_interval is not None:
+            return pipeline_idle_cycles(self)
+        return fp_station_idle_cycles(self)
 
-    def rewind(self):
-        """ Used to reset the reservation stations back to the instruction before the branch occurred
+    def fast_forward(self, cycles):
+        """ Apply 'cycles' idle ticks at once. Only valid for cycles <= idle_cycles()
         """
-        self.reservation_stations = self.history.copy()
-        self.num_filled_stations = sum([1 for key,val in self.reservation_stations.items() if val["busy"] == True])
-        self.executing = False
-        self.current_tag = None
+        if self.initiation_interval is not None:
+            pipeline_fast_forward(self, cycles)
+        else:
+            fp_station_fast_forward(self, cycles)
+
+    def squash(self, tags):
+        """ Frees the stations and drops the results of squashed instructions (their dest is in 'tags').
+            Returns the freed stations
+        """
+        squashed = squash_stations(self, tags)
+        self.just_issued.difference_update(squashed)
+        return squashed
 
     def read_cdb(self, bus_data, tracker=None):
         """ Read data on CDB and check if unit is looking for that value. Data bus formatted as {"dest":Destination, "value":Value}
         """
-        for tag, station in self.reservation_stations.items():
-            if station["qj"] == bus_data["dest"]:
-                station["vj"] = bus_data["value"]
-            if station["qk"] == bus_data["dest"]:
-                station["vk"] = bus_data["value"]
+        for station in self.reservation_stations:
+            if station.qj == bus_data["dest"]:
+                station.vj = bus_data["value"]
+            if station.qk == bus_data["dest"]:
+                station.vk = bus_data["value"]
+
+    def wakeup(self, station, field, value):
+        """ Called by the CDB wakeup index when the tag a station operand waits on is broadcast
+        """
+        setattr(station, field, value)
 
     def __str__(self):
         output_string = "===================================================FP Multiply Unit==============================================================================\n"
         output_string += "Tag\t\t|\tBusy\t|\tOp\t|\tvj\t|\tvk\t|\tqj     |    qk    |    Countdown   |   Destination\n"
         output_string += "-------------------------------------------------------------------------------------------------------------------------------------------------\n"
-        for tag, value in self.reservation_stations.items():
-            output_string += str(tag + "\t|\t" + str(value["busy"]) + "\t|\t" + str(value["op"]) + \
-                "\t|\t" + str(value["vj"]) + "\t|\t" + str(value["vk"]) + "\t|\t" + str(value["qj"]) + \
-                "    |   " + str(value["qk"]) + "  |       " + str(value["countdown"]) + "      |   " + str(value["dest"]) + "\n")
+        for value in self.reservation_stations:
+            output_string += str(value.tag + "\t|\t" + str(value.busy) + "\t|\t" + str(value.op) + \
+                "\t|\t" + str(value.vj) + "\t|\t" + str(value.vk) + "\t|\t" + str(operand_name(value.qj)) + \
+                "    |   " + str(operand_name(value.qk)) + "  |       " + str(value.countdown) + "      |   " + str(operand_name(value.dest)) + "\n")
         output_string += "-------------------------------------------------------------------------------------------------------------------------------------------------\n"
         output_string += "Result Buffer: {}".format(self.result_buffer)
+        if self.initiation_interval is not None:
+            output_string += "\nPipeline: {}".format(pipeline_str(self))
         output_string += "\n=================================================================================================================================================\n"
         return output_string
 
@@ -226,25 +340,32 @@ class FPAdder:
     def __init__(self, num_reservations_stations, cycles_in_ex, fu_number, rob):
         """ Initialization function for the FPAdder to specify parameters.
         """
-        self.reservation_stations = {}
+        self.reservation_stations = []
         self.fu_number = fu_number
         self.cycles_in_ex = cycles_in_ex
         self.num_filled_stations = 0
-        self.last_issued = None
+        self.just_issued = set()  # stations filled this cycle, they start executing next cycle
         self.size = num_reservations_stations
         for i in range(num_reservations_stations):
             tag = "FPADD_{}_{}".format(str(fu_number), str(i))
-            self.reservation_stations[tag] = {"busy":False, "op":None,"vj":None, "vk":None, "qj":None, "qk":None, "value":None, "countdown":self.cycles_in_ex, "dest":None, "instruction":None}
+            self.reservation_stations.append(ReservationStation(tag, i, self.cycles_in_ex))
+        self.free_mask = (1 << num_reservations_stations) - 1  # bit i set = station i is free
 
         # This buffer keeps a history of results and their associated tags to send to CDB
         self.result_buffer = []
-
-        # This reserves a copy of our reservation station in case we need to backtrack
-        self.history = []
+        self.result_capacity = None  # results held for the CDB before the unit stalls, None = no limit
+        self.cdb_port = None  # set by the CDB, signalled whenever a result is buffered
+        self.initiation_interval = None  # cycles between starts when pipelined, None = stations execute in place
+        self.pipeline = []  # [cycles left, result] per instruction in flight when pipelined, oldest first
+        self.start_wait = 0  # cycles until the pipeline accepts another instruction
 
         # Register the rob to make requests
         self.rob = rob
 
+        # CDB wakeup index, registered by the processor. Without it read_cdb() scans every station
+        self.wakeup_index = None
+        self.trace = channel("FPA")
+
     def issue(self, instruction):
         """ Function to insert an instruction into the reservation station
         """
@@ -252,24 +373,26 @@ class FPAdder:
         if self.num_filled_stations >= self.size:
             return Warning("Reservation Station of FPAdder {} is full".format(self.fu_number))
         else:
-            tag = [tag for tag, values in self.reservation_stations.items() if values["busy"] == False][0]
-            self.last_issued = tag
+            station = allocate_station(self)
+            self.just_issued.add(station)
             if instruction.op == "Add.d":
                 # Add.d: Fd = Fs + Ft
-                self.reservation_stations[tag] = {"busy":True, "op":instruction.op, "qk":instruction.rs, "qj":instruction.rt, "countdown":self.cycles_in_ex, "value":None, "dest":instruction.rd, "instruction":instruction}
-                self.reservation_stations[tag]["vk"] = self.rob.request(instruction.rs)
-                self.reservation_stations[tag]["vj"] = self.rob.request(instruction.rt)
+                station.fill(instruction, instruction.rt, instruction.rs, instruction.rd, self.cycles_in_ex)
+                station.vk = self.rob.request(instruction.rs)
+                station.vj = self.rob.request(instruction.rt)
 
             elif instruction.op == "Sub.d":
                 # Sub.d: Fd = Fs - Ft
-                self.reservation_stations[tag] = {"busy":True, "op":instruction.op, "qk":instruction.rs, "qj":instruction.rt, "countdown":self.cycles_in_ex, "value":None, "dest":instruction.rd, "instruction":instruction}
-                self.reservation_stations[tag]["vk"] = self.rob.request(instruction.rs)
-                self.reservation_stations[tag]["vj"] = self.rob.request(instruction.rt)
+                station.fill(instruction, instruction.rt, instruction.rs, instruction.rd, self.cycles_in_ex)
+                station.vk = self.rob.request(instruction.rs)
+                station.vj = self.rob.request(instruction.rt)
 
+            watch_operands(self, station)
             self.num_filled_stations += 1
 
         if self.num_filled_stations == self.size:
-            print("FP Adder {} is now full!".format(self.fu_number))
+            if self.trace.level >= INFO:
+                self.trace.emit(INFO, "stations_full", fu=self.fu_number)
         return None
 
     def deliver(self):
@@ -278,65 +401,83 @@ class FPAdder:
     def tick(self, tracker):
         """ Go forward once cycle and perform calculations. Add a waiting instruction to be executed. If a station is done, put result on output buffer
         """
+        if self.initiation_interval is not None:
+            pipeline_tick(self, tracker, first_ready_station(self), self.cycles_in_ex)
+            self.just_issued.clear()
+            return
         # Let ready instructions operate
         new_instruction_began = False
-        for tag, instruction in self.reservation_stations.items():
-            if tag != self.last_issued:
-                if instruction["vj"] != None and instruction["vk"] != None and instruction["countdown"] == self.cycles_in_ex and new_instruction_began != True:
-                    instruction["countdown"] -= 1
+        for station in self.reservation_stations:
+            if station not in self.just_issued:
+                if station.vj is not None and station.vk is not None and station.countdown == self.cycles_in_ex and new_instruction_began != True:
+                    station.countdown -= 1
                     new_instruction_began = True
-                    tracker.update("execute", {"pc":instruction["instruction"].pc})
-                elif instruction["vj"] != None and instruction["vk"] != None and instruction["countdown"] < self.cycles_in_ex and instruction["countdown"] != 0:
-                    instruction["countdown"] -= 1
-                elif instruction["countdown"] == 0:
-                    # Calculate value
-                    if instruction["op"] == "Add.d":
-                        answer = float(self.reservation_stations[tag]["vj"]) + float(self.reservation_stations[tag]["vk"])
-                    else:
-                        answer = float(self.reservation_stations[tag]["vk"]) - float(self.reservation_stations[tag]["vj"])
-
-                    self.reservation_stations[tag]["value"] = answer
-                    self.result_buffer.append({"dest":self.reservation_stations[tag]["dest"],"value":answer,"op":self.reservation_stations[tag]["op"]})
-                    self.reservation_stations[tag] = {"busy":False, "op":None,"vj":None, "vk":None, "qj":None, "qk":None, "value":None, "countdown":self.cycles_in_ex, "dest":None}
+                    tracker.update("execute", {"pc":station.instruction.pc})
+                elif station.vj is not None and station.vk is not None and station.countdown < self.cycles_in_ex and station.countdown != 0:
+                    station.countdown -= 1
+                elif station.countdown == 0 and result_room(self):
+                    post_result(self, {"dest":station.dest,"value":self.compute(station),"op":station.op})
+                    release_station(self, station, self.cycles_in_ex)
                     self.num_filled_stations -= 1
-                elif instruction["qj"] != None or instruction["qk"] != None:
-                    print("{} still waiting on {} or {}".format(tag, instruction["qj"], instruction["qk"]))
-
-            self.last_issued = None
+                elif station.qj is not None or station.qk is not None:
+                    if self.trace.level >= DEBUG:
+                        self.trace.emit(DEBUG, "waiting", station=station.tag, qj=operand_name(station.qj), qk=operand_name(station.qk))
+        self.just_issued.clear()
+
+    def compute(self, station):
+        if station.op == "Add.d":
+            return float(station.vj) + float(station.vk)
+        return float(station.vk) - float(station.vj)
+
+    def idle_cycles(self):
+        """ Number of upcoming cycles in which tick() would only count down executing stations
+        """
+        if self.initiation_interval is not None:
+            return pipeline_idle_cycles(self)
+        return fp_station_idle_cycles(self)
 
-    def save_state(self):
-        """ Saves a copy of the reservation stations. Needs to be called when a branch instruction is issued from
-        instruction buffer
+    def fast_forward(self, cycles):
+        """ Apply 'cycles' idle ticks at once. Only valid for cycles <= idle_cycles()
         """
-        self.history = self.reservation_stations.copy()
+        if self.initiation_interval is not None:
+            pipeline_fast_forward(self, cycles)
+        else:
+            fp_station_fast_forward(self, cycles)
 
-    def rewind(self):
-        """ Used to reset the reservation stations back to the instruction before the branch occurred
+    def squash(self, tags):
+        """ Frees the stations and drops the results of squashed instructions (their dest is in 'tags').
+            Returns the freed stations
         """
-        self.reservation_stations = self.history.copy()
-        self.num_filled_stations = sum([1 for key,val in self.reservation_stations.items() if val["busy"] == True])
-        self.executing = False
-        self.current_tag = None
+        squashed = squash_stations(self, tags)
+        self.just_issued.difference_update(squashed)
+        return squashed
 
     def read_cdb(self, bus_data, tracker=None):
         """ Read data on CDB and check if unit is looking for that value. Data bus formatted as {"dest":Destination, "value":Value}
         """
-        for tag, station in self.reservation_stations.items():
-            if station["qj"] == bus_data["dest"]:
-                station["vj"] = bus_data["value"]
-            if station["qk"] == bus_data["dest"]:
-                station["vk"] = bus_data["value"]
+        for station in self.reservation_stations:
+            if station.qj == bus_data["dest"]:
+                station.vj = bus_data["value"]
+            if station.qk == bus_data["dest"]:
+                station.vk = bus_data["value"]
+
+    def wakeup(self, station, field, value):
+        """ Called by the CDB wakeup index when the tag a station operand waits on is broadcast
+        """
+        setattr(station, field, value)
 
     def __str__(self):
         output_string = "===================================================FP Adder Unit====================================================================================\n"
         output_string += "Tag\t\t|\tBusy\t|\tOp\t|\tvj\t|\tvk\t|\tqj      |    qk      |     value     |     Countdown\n"
         output_string += "----------------------------------------------------------------------------------------------------------------------------------------------------\n"
-        for tag, value in self.reservation_stations.items():
-            output_string += str(tag + "\t|\t" + str(value["busy"]) + "\t|\t" + str(value["op"]) + \
-                "\t|\t" + str(value["vj"]) + "\t|\t" + str(value["vk"]) + "\t|\t" + str(value["qj"]) + \
-                "    |    " + str(value["qk"]) + "     |     " + str(value["value"]) + "     |     " + str(value["countdown"]) + "\n")
+        for value in self.reservation_stations:
+            output_string += str(value.tag + "\t|\t" + str(value.busy) + "\t|\t" + str(value.op) + \
+                "\t|\t" + str(value.vj) + "\t|\t" + str(value.vk) + "\t|\t" + str(operand_name(value.qj)) + \
+                "    |    " + str(operand_name(value.qk)) + "     |     " + str(value.value) + "     |     " + str(value.countdown) + "\n")
         output_string += "----------------------------------------------------------------------------------------------------------------------------------------------------\n"
         output_string += "Result Buffer: {}".format(self.result_buffer)
+        if self.initiation_interval is not None:
+            output_string += "\nPipeline: {}".format(pipeline_str(self))
         output_string += "\n====================================================================================================================================================\n"
         return output_string
 
@@ -347,31 +488,38 @@ class IntegerAdder:
     def __init__(self, num_reservations_stations, cycles_in_ex, fu_number, rob):
         """ Initialization function for the IntegerAdder to specify parameters.
         """
-        self.reservation_stations = {}
+        self.reservation_stations = []
         self.fu_number = fu_number
         self.cycles_in_ex = cycles_in_ex-1
         self.countdown = cycles_in_ex-1
         self.executing = False
-        self.current_tag = None
-        self.last_issued = None
+        self.current_station = None
+        self.just_issued = set()  # stations filled this cycle, they start executing next cycle
         self.num_filled_stations = 0
         self.size = num_reservations_stations
         for i in range(num_reservations_stations):
             tag = "INTADD_{}_{}".format(str(fu_number), str(i))
-            self.reservation_stations[tag] = {"busy":False, "op":None,"vj":None, "vk":None, "qj":None, "qk":None, "value":None, "dest":None}
+            self.reservation_stations.append(ReservationStation(tag, i, self.cycles_in_ex))
+        self.free_mask = (1 << num_reservations_stations) - 1  # bit i set = station i is free
 
         # This buffer keeps a history of results and their associated tags to send to CDB
         self.result_buffer = []
+        self.result_capacity = None  # results held for the CDB before the unit stalls, None = no limit
+        self.cdb_port = None  # set by the CDB, signalled whenever a result is buffered
+        self.initiation_interval = None  # cycles between starts when pipelined, None = stations execute in place
+        self.pipeline = []  # [cycles left, result] per instruction in flight when pipelined, oldest first
+        self.start_wait = 0  # cycles until the pipeline accepts another instruction
 
         # This keeps track of stations that are ready to go
         self.ready_queue = []
 
-        # This reserves a copy of our reservation station in case we need to backtrack
-        self.history = []
-
         # Register the rob to make requests
         self.rob = rob
 
+        # CDB wakeup index, registered by the processor. Without it read_cdb() scans every station
+        self.wakeup_index = None
+        self.trace = channel("INT")
+
     def issue(self, instruction):
         """ Function to insert an instruction into the reservation station. Returns whether full or not
         """
@@ -380,103 +528,142 @@ class IntegerAdder:
             return Warning("Reservation Station of IntegerAdder {} is full".format(self.fu_number))
         else:
             # Flag marks reservation station as just issued, so don't execute during next tick() cycle
-            tag = [tag for tag, values in self.reservation_stations.items() if values["busy"] == False][0]
-            self.last_issued = tag
+            station = allocate_station(self)
+            self.just_issued.add(station)
             if instruction.op == "Add":
                 # Add: Rd = Rs + Rt
-                self.reservation_stations[tag] = {"busy":True, "op":instruction.op, "qk":instruction.rs, "qj":instruction.rt, "vj":None, "vk":None, "countdown":self.cycles_in_ex, "value":None, "dest":instruction.rd, "instruction":instruction}
-                self.reservation_stations[tag]["vk"] = self.rob.request(instruction.rs)
-                self.reservation_stations[tag]["vj"] = self.rob.request(instruction.rt)
+                station.fill(instruction, instruction.rt, instruction.rs, instruction.rd, self.cycles_in_ex)
+                station.vk = self.rob.request(instruction.rs)
+                station.vj = self.rob.request(instruction.rt)
             elif instruction.op == "Sub":
                 # Sub: Rd = Rs - Rt
-                self.reservation_stations[tag] = {"busy":True, "op":instruction.op, "qk":instruction.rs, "qj":instruction.rt, "vj":None, "vk":None, "countdown":self.cycles_in_ex, "value":None, "dest":instruction.rd, "instruction":instruction}
-                self.reservation_stations[tag]["vk"] = self.rob.request(instruction.rs)
-                self.reservation_stations[tag]["vj"] = self.rob.request(instruction.rt)
+                station.fill(instruction, instruction.rt, instruction.rs, instruction.rd, self.cycles_in_ex)
+                station.vk = self.rob.request(instruction.rs)
+                station.vj = self.rob.request(instruction.rt)
             elif instruction.op == "Addi":
                 # Addi: Rt = Rs + imm
-                self.reservation_stations[tag] = {"busy":True, "op":instruction.op, "qk":instruction.rs, "qj":None,"vk":None, "vj":instruction.addr_imm, "countdown":self.cycles_in_ex, "value":None, "dest":instruction.rt, "instruction":instruction}
-                self.reservation_stations[tag]["vk"] = self.rob.request(instruction.rs)
+                station.fill(instruction, None, instruction.rs, instruction.rt, self.cycles_in_ex)
+                station.vj = instruction.addr_imm
+                station.vk = self.rob.request(instruction.rs)
             elif instruction.op in ["Bne", "Beq"]:
                 # Bne: Rt != Rs? via subtraction
                 # Beq: Rt == Rs? via subtraction
-                self.reservation_stations[tag] = {"busy":True, "op":instruction.op, "qk":instruction.rs, "qj":instruction.rt, "vj":None, "vk":None, "countdown":self.cycles_in_ex, "value":None, "dest":"BTB", "instruction":instruction}
-                self.reservation_stations[tag]["vk"] = self.rob.request(instruction.rs)
-                self.reservation_stations[tag]["vj"] = self.rob.request(instruction.rt)
+                # the result goes to the branch's BTB checkpoint, its tag is in rd
+                station.fill(instruction, instruction.rt, instruction.rs, instruction.rd, self.cycles_in_ex)
+                station.vk = self.rob.request(instruction.rs)
+                station.vj = self.rob.request(instruction.rt)
 
+            watch_operands(self, station)
             self.num_filled_stations += 1
 
         if self.num_filled_stations == self.size:
-            print("Integer Adder {} is full!".format(self.fu_number))
+            if self.trace.level >= INFO:
+                self.trace.emit(INFO, "stations_full", fu=self.fu_number)
         return None
 
     def tick(self, tracker):
         """ Go forward once cycle and perform calculations. Add a waiting instruction to be executed. If a station is done, put result on output buffer
         """
         # Check for ready instructions and add to queue
-        for tag, instruction in self.reservation_stations.items():
-            if instruction["vj"] != None and instruction["vk"] != None and tag not in self.ready_queue and tag != self.last_issued:
-                self.ready_queue.append(tag)
-            elif tag == self.last_issued:
-                self.last_issued = None
+        for station in self.reservation_stations:
+            if station.vj is not None and station.vk is not None and station not in self.just_issued and station not in self.ready_queue:
+                self.ready_queue.append(station)
+        self.just_issued.clear()
+
+        if self.initiation_interval is not None:
+            started = pipeline_tick(self, tracker, self.ready_queue[0] if len(self.ready_queue) > 0 else None,
+                                    self.cycles_in_ex + 1)
+            if started is not None:
+                self.ready_queue.remove(started)
+            return
 
         if self.countdown != 0 and self.executing == True:
             self.countdown -= 1
-        elif self.countdown == 0 and self.executing == True:
+        elif self.countdown == 0 and self.executing == True and result_room(self):
             # Calculate answer
-            if self.reservation_stations[self.current_tag]["op"] == "Add" or self.reservation_stations[self.current_tag]["op"] == "Addi":
-                answer = int(self.reservation_stations[self.current_tag]["vj"]) + int(self.reservation_stations[self.current_tag]["vk"])
-            else:
-                # Sub OR Bne OR Beq
-                answer = int(self.reservation_stations[self.current_tag]["vk"]) - int(self.reservation_stations[self.current_tag]["vj"])
+            station = self.current_station
 
-            self.reservation_stations[self.current_tag]["value"] = answer
-            
             # Put answer on result_buffer
-            self.result_buffer.append({"dest":self.reservation_stations[self.current_tag]["dest"],"value":answer,"op":self.reservation_stations[self.current_tag]["op"]})
-            
+            post_result(self, {"dest":station.dest,"value":self.compute(station),"op":station.op})
+
             # Free reservation station and reset tags/flags
-            self.reservation_stations[self.current_tag] = {"busy":False, "op":None,"vj":None, "vk":None, "qj":None, "qk":None, "value":None, "dest":None, "instruction":None}
-            self.ready_queue.remove(self.current_tag)
-            self.current_tag = None
+            self.ready_queue.remove(station)
+            release_station(self, station, self.cycles_in_ex)
+            self.current_station = None
             self.num_filled_stations -= 1
             self.executing = False
             self.countdown = self.cycles_in_ex
 
         # Begin executing next instruction if idle
         if self.executing == False and len(self.ready_queue) != 0:
-            self.current_tag = self.ready_queue[0]
+            self.current_station = self.ready_queue[0]
             self.executing = True
             self.countdown = self.cycles_in_ex
-            instruction = self.reservation_stations[self.current_tag]
-            #print("!EXECUTE BEGAN: {}".format(instruction["instruction"]))
-            tracker.update("execute", {"pc":instruction["instruction"].pc})
+            #print("!EXECUTE BEGAN: {}".format(self.current_station.instruction))
+            tracker.update("execute", {"pc":self.current_station.instruction.pc})
 
 
     def deliver(self):
         return self.result_buffer.pop(0)
 
-    def save_state(self):
-        """ Saves a copy of the reservation stations. Needs to be called when a branch instruction is issued from
-        instruction buffer
-        """
-        self.history = self.reservation_stations.copy()
+    def compute(self, station):
+        if station.op == "Add" or station.op == "Addi":
+            return int(station.vj) + int(station.vk)
+        # Sub OR Bne OR Beq
+        return int(station.vk) - int(station.vj)
 
-    def rewind(self):
-        """ Used to reset the reservation stations back to the instruction before the branch occurred
+    def idle_cycles(self):
+        """ Number of upcoming cycles in which tick() would only count down the executing station
         """
-        self.reservation_stations = self.history.copy()
-        self.num_filled_stations = sum([1 for key,val in self.reservation_stations.items() if val["busy"] == True])
-        self.executing = False
-        self.current_tag = None
+        if self.initiation_interval is not None:
+            return pipeline_idle_cycles(self)
+        if len(self.just_issued) > 0:
+            return 0
+        for station in self.reservation_stations:
+            if station.vj is not None and station.vk is not None and station not in self.ready_queue:
+                return 0  # station woke up and still has to join the ready queue
+
+        if self.executing == True:
+            return self.countdown  # the tick that sees countdown == 0 delivers the answer
+        if len(self.ready_queue) != 0:
+            return 0
+        return IDLE_FOREVER
+
+    def fast_forward(self, cycles):
+        """ Apply 'cycles' idle ticks at once. Only valid for cycles <= idle_cycles()
+        """
+        if self.initiation_interval is not None:
+            pipeline_fast_forward(self, cycles)
+        elif self.executing == True:
+            self.countdown -= cycles
+
+    def squash(self, tags):
+        """ Frees the stations and drops the results of squashed instructions (their dest is in 'tags').
+            Returns the freed stations
+        """
+        squashed = squash_stations(self, tags)
+        self.just_issued.difference_update(squashed)
+        if squashed:
+            self.ready_queue = [station for station in self.ready_queue if station.busy]
+            if self.current_station in squashed:
+                self.current_station = None
+                self.executing = False
+                self.countdown = self.cycles_in_ex
+        return squashed
 
     def read_cdb(self, bus_data, tracker=None):
         """ Read data on CDB and check if unit is looking for that value. Data bus formatted as {"dest":Destination, "value":Value}
         """
-        for tag, station in self.reservation_stations.items():
-            if station["qj"] == bus_data["dest"]:
-                station["vj"] = bus_data["value"]
-            if station["qk"] == bus_data["dest"]:
-                station["vk"] = bus_data["value"]
+        for station in self.reservation_stations:
+            if station.qj == bus_data["dest"]:
+                station.vj = bus_data["value"]
+            if station.qk == bus_data["dest"]:
+                station.vk = bus_data["value"]
+
+    def wakeup(self, station, field, value):
+        """ Called by the CDB wakeup index when the tag a station operand waits on is broadcast
+        """
+        setattr(station, field, value)
 
     def __str__(self):
         if self.executing:
@@ -486,29 +673,41 @@ class IntegerAdder:
 
         output_string += "Tag\t\t|\tBusy\t|\tOp\t|\tvj\t|\tvk\t|\tqj      |    qk    |     value\n"
         output_string += "----------------------------------------------------------------------------------------------------------------------------\n"
-        for tag, value in self.reservation_stations.items():
-            output_string += str(tag + "\t|\t" + str(value["busy"]) + "\t|\t" + str(value["op"]) + \
-                "\t|\t" + str(value["vj"]) + "\t|\t" + str(value["vk"]) + "\t| \t" + str(value["qj"]))
-            output_string += "    |    " + str(value["qk"]) + "    |    " + str(value["value"]) + "\n"
+        for value in self.reservation_stations:
+            output_string += str(value.tag + "\t|\t" + str(value.busy) + "\t|\t" + str(value.op) + \
+                "\t|\t" + str(value.vj) + "\t|\t" + str(value.vk) + "\t| \t" + str(operand_name(value.qj)))
+            output_string += "    |    " + str(operand_name(value.qk)) + "    |    " + str(value.value) + "\n"
         output_string += "----------------------------------------------------------------------------------------------------------------------------\n"
-        output_string += "Result Buffer: {}\nReady Instruction Queue: {}".format(self.result_buffer, self.ready_queue)
+        output_string += "Result Buffer: {}\nReady Instruction Queue: {}".format(self.result_buffer, [station.tag for station in self.ready_queue])
+        if self.initiation_interval is not None:
+            output_string += "\nPipeline: {}".format(pipeline_str(self))
         output_string += "\n============================================================================================================================\n"
         return output_string
 
 class ROB:
     def __init__(self, num_rob_entries, int_arf, fp_arf):
         self.num_entries = num_rob_entries
-        self.int_arf = {"R{}".format(i):0 for i in range(0,int_arf)}
-        self.fp_arf = {"F{}".format(i):0.0 for i in range(0,fp_arf)}
+        self.int_arf = {encode_operand("R{}".format(i)):0 for i in range(0,int_arf)}
+        self.fp_arf = {encode_operand("F{}".format(i)):0.0 for i in range(0,fp_arf)}
         self.rob = [0] * num_rob_entries
+        # Tags are bound to slots (ROBn always lives in self.rob[n-1]), see rob_tag()/rob_slot()
         for i in range(num_rob_entries):
-            self.rob[i] = {"tag":"ROB{}".format(i+1),"op":None, "dest":None, "value":None, "finished":False, "instruction":None}
+            self.rob[i] = {"tag":rob_tag(i+1),"op":None, "dest":None, "value":None, "finished":False, "instruction":None}
         self.front = -1
         self.rear = -1
         self.rob_empty = True
-        self.last_wb = None
+        # tags written back by the latest cycle that had write-backs, they can't commit in that cycle.
+        #  The first write-back of a cycle replaces the set, later ones on other buses join it
+        self.last_wb = set()
+        self.wb_cycle_open = False
+        self.enqueued = 0          # entries ever enqueued, stamped on each entry as "seq"
+        self.commit_limit = None   # seq of the first entry behind an unresolved branch, set by the BTB
+        # The original pipeline keeps ticking the stale slot behind front == -1 when the ROB is empty,
+        #  and the reference outputs depend on it. Speculation turns this on so an empty ROB commits nothing
+        self.idle_when_empty = False
         self.LSQ = None
         self.RAT = None
+        self.trace = channel("ROB")
 
     def __str__(self):
         output_string = "===================ROB====================\n"
@@ -516,27 +715,35 @@ class ROB:
         output_string += "------------------------------------------\n"
         if (self.rear >= self.front):
             for i in range(self.front, self.rear + 1):
-                output_string += str(self.rob[i]) + "\n"
+                output_string += self.__entry_str__(self.rob[i]) + "\n"
         else:
             for i in range(self.front, self.num_entries):
-                output_string += str(self.rob[i]) + "\n"
+                output_string += self.__entry_str__(self.rob[i]) + "\n"
             for i in range(0, self.rear + 1):
-                output_string += str(self.rob[i]) + "\n"
+                output_string += self.__entry_str__(self.rob[i]) + "\n"
         output_string += "==========================================\n"
         if ((self.rear + 1) % self.num_entries == self.front):
             print("ROB is Full")
         return output_string
 
+    def __entry_str__(self, entry):
+        return str(dict(entry, tag=operand_name(entry["tag"]), dest=operand_name(entry["dest"])))
+
     def tick(self, tracker):
+        self.wb_cycle_open = False
+        if self.front == -1 and self.idle_when_empty:
+            self.last_wb = set()
+            return
+
         # Special case: Sd needs to check the LSQ to set it's finished status
         if self.rob[self.front]["op"] == "Sd":
             if self.LSQ.check_mem_commit(self.rob[self.front]["tag"]) == True:
                 self.rob[self.front]["finished"] = True
 
         # Check to see if the entry at the head is ready to commit. If so, commit/mem_commit and dequeue it
-        if self.rob[self.front]["finished"] == True:
+        if self.rob[self.front]["finished"] == True and not self.__behind_branch__(self.rob[self.front]):
             entry = self.rob[self.front]
-            if self.last_wb != entry["tag"]:
+            if entry["tag"] not in self.last_wb:
                 if entry["op"] == "Ld" or entry["op"] == "Sd":
                     tracker.update("commit",{"pc":entry["instruction"].pc}) #@Collin - changed this from "memory" to "commit"
                     self.mem_commit(entry)
@@ -545,7 +752,31 @@ class ROB:
                     tracker.update("commit",{"pc":entry["instruction"].pc})
                     self.commit(entry)
                     return self.dequeue()
-        self.last_wb = None
+        self.last_wb = set()
+
+    def idle_cycles(self):
+        """ Number of upcoming cycles in which tick() would not commit or change any state
+        """
+        if len(self.last_wb) > 0:
+            return 0
+        if self.front == -1 and self.idle_when_empty:
+            return IDLE_FOREVER
+        head = self.rob[self.front]
+        if head["op"] == "Sd":
+            if len(self.LSQ.queue_stations) == 0 or self.LSQ.check_mem_commit(head["tag"]):
+                return 0
+        if head["finished"] == True and not self.__behind_branch__(head):
+            return 0
+        return IDLE_FOREVER
+
+    def __behind_branch__(self, entry):
+        # speculative entries wait for their branch before they can commit
+        return self.commit_limit is not None and entry["seq"] >= self.commit_limit
+
+    def fast_forward(self, cycles):
+        """ Nothing counts down in the ROB, a stalled head stays stalled
+        """
+        return
 
     def enqueue(self, entry):
         """ Add an entry to the ROB, formatted as
@@ -553,19 +784,23 @@ class ROB:
         """
         self.rob_empty = False
         if ((self.rear + 1) % self.num_entries == self.front):
-            print("ROB is full!")
+            if self.trace.level >= INFO:
+                self.trace.emit(INFO, "rob_full", pc=entry["pc"])
             return None
         elif self.front == -1:
             self.front = 0
             self.rear = 0
-            entry["tag"] = "ROB{}".format(self.rear+1)
+            entry["tag"] = rob_tag(self.rear+1)
             entry["finished"] = False
+            entry["seq"] = self.enqueued
             self.rob[self.rear] = entry
         else:
             self.rear = (self.rear + 1) % self.num_entries
-            entry["tag"] = "ROB{}".format(self.rear+1)
+            entry["tag"] = rob_tag(self.rear+1)
             entry["finished"] = False
+            entry["seq"] = self.enqueued
             self.rob[self.rear] = entry
+        self.enqueued += 1
         return self.rob[self.rear]["tag"]
 
     def dequeue(self):
@@ -573,7 +808,8 @@ class ROB:
             {"op": Add|Add.d|Sub|Sub.d|Mult.d|Ld|Sd|Beq|Bne, "dest":Destination, "instruction":Instruction}
         """
         if self.front == -1:
-            print("ROB is empty")
+            if self.trace.level >= INFO:
+                self.trace.emit(INFO, "dequeue_empty")
         elif self.front == self.rear:
             self.rob_empty = True
             temp = self.rob[self.front]
@@ -589,81 +825,116 @@ class ROB:
         """ Read data on CDB and check if unit is looking for that value. Data bus formatted as
             {"dest":Destination, "value":Value, "instruction":Instruction}
         """
-        for entry in self.rob:
-            if entry["tag"] == bus_data["dest"]:
-                entry["value"] = bus_data["value"]
-                entry["finished"] = True
-                tracker.update("wrtback", {"pc":entry["pc"]})
-                self.last_wb = entry["tag"]
+        if bus_data["dest"] & KIND_MASK != ROB_TAG:
+            return  # not meant for the ROB (e.g. branch outcomes for the BTB)
+        entry = self.rob[rob_slot(bus_data["dest"])]
+        entry["value"] = bus_data["value"]
+        entry["finished"] = True
+        tracker.update("wrtback", {"pc":entry["pc"]})
+        if not self.wb_cycle_open:
+            self.last_wb = set()
+            self.wb_cycle_open = True
+        self.last_wb.add(entry["tag"])
 
     def commit(self, entry):
         if entry["finished"] and entry["op"] not in ["Sd"]:
-            if "F" in entry["dest"]:
+            if entry["dest"] & KIND_MASK == FP_REG:
                 self.fp_arf[entry["dest"]] = entry["value"]
-            elif "R" in entry["dest"]:
+            elif entry["dest"] & KIND_MASK == INT_REG:
                 self.int_arf[entry["dest"]] = entry["value"]
-                if entry["dest"] == "R0":
-                    print("Attempting to write to R0... booooo")
-                    self.int_arf["R0"] = 0
+                if entry["dest"] == R0:
+                    if self.trace.level >= INFO:
+                        self.trace.emit(INFO, "r0_write", pc=entry["pc"])
+                    self.int_arf[R0] = 0
                     entry["dest"] = 0
             self.RAT.commit_update(entry["tag"])
 
     def mem_commit(self, entry):
         if entry["op"] in ["Sd", "Ld"]:
             if entry["op"] == "Ld":
-                if "F" in entry["dest"]:
+                if entry["dest"] & KIND_MASK == FP_REG:
                     self.fp_arf[entry["dest"]] = entry["value"]
-                elif "R" in entry["dest"]:
+                elif entry["dest"] & KIND_MASK == INT_REG:
                     self.int_arf[entry["dest"]] = entry["value"]
-                    if entry["dest"] == "R0":
-                        print("Attempting to write to R0... booooo")
-                        self.int_arf["R0"] = 0
+                    if entry["dest"] == R0:
+                        if self.trace.level >= INFO:
+                            self.trace.emit(INFO, "r0_write", pc=entry["pc"])
+                        self.int_arf[R0] = 0
                         entry["dest"] = 0
                 self.RAT.commit_update(entry["tag"])
             self.LSQ.mem_commit(entry["tag"])
 
-    def request(self, register_name):
-        if "ROB" in register_name:
-            matching_entry = next((entry for entry in self.rob if entry["tag"] == register_name), None)
-            if matching_entry == None or "value" not in matching_entry.keys():
+    def request(self, operand):
+        kind = operand & KIND_MASK
+        if kind == ROB_TAG:
+            entry = self.rob[rob_slot(operand)]
+            if "value" not in entry:
                 return None
             else:
-                return matching_entry["value"]
-        elif "R" in register_name:
-            return self.int_arf[register_name]
-        elif "F" in register_name:
-            return self.fp_arf[register_name]
+                return entry["value"]
+        elif kind == INT_REG:
+            return self.int_arf[operand]
+        elif kind == FP_REG:
+            return self.fp_arf[operand]
 
     def register_arfs(self, int_arf, fp_arf):
         """ Initializes the FP ARF and INT ARF values based on what comes from the input file
         """
         for key, value in int_arf.items():
-            self.int_arf[key] = value
+            self.int_arf[encode_operand(key)] = value
         for key, value in fp_arf.items():
-            self.fp_arf[key] = value
+            self.fp_arf[encode_operand(key)] = value
         
         # Register un-writeable R0
-        self.int_arf["R0"] = 0
+        self.int_arf[R0] = 0
 
-        print("INT ARF: {}\nFP ARF: {}".format(self.int_arf, self.fp_arf))
+        if self.trace.level >= INFO:
+            self.trace.emit(INFO, "arf_init", int_arf=named(self.int_arf), fp_arf=named(self.fp_arf))
 
-    def save_state(self):
-        """ Saves a copy of the rob. Needs to be called when a branch instruction is issued from instruction buffer
+    def live(self, tag):
+        """ Whether the entry 'tag' is currently allocated (between front and rear)
         """
-        self.history = self.rob.copy()
-        self.front_copy = self.front
-        self.rear_copy = self.rear
+        slot = rob_slot(tag)
+        if self.front == -1:
+            return False
+        if self.front <= self.rear:
+            return self.front <= slot <= self.rear
+        return slot >= self.front or slot <= self.rear
 
-    def rewind(self):
-        """ Resets the rob back to the instruction before the branch occurred
+    def speculative(self, tag):
+        """ Whether the entry 'tag' is younger than an unresolved branch
         """
-        self.rob = self.history.copy()
-        self.front = self.front_copy
-        self.rear = self.rear_copy
+        return self.__behind_branch__(self.rob[rob_slot(tag)])
+
+    def squash(self, mark):
+        """ Drops every entry enqueued after the first 'mark' enqueues (a branch checkpoint), youngest first.
+            Returns the tags of the dropped entries
+        """
+        tags = set()
+        while self.front != -1 and self.rob[self.rear]["seq"] >= mark:
+            tags.add(self.rob[self.rear]["tag"])
+            self.rob[self.rear] = {"tag":self.rob[self.rear]["tag"], "op":None, "dest":None, "value":None, "finished":False, "instruction":None}
+            if self.front == self.rear:
+                self.front = -1
+                self.rear = -1
+                self.rob_empty = True
+            else:
+                self.rear = (self.rear - 1) % self.num_entries
+        self.last_wb -= tags
+        return tags
 
 class BTB:
-    def __init__(self, rob, rat, int_adders, fp_adders, fp_multipliers):
-        self.entries = {i:False for i in range(8)}
+    """ Branch predictor and fetch PC. With max_branches == 0 fetch stalls on every branch until it
+        resolves. With max_branches == N fetch follows the prediction past up to N unresolved branches;
+        each one keeps a checkpoint of marks (rename journal length, ROB enqueue count, timing table rows)
+        and a mispredict squashes only what was issued after it
+    """
+    def __init__(self, rob, rat, int_adders, fp_adders, fp_multipliers, max_branches=0, predictor=None):
+        # direction predictor and optional target cache, predictor is a config from parse_predictor()
+        self.predictor, self.target_cache = make_predictor(predictor)
+        self.predicted = 0     # branches resolved
+        self.mispredicted = 0  # of which mispredicted
+        self.outcome_trace = None  # bytearray of packed resolved branches while recording, see predictors.py
         self.branch_pc = 0
         self.branch_entry = -1
         self.correct = None
@@ -672,27 +943,48 @@ class BTB:
         self.actual_result = None
         self.f_stall = False
         self.current_instruction = None
-
-        # Register any unit that needs to have save_state() or rewind() called
+        self.trace = channel("BTB")
+
+        # speculation: outstanding branch checkpoints, oldest first
+        self.max_branches = max_branches
+        self.speculate = max_branches > 0
+        rob.idle_when_empty = self.speculate
+        self.branches = []
+        self.free_slots = list(range(max_branches))
+        self.fetching = False      # fetch_pc handed out a pc this cycle
+        self.fetch_target = None   # predicted pc if what was fetched is a branch
+
+        # Units that hold instructions younger than a branch, squashed on a mispredict
         self.rob = rob
         self.rat = rat
         self.int_adders = int_adders
         self.fp_adders = fp_adders
         self.fp_multipliers = fp_multipliers
+        self.lsq = None
+        self.cdb = None
+        self.tracker = None
 
     def __str__(self):
         output_string = "========= BTB ==========\n"
         output_string += "Entry\tTaken\tIn Use\n"
         output_string += "-----------------------\n"
-        for entry, taken in self.entries.items():
+        in_use = [self.predictor.index(branch["pc"]) for branch in self.branches]
+        for entry, taken in self.predictor.rows():
             output_string += "{}\t{}".format(entry, taken)
-            if self.branch_entry == entry:
+            if self.branch_entry == entry or entry in in_use:
                 output_string += "\tYES"
             output_string += "\n"
         output_string += "========================\n"
         return output_string
 
     def fetch_pc(self, f_stall=False):
+        if self.speculate:
+            self.f_stall = f_stall
+            if f_stall == True or self.fetch_blocked():
+                return None
+            self.fetching = True
+            return self.new_pc
+
         if self.branch_entry != -1 or f_stall == True:
             self.f_stall = f_stall
             return None
@@ -701,45 +993,81 @@ class BTB:
             self.f_stall = f_stall
             return self.new_pc
 
+    def next_fetch(self):
+        """ Moves fetch on to the next instruction within the cycle, for each further slot of a wide
+            issue group. Groups end at a branch, so this is always the fall-through pc
+        """
+        if self.speculate:
+            self.fetching = False
+        self.new_pc = self.new_pc + 4
+
+    def fetch_blocked(self):
+        """ Whether fetch waits on branches (the one outstanding branch, or a full checkpoint ring)
+        """
+        if self.speculate:
+            return len(self.branches) >= self.max_branches
+        return self.branch_entry != -1
+
+    def reserve(self, instruction):
+        """ Called when a branch is renamed. Returns the tag its outcome is broadcast under.
+            When speculating this predicts it and takes its checkpoint
+        """
+        if not self.speculate:
+            return BTB_DEST
+        slot = self.free_slots.pop(0)
+        taken = self.__predict__(instruction.pc)
+        branch = {"tag":branch_tag(slot), "slot":slot, "pc":instruction.pc, "prediction":taken, "actual":None,
+                  "offset":int(instruction.addr_imm),
+                  "rob_mark":self.rob.enqueued, "rename_mark":len(self.rat.rename_log),
+                  "row_mark":len(self.tracker.tracked_instructions)}
+        self.branches.append(branch)
+        self.rob.commit_limit = self.branches[0]["rob_mark"]
+        self.fetch_target = self.__target__(branch, taken)
+        if self.trace.level >= INFO:
+            self.trace.emit(INFO, "predict", pc=instruction.pc, taken=taken, target=self.fetch_target)
+        return branch["tag"]
+
     def issue(self, instruction, current_pc):
         """ Function to issue instruction to the BTB. Will return value of predicted PC
         """
         if instruction.op not in ["Bne", "Beq"]:
             raise Warning("This is not a Branch instruction!")
+        elif self.speculate:
+            return  # predicted and checkpointed at rename, see reserve()
         else:
-            # Issue save_state() to all relevant units
-            print(">>>>>>>>>>>> SAVE STATE <<<<<<<<<<<<")
-            self.rob.save_state()
-            self.rat.save_state()
-            for _, int_adder in self.int_adders.items():
-                int_adder.save_state()
-            for _, fp_adder in self.fp_adders.items():
-                fp_adder.save_state()
-            for _, fp_multiplier in self.fp_multipliers.items():
-                fp_multiplier.save_state()
             self.rs = instruction.rs
             self.rt = instruction.rt
             self.current_instruction = instruction
             self.predicted_offset = int(instruction.addr_imm)
-            self.branch_entry = current_pc % 8
+            self.branch_entry = self.predictor.index(current_pc)
 
             # Make prediction based on what's in the BTB entry PC
-            if self.entries[current_pc % 8] == True:
+            #  A branch held by a full unit issues a cycle after it was fetched, by then new_pc has
+            #  moved on, so the branch's own pc is what its target is relative to
+            self.branch_pc = current_pc
+            if self.__predict__(current_pc) == True:
                 # Predict taken
-                self.branch_pc = self.new_pc
                 self.prediction = True
-                self.predicted_pc = self.new_pc + 4 + self.predicted_offset * 4
-                print("@@@@@@@@@@@@@@@@@@@@@@@ BTB PREDICT TAKEN TO {}".format(self.predicted_pc))
+                self.predicted_pc = current_pc + 4 + self.predicted_offset * 4
+                if self.trace.level >= INFO:
+                    self.trace.emit(INFO, "predict", pc=current_pc, taken=True, target=self.predicted_pc)
             else:
                 # Predict not taken
-                print("@@@@@@@@@@@@@@@@@@@@@@@@ BTB PREDICT NOT TAKEN TO {}".format(self.new_pc + 4))
-                self.branch_pc = self.new_pc
+                if self.trace.level >= INFO:
+                    self.trace.emit(INFO, "predict", pc=current_pc, taken=False, target=current_pc + 4)
                 self.prediction = False
-                self.predicted_pc = self.new_pc + 4
+                self.predicted_pc = current_pc + 4
 
     def tick(self, tracker=None):
         """ Will check for misprediction, correct prediction, or no prediction and issue PC accordingly
         """
+        if self.speculate:
+            return self.__speculative_tick__(tracker)
+
+        if self.lsq is not None and self.lsq.violation is not None:
+            self.new_pc = self.__replay__()
+            return
+
         if self.correct is None:
             if self.branch_entry == -1 and not self.f_stall:
                 self.new_pc = self.new_pc + 4
@@ -747,29 +1075,22 @@ class BTB:
                 self.new_pc = self.new_pc
         elif self.correct is False:
             tracker.update("commit", {"pc":self.current_instruction.pc})
+            self.__resolve__(self.current_instruction.pc, self.prediction, self.actual_result,
+                             self.branch_pc + self.predicted_offset * 4 + 4)
             self.current_instruction = None
             self.correct = None
-            self.entries[self.branch_entry] = not self.entries[self.branch_entry]
             self.branch_entry = -1
             if self.actual_result == True:
                 self.new_pc = self.branch_pc + self.predicted_offset * 4 + 4
             else:
                 self.new_pc = self.branch_pc + 4
             self.actual_result = None
-            # Call rewind on all relevant units
-            """
-            self.rob.rewind()
-            self.rat.rewind()
-            for int_adder in self.int_adders:
-                int_adder.rewind()
-            for fp_adder in self.fp_adders:
-                fp_adder.rewind()
-            for fp_multiplier in self.fp_multipliers:
-                fp_multiplier.rewind()
-            """
+            # Nothing was fetched past the branch, so there is nothing to squash
         elif self.correct is True:
             # Reset all values if prediction is good
             tracker.update("commit", {"pc":self.current_instruction.pc})
+            self.__resolve__(self.current_instruction.pc, self.prediction, self.actual_result,
+                             self.branch_pc + self.predicted_offset * 4 + 4)
             self.current_instruction = None
             self.correct = None
             self.branch_entry = -1
@@ -780,6 +1101,137 @@ class BTB:
                 self.new_pc = self.branch_pc + 4
             self.actual_result = None
 
+    def __speculative_tick__(self, tracker):
+        # retire resolved branches, oldest first. A mispredict squashes everything younger
+        redirect = None
+        if self.lsq is not None and self.lsq.violation is not None:
+            redirect = self.__replay__()  # an older mispredicted branch below still takes over
+        i = 0
+        while i < len(self.branches):
+            branch = self.branches[i]
+            if branch["actual"] is None:
+                i += 1
+                continue
+            tracker.update("commit", {"pc":branch["pc"]})
+            self.__resolve__(branch["pc"], branch["prediction"], branch["actual"], self.__target__(branch, True))
+            if branch["actual"] != branch["prediction"]:
+                self.__squash__(i)
+                redirect = self.__target__(branch, branch["actual"])
+            del self.branches[i]
+            self.free_slots.append(branch["slot"])
+
+        if redirect is not None:
+            self.new_pc = redirect
+        elif self.fetching:
+            self.new_pc = self.new_pc + 4 if self.fetch_target is None else self.fetch_target
+        self.fetching = False
+        self.fetch_target = None
+        if len(self.branches) == 0:
+            self.rob.commit_limit = None
+            self.rat.rename_log = []  # nothing left to roll back to
+        else:
+            self.rob.commit_limit = self.branches[0]["rob_mark"]
+
+    def __predict__(self, pc):
+        # a taken prediction only counts when the target cache (if any) knows where to go
+        taken = self.predictor.predict(pc)
+        if taken and self.target_cache is not None and self.target_cache.lookup(pc) is None:
+            return False
+        return taken
+
+    def __resolve__(self, pc, prediction, actual, target):
+        self.predictor.update(pc, actual)
+        if actual and self.target_cache is not None:
+            self.target_cache.insert(pc, target)
+        self.predicted += 1
+        if prediction != actual:
+            self.mispredicted += 1
+        if self.outcome_trace is not None:
+            self.outcome_trace += pack_branch(pc, actual, target)
+
+    def __target__(self, branch, taken):
+        if taken:
+            return branch["pc"] + 4 + branch["offset"] * 4
+        return branch["pc"] + 4
+
+    def __squash__(self, index):
+        """ Undo everything issued after self.branches[index]. Each unit only visits its own younger entries
+        """
+        branch = self.branches[index]
+        younger = self.branches[index+1:]
+        if self.trace.level >= INFO:
+            self.trace.emit(INFO, "squash", pc=branch["pc"], branches=len(younger),
+                            instructions=len(self.tracker.tracked_instructions) - branch["row_mark"])
+        del self.branches[index+1:]
+        for other in younger:
+            self.free_slots.append(other["slot"])
+
+        tags = self.rob.squash(branch["rob_mark"])
+        tags.update(other["tag"] for other in younger)
+        self.rat.squash(branch["rename_mark"])
+        squashed = self.lsq.squash(tags)
+        for units in [self.int_adders, self.fp_adders, self.fp_multipliers]:
+            for unit in units.values():
+                squashed += unit.squash(tags)
+        self.cdb.squash(squashed)
+        self.tracker.squash(branch["row_mark"])
+        self.rat.instr_queue.out_of_bounds_hit = False  # the wrong path may have run off the end
+
+    def __replay__(self):
+        """ The load the LSQ left in violation read memory before an older store wrote it: squash it
+            and everything younger, returns its pc to fetch again from
+        """
+        load = self.rob.rob[rob_slot(self.lsq.violation["qrt"])]
+        if self.trace.level >= INFO:
+            self.trace.emit(INFO, "replay", pc=load["pc"],
+                            instructions=len(self.tracker.tracked_instructions) - load["row"])
+        younger = [branch for branch in self.branches if branch["rob_mark"] > load["seq"]]
+        self.branches = [branch for branch in self.branches if branch["rob_mark"] <= load["seq"]]
+        for other in younger:
+            self.free_slots.append(other["slot"])
+
+        tags = self.rob.squash(load["seq"])
+        tags.update(other["tag"] for other in younger)
+        if self.branch_entry != -1:
+            # without speculation fetch is held by a branch, and it came after the load
+            tags.add(BTB_DEST)
+            self.branch_entry = -1
+            self.current_instruction = None
+            self.correct = None
+            self.actual_result = None
+        self.rat.replay()
+        squashed = self.lsq.squash(tags)
+        for units in [self.int_adders, self.fp_adders, self.fp_multipliers]:
+            for unit in units.values():
+                squashed += unit.squash(tags)
+        self.cdb.squash(squashed)
+        self.tracker.squash(load["row"])
+        self.rat.instr_queue.out_of_bounds_hit = False
+        return load["pc"]
+
+    def idle_cycles(self):
+        """ The BTB only acts on its own when a branch outcome came in from the CDB, or a load
+            has to be replayed
+        """
+        if self.lsq is not None and self.lsq.violation is not None:
+            return 0
+        if self.speculate:
+            for branch in self.branches:
+                if branch["actual"] is not None:
+                    return 0
+            return IDLE_FOREVER
+        if self.correct is not None:
+            return 0
+        return IDLE_FOREVER
+
+    def fast_forward(self, cycles):
+        """ Apply 'cycles' idle ticks at once. Only valid for cycles <= idle_cycles()
+        """
+        if self.speculate:
+            return  # the pc only moves on fetches, and nothing is fetched while idle
+        if self.branch_entry == -1:
+            self.new_pc = self.new_pc + 4 * self.rat.idle_fetches
+
     def read_cdb(self, data_bus, tracker=None):
         """ Read data on CDB and check if unit is looking for that value. Data bus formatted as
         {"dest":Destination, "value":Value, "op":Type of Instruction}
@@ -800,6 +1252,15 @@ class BTB:
                     # Bne Not Taken
                     self.actual_result = False
 
+            if self.speculate:
+                # outcomes are matched to their checkpoint by tag, applied on the next tick
+                for branch in self.branches:
+                    if branch["tag"] == data_bus["dest"]:
+                        branch["actual"] = self.actual_result
+                        tracker.update("wrtback", {"pc":branch["pc"]})
+                self.actual_result = None
+                return
+
             # See if we were right
             if self.actual_result == self.prediction:
                 self.correct = True
@@ -807,3 +1268,125 @@ class BTB:
                 self.correct = False
             tracker.update("wrtback", {"pc":self.current_instruction.pc})
 
+
+# =====================SHARED RULES FOR RESERVATION STATIONS====================
+# free stations are the set bits of unit.free_mask, the lowest one is handed out first
+def allocate_station(unit):
+    lowest = unit.free_mask & -unit.free_mask
+    unit.free_mask ^= lowest
+    return unit.reservation_stations[lowest.bit_length() - 1]
+
+
+def release_station(unit, station, countdown):
+    station.reset(countdown)
+    unit.free_mask |= 1 << station.slot
+
+
+# frees every busy station whose instruction got squashed, and drops results already computed for them
+def squash_stations(unit, tags):
+    squashed = []
+    for station in unit.reservation_stations:
+        if station.busy and station.dest in tags:
+            release_station(unit, station, unit.cycles_in_ex)
+            unit.num_filled_stations -= 1
+            squashed.append(station)
+    unit.result_buffer = [result for result in unit.result_buffer if result["dest"] not in tags]
+    unit.pipeline = [stage for stage in unit.pipeline if stage[1]["dest"] not in tags]
+    return squashed
+
+
+# registers every operand of a freshly issued station that still waits on a tag
+def watch_operands(unit, station):
+    if unit.wakeup_index is None:
+        return
+    if station.vj is None and station.qj is not None:
+        unit.wakeup_index.watch(station.qj, unit, station, "vj")
+    if station.vk is None and station.qk is not None:
+        unit.wakeup_index.watch(station.qk, unit, station, "vk")
+
+# buffers a result for the CDB and tells the bus arbiter there is something to collect
+def post_result(unit, result):
+    unit.result_buffer.append(result)
+    if unit.cdb_port is not None:
+        unit.cdb_port.ready()
+
+
+# a finished instruction only leaves its station (or the integer adder) when its result fits in
+#  the result buffer, otherwise it holds at countdown 0 until the CDB drains the buffer
+def result_room(unit):
+    return unit.result_capacity is None or len(unit.result_buffer) < unit.result_capacity
+
+
+# Pipelined units (initiation_interval set): an instruction leaves its station when it starts and
+#  moves down unit.pipeline, which finishes one instruction a cycle at most. Another may start every
+#  initiation_interval cycles, 1 is fully pipelined and the latency (cycles in EX) is unpipelined.
+#  A finished instruction whose result doesn't fit in the result buffer stalls the whole pipeline
+def first_ready_station(unit):
+    for station in unit.reservation_stations:
+        if station.busy and station not in unit.just_issued and station.vj is not None and station.vk is not None:
+            return station
+    return None
+
+
+# one cycle of a pipelined unit, ready is the station to start if the pipeline takes one. Returns the started station
+def pipeline_tick(unit, tracker, ready, latency):
+    if len(unit.pipeline) > 0 and unit.pipeline[0][0] == 0:
+        if not result_room(unit):
+            return None
+        post_result(unit, unit.pipeline.pop(0)[1])
+    for stage in unit.pipeline:
+        stage[0] -= 1
+    if unit.start_wait > 0:
+        unit.start_wait -= 1
+        return None
+    if ready is None:
+        return None
+    tracker.update("execute", {"pc":ready.instruction.pc})
+    unit.pipeline.append([latency - 1, {"dest":ready.dest, "value":unit.compute(ready), "op":ready.op}])
+    unit.start_wait = unit.initiation_interval - 1
+    release_station(unit, ready, unit.cycles_in_ex)
+    unit.num_filled_stations -= 1
+    return ready
+
+
+def pipeline_str(unit):
+    return [(operand_name(result["dest"]), cycles) for cycles, result in unit.pipeline]
+
+
+def pipeline_idle_cycles(unit):
+    if len(unit.just_issued) > 0:
+        return 0
+    for station in unit.reservation_stations:
+        if station.busy and station.vj is not None and station.vk is not None:
+            return 0  # waiting to start
+    if len(unit.pipeline) > 0:
+        return unit.pipeline[0][0]
+    return IDLE_FOREVER
+
+
+def pipeline_fast_forward(unit, cycles):
+    for stage in unit.pipeline:
+        stage[0] -= cycles
+    unit.start_wait = max(unit.start_wait - cycles, 0)
+
+
+# FPMultiplier and FPAdder share the same station life cycle:
+#  ready -> countdown == cycles_in_ex (start, one per cycle) -> ... -> 0 (deliver)
+def fp_station_idle_cycles(unit):
+    if len(unit.just_issued) > 0:
+        return 0
+    idle = IDLE_FOREVER
+    for station in unit.reservation_stations:
+        if station.vj is None or station.vk is None:
+            continue  # waiting on the CDB, not on the clock
+        if station.countdown == unit.cycles_in_ex or station.countdown <= 0:
+            return 0  # about to start or to deliver
+        idle = min(idle, station.countdown)
+    return idle
+
+
+def fp_station_fast_forward(unit, cycles):
+    for station in unit.reservation_stations:
+        if station.vj is not None and station.vk is not None and 0 < station.countdown < unit.cycles_in_ex:
+            station.countdown -= cycles
+# =============================================================================
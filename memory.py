@@ -16,7 +16,26 @@
         relevant to a store operation
 
     The LSQ implements:
-    - .deliver()/result_buffer[] so it may be a source
+    - .deliver()/result_buffer[]/cdb_port so it may be a source
+
+    Memory ports (opt-in, ports=None keeps the single-ported queue where only the head goes to memory)
+    - mem_alus: address generation units, each computes one eff_addr at a time
+    - ports: memory accesses in flight at once. A Ld starts as soon as every older Sd has an address
+        and none of them matches its own (those forward instead), a Sd still starts only at the head
+    - banks: memory is interleaved over banks every `interleave` words, a bank serves one access at a time.
+        A ready access whose bank is busy waits (a bank conflict)
+    - mshrs: makes memory non-blocking. An access holds its port and bank only in the cycle it starts, a
+        miss (every access without caches, else a miss in the closest level) then waits in one of the
+        mshrs miss registers. A miss to a line that already has one joins it and finishes with it,
+        a miss finding them all taken waits. Loads still leave through result_buffer as they finish
+    - dependence: a memory dependence predictor (see predictors.py) lets a Ld start before older Sd
+        addresses are known, unless it predicts the Ld depends on one of them. When a Sd gets its address
+        and a younger Ld to it already took its value from memory or an older Sd, the Ld is left in
+        violation and the BTB replays it and everything younger on its next tick
+    - write_buffer_size: a Sd leaves the queue as soon as the ROB commits it and waits in a write buffer
+        of that many entries, which drains to memory oldest first on a port left free by the loads.
+        A committed Sd to a word whose buffered store has not started draining replaces it (coalescing),
+        younger Lds forward from the buffer. The ROB can't commit a Sd while the buffer is full
 
     Core Memory Block
     - Block is parameterizable in the following ways:
@@ -27,8 +46,23 @@
     - Number of elements available is size_bytes / word_len
     - Class cannot init if size_bytes % word_len != 0
     - To think in terms of elements, not bytes, set word_len = 1.
+    - Small memories are a plain list of words. Large ones (or a PagedStore handed in as the
+        config) only hold the pages that were written, so the address space can be gigabytes
+
+    Paged Store
+    - Words live in pages of PAGE_WORDS 8-byte slots, allocated on the first store to the page.
+        Reading an untouched word gives 0 without allocating
+    - Each slot remembers whether it holds an int or a float, values that fit neither
+        (e.g. ints past 64 bits) are kept as objects, so loads give back exactly what was stored
+    - load_image() maps a raw file of little-endian 8-byte ints or floats in at a word index,
+        or reads back a dump() of the touched pages
 """
+import mmap
+import os
+import struct
 from functional_units import *
+from operands import operand_name
+from tracing import channel, INFO, DEBUG
 
 
 class LoadStoreQueue:
@@ -43,36 +77,67 @@ class LoadStoreQueue:
         self.fwd_cost = 1
         #sub-component params
         self.enqueue_buf = None
-        self.queue_stations = [] * int(queue_len)
+        self.queue_stations = EntryRing(int(queue_len))
+        self.enqueued = 0         # entries ever enqueued, stamped on each entry as "seq" (queue order)
+        self.store_index = {}     # eff_addr -> queued Sd entries with that address, oldest first
+        self.addr_loads = []      # queued Ld entries with an address and no value yet
+        self.forwarded = []       # Ld entries holding a forwarded value, in queue order
         self.result_buffer = []
-        self.rb_history = []
-        self.lsq_history = []
+        self.cdb_port = None  # set by the CDB, signalled whenever a result is buffered
         self.mem_unit = Memory(int(mem_size), word_len=wl, mem_config=config, verbose=verbose)
-        self.mem_alu = {"target":-1, "busy":False,"countdown":None}
+        self.mem_alus = [idle_alu()]  # address generation units, more of them come with memory ports
+        self.ports = None       # memory accesses in flight at once, None = only the queue head is served
+        self.banks = 1          # memory banks, each serves one access at a time
+        self.interleave = 1     # consecutive words per bank
+        self.bank_conflicts = 0 # ready accesses held back by a busy bank, one per entry and cycle
+        self.port_stalls = 0    # cycles a ready access found every port busy
+        self.mshrs = None       # miss registers, None = an access holds its port until it finishes
+        self.mshr_merges = 0    # misses that joined the miss register of their line
+        self.mshr_stalls = 0    # ready misses held back by full miss registers, one per entry and cycle
+        self.dependence = None  # memory dependence predictor, None = a Ld waits for every older Sd address
+        self.spec_loads = []    # Ld entries that left while an older Sd address was unknown
+        self.violation = None   # oldest Ld that read a stale value, replayed by the BTB
+        self.violations = 0
+        self.write_buffer_size = None  # committed Sd entries held for memory, None = a Sd writes from the queue
+        self.write_buffer = []         # committed Sd entries, oldest first
+        self.coalesced = 0             # buffered stores replaced by a younger store to their word
+        self.write_buffer_stalls = 0   # cycles the oldest Sd could not commit because the buffer was full
+        self.caches = None  # CacheHierarchy deciding each access' latency, None = always cycles_in_mem
         #component ref params
         self.reorder_buffer = rob
+        self.wakeup_index = None  # CDB wakeup index, without it read_cdb() scans the queue
+        self.trace = channel("LSQ")
 
 
     def issue(self, instr, sd_rob=None):
         if self.num_stats_free == 0:
             return Warning("Warning! Queue is unable to accept instruction.")
+        if self.enqueue_buf is not None:
+            return Warning("Warning! Queue already accepted an instruction this cycle.")
 
         # create new queue entry with default value
         enqueue = {"op":instr.op, "qrs":instr.rs, "qrt":instr.rt, \
                    "vrs":None, "vrt":None, "imm":int(instr.addr_imm), \
                    "countdown":self.cycles_in_mem, "commit":commit_check(instr), \
-                   "eff_addr": None, "pc":instr.pc, "rob_ptr":sd_rob}
+                   "eff_addr": None, "pc":instr.pc, "rob_ptr":sd_rob, "in_mem":False,
+                   "mshr":None, "source":None, "seq":self.enqueued}
+        self.enqueued += 1
 
         enqueue["vrs"] = self.reorder_buffer.request(enqueue["qrs"])
         enqueue["vrt"] = self.reorder_buffer.request(enqueue["qrt"])
+        if self.wakeup_index is not None:
+            if enqueue["vrs"] is None:
+                self.wakeup_index.watch(enqueue["qrs"], self, enqueue, "vrs")
+            if enqueue["vrt"] is None and instr.op == "Sd":  # a Ld's qrt is its own destination
+                self.wakeup_index.watch(enqueue["qrt"], self, enqueue, "vrt")
 
         self.enqueue_buf = enqueue
         self.num_stats_free -= 1  #preemptively reserve the space
 
     # standard heartbeat operation
     def tick(self, tracker):
-        if self.num_stats_free == self.queue_sz:
-            # if nothing is queue'd, nothing to do.
+        if self.num_stats_free == self.queue_sz and len(self.write_buffer) == 0:
+            # if nothing is queue'd or buffered, nothing to do.
             return
         self.__exe_stage__(tracker)  # memory has its own exe stage for eff_addr
         self.__mem_stage__(tracker)
@@ -80,120 +145,441 @@ class LoadStoreQueue:
 
 
     def __exe_stage__(self, tracker):
-        if self.mem_alu["busy"]:
-            self.mem_alu["countdown"] -= 1
-            if self.mem_alu["countdown"] == 0:
-                q_target = self.queue_stations[self.mem_alu["target"]]
-                q_target["eff_addr"] = q_target["vrs"] + int(q_target["imm"])
-                self.mem_alu["busy"] = False
-                self.mem_alu["target"] = -1
-
-        if not self.mem_alu["busy"]:
-            for i in range(len(self.queue_stations)):
-                # find first entry w/o eff_addr and set up adder to work
-                entry = self.queue_stations[i]
-                if  entry["vrs"] is not None and entry["eff_addr"] is None:
-                    self.mem_alu["target"] = i
-                    self.mem_alu["countdown"] = self.cycles_in_exe
-                    self.mem_alu["busy"] = True
-                    tracker.update("execute", self.queue_stations[i])
+        for mem_alu in self.mem_alus:
+            if mem_alu["busy"]:
+                mem_alu["countdown"] -= 1
+                if mem_alu["countdown"] == 0:
+                    q_target = self.queue_stations.at(mem_alu["target"])
+                    q_target["eff_addr"] = q_target["vrs"] + int(q_target["imm"])
+                    self.__index_entry__(q_target)
+                    if q_target["op"] == "Sd" and self.dependence is not None:
+                        self.__check_violation__(q_target)
+                    mem_alu["busy"] = False
+                    mem_alu["target"] = -1
+
+        targeted = set(mem_alu["target"] for mem_alu in self.mem_alus if mem_alu["busy"])
+        for mem_alu in self.mem_alus:
+            if mem_alu["busy"]:
+                continue
+            for entry in self.queue_stations:
+                # find first entry w/o eff_addr no other alu works on and set up adder to work
+                if  entry["vrs"] is not None and entry["eff_addr"] is None and entry["slot"] not in targeted:
+                    mem_alu["target"] = entry["slot"]
+                    mem_alu["countdown"] = self.cycles_in_exe
+                    mem_alu["busy"] = True
+                    targeted.add(entry["slot"])
+                    tracker.update("execute", entry)
                     break
 
         if self.enqueue_buf is not None:
-            self.queue_stations.append(self.enqueue_buf)
+            self.queue_stations.push(self.enqueue_buf)
             self.enqueue_buf = None
 
 
     def __mem_stage__(self, tracker):
-        # value-forwarding operations - pass all values and change countdowns
-        trgt_addr = 0
-        fwd_val = 0
-        for i in range(len(self.queue_stations)):
-            s_instr = self.queue_stations[i]
-            if entry_str_fwd_ready(s_instr): # look for each ready Sd
-                trgt_addr = s_instr["eff_addr"]
-                fwd_val = s_instr["vrt"]
-
-                for j in range(i, len(self.queue_stations)):  # look for all following Lds
-                    l_instr = self.queue_stations[j]
-                    if entry_ld_fwd_ready(l_instr, trgt_addr):
-                        print("ID fwd candidate {}".format(l_instr))
-                        l_instr["vrt"] = fwd_val
-                        l_instr["countdown"] = self.fwd_cost
+        # value-forwarding operations - each Ld with an address takes the value of the youngest older Sd
+        #  to the same address, once that Sd has its value
+        for l_instr in list(self.addr_loads):
+            s_instr = self.__forwarding_store__(l_instr)
+            if s_instr is not None:
+                if self.trace.level >= DEBUG:
+                    self.trace.emit(DEBUG, "forward", pc=l_instr["pc"], addr=l_instr["eff_addr"], value=s_instr["vrt"])
+                l_instr["vrt"] = s_instr["vrt"]
+                l_instr["source"] = s_instr["seq"]
+                l_instr["countdown"] = self.fwd_cost
+                self.addr_loads.remove(l_instr)
+                insert_in_order(self.forwarded, l_instr)
 
         # memory operations
-        data_fwd_idex = self.queue_sz + 1
-            # direct operations
-        queue_leader = self.queue_stations[0]
+        dequeued = False
+        if self.ports is None:
+            dequeued = self.__head_access__(tracker)
+        else:
+            self.__port_accesses__(tracker)
+
+        # value forwarding operations - if Ld did not go to result buffer, then we can now.
+        #  On the single-ported queue the entry right behind a dequeued one sits this cycle out
+        skipped = None
+        for entry in list(self.forwarded):
+            if entry is skipped:
+                continue
+            if entry["countdown"] == 0:
+                # ready to dequeue, check nothing already buff'd and space available
+                if not (dequeued and self.ports is None) and len(self.result_buffer) < self.CDBe:
+                    dequeued = True
+                    ld_res = {"op":"Ld", "pc":entry["pc"], \
+                              "dest":entry["qrt"], "value":entry["vrt"]}
+                    self.num_stats_free += 1
+                    post_result(self, ld_res)
+                    if self.ports is None:
+                        skipped = self.queue_stations.next_after(entry)
+                    self.queue_stations.remove(entry)
+                    self.forwarded.remove(entry)
+                    if self.dependence is not None:
+                        self.spec_loads.append(entry)
+
+            else:   # entry got value but must pay transfer penalty
+                if entry["countdown"] == self.fwd_cost:
+                    tracker.update("memory", entry)
+                entry["countdown"] -= 1
+
+    # single-ported memory: only the queue head is served, returns whether a Ld left for the result buffer
+    def __head_access__(self, tracker):
+        dequeued = False  # one load leaves for the result buffer per cycle
+        queue_leader = self.queue_stations.front()
         #print("[LSQ] ENTRY of INTEREST: {}".format(queue_leader))
         if not lsq_fwd_ready(queue_leader): #check for fwd'd value
             if lsq_entry_ready(queue_leader):  #check that this instruction is set to go to memory
                 if queue_leader["countdown"] == 0:  # queue leader has been fully served by memory
-
                     if queue_leader["op"] == "Ld":
-                        if len(self.result_buffer) < self.CDBe:  # there is space in the results buffer
+                        if len(self.result_buffer) < self.CDBe and not self.__wrong_path_fault__(queue_leader):  # there is space in the results buffer
                             res = self.mem_unit.access("Ld", queue_leader["eff_addr"], None)
                             ld_res = {"op":"Ld", "pc":queue_leader["pc"], \
                                       "dest":queue_leader["qrt"], "value":res}
-                            self.result_buffer.append(ld_res)
-                            self.queue_stations.pop(0)
+                            post_result(self, ld_res)
+                            self.queue_stations.remove(queue_leader)
+                            remove_entry(self.addr_loads, queue_leader)
                             self.num_stats_free += 1
-                            data_fwd_idex = 0
+                            dequeued = True
                     else:  # store ops, auto-commit/dequeue when they complete
                         self.mem_unit.access("Sd", queue_leader["eff_addr"], queue_leader["vrt"])
-                        self.queue_stations.pop(0)
+                        self.queue_stations.remove(queue_leader)
+                        self.__unindex_store__(queue_leader)
                         self.num_stats_free += 1
-                        self.__reposition_alu_ptr__(0) # its possible to do a store and load-fwd on the same cycle
                         tracker.update("commit", queue_leader) # memory is also commit for Sd
-
                     # Queue leader was simply served, we must load the next instr. to memory in same cycle
                     if len(self.queue_stations) != 0:  # empty queue check
-                        next_leader = self.queue_stations[0]
+                        next_leader = self.queue_stations.front()
                         if not lsq_fwd_ready(next_leader) and lsq_entry_ready(next_leader): # we only serve non-fwd'd entries when ready
-                            if next_leader["countdown"] == self.cycles_in_mem:
-                                tracker.update("memory", next_leader)
+                            if not next_leader["in_mem"]:
+                                self.__begin_access__(next_leader, tracker)
                             next_leader["countdown"] -= 1
-
                 else: # if the instr is not fwd'd a val, and is not counted down, then mem is serving it
-                    if queue_leader["countdown"] == self.cycles_in_mem:
-                        tracker.update("memory", queue_leader)
+                    if not queue_leader["in_mem"]:
+                        self.__begin_access__(queue_leader, tracker)
                     queue_leader["countdown"] -= 1
-
-        # value forwarding operations - if Ld did not go to result buffer, then we can now.
+        return dequeued
+
+    # memory ports: accesses in flight count down together, finished ones free their port and bank
+    #  and ready entries start on the free ones, oldest first. With miss registers the ports and banks
+    #  are only taken for the cycle an access starts
+    def __port_accesses__(self, tracker):
+        in_flight = 0
+        busy_banks = set()
+        outstanding = {}  # line -> the entry that took its miss register
+        if len(self.write_buffer) > 0 and self.write_buffer[0]["in_mem"]:
+            store = self.write_buffer[0]
+            if store["countdown"] > 0:
+                store["countdown"] -= 1
+                if self.mshrs is None:
+                    in_flight += 1
+                    busy_banks.add(self.__bank__(store))
+            else:
+                self.mem_unit.access("Sd", store["eff_addr"], store["vrt"])
+                self.write_buffer.pop(0)
+                tracker.update("commit", store)
+        for entry in list(self.queue_stations):
+            if not entry["in_mem"]:
+                continue
+            if entry["countdown"] > 0:
+                entry["countdown"] -= 1
+            elif entry["op"] == "Ld":
+                if len(self.result_buffer) < self.CDBe and not self.__wrong_path_fault__(entry):
+                    res = self.mem_unit.access("Ld", entry["eff_addr"], None)
+                    post_result(self, {"op":"Ld", "pc":entry["pc"], "dest":entry["qrt"], "value":res})
+                    self.queue_stations.remove(entry)
+                    remove_entry(self.addr_loads, entry)
+                    self.num_stats_free += 1
+                    if self.dependence is not None:
+                        self.spec_loads.append(entry)
+                    continue
+            else:
+                self.mem_unit.access("Sd", entry["eff_addr"], entry["vrt"])
+                self.queue_stations.remove(entry)
+                self.__unindex_store__(entry)
+                self.num_stats_free += 1
+                tracker.update("commit", entry)
+                continue
+            if self.mshrs is None:
+                in_flight += 1  # still counting down, or a finished Ld waiting for the result buffer
+                busy_banks.add(self.__bank__(entry))
+            elif entry["mshr"] is not None and entry["countdown"] > 0:
+                outstanding.setdefault(entry["mshr"], entry)
+
+        unknown_stores = []  # older Sd entries without an address, a Ld passes them only on a prediction
+        older_store_addrs = set()
         for entry in self.queue_stations:
-            if lsq_fwd_ready(entry):
-                if entry["countdown"] == 0:
-                    # ready to dequeue, check nothing already buff'd and space available
-                    if data_fwd_idex == self.queue_sz + 1 and len(self.result_buffer) < self.CDBe:
-                        data_fwd_idex = self.queue_stations.index(entry)
-                        ld_res = {"op":"Ld", "pc":entry["pc"], \
-                                  "dest":entry["qrt"], "value":entry["vrt"]}
-                        self.num_stats_free += 1
-                        self.result_buffer.append(ld_res)
-                        self.queue_stations.pop(data_fwd_idex)
+            if entry["op"] == "Sd":
+                ready = entry is self.queue_stations.front() and lsq_entry_ready(entry)
+                if entry["eff_addr"] is None:
+                    unknown_stores.append(entry)
+                else:
+                    older_store_addrs.add(entry["eff_addr"])
+            else:
+                ready = lsq_entry_ready(entry) and not lsq_fwd_ready(entry) \
+                        and entry["eff_addr"] not in older_store_addrs and not self.__waits_on__(entry, unknown_stores)
+            if not ready or entry["in_mem"]:
+                continue
+            if in_flight == self.ports:
+                self.port_stalls += 1
+                break
+            if self.__bank__(entry) in busy_banks:
+                self.bank_conflicts += 1
+                continue
+            if self.mshrs is not None:
+                line = self.__line__(entry)
+                if line in outstanding:  # secondary miss, done when the line arrives
+                    entry["in_mem"] = True
+                    entry["mshr"] = line
+                    entry["countdown"] = outstanding[line]["countdown"]
+                    tracker.update("memory", entry)
+                    self.mshr_merges += 1
+                    in_flight += 1
+                    busy_banks.add(self.__bank__(entry))
+                    continue
+                if self.caches is None or not self.caches.holds(entry["eff_addr"]):
+                    if len(outstanding) == self.mshrs:
+                        self.mshr_stalls += 1
+                        continue
+                    entry["mshr"] = line
+                    outstanding[line] = entry
+            self.__begin_access__(entry, tracker)
+            entry["countdown"] -= 1
+            entry["source"] = -1
+            in_flight += 1
+            busy_banks.add(self.__bank__(entry))
+
+        # the write buffer drains one store at a time, oldest first, on a port the loads left free
+        if len(self.write_buffer) > 0 and not self.write_buffer[0]["in_mem"] and in_flight < self.ports \
+                and self.__bank__(self.write_buffer[0]) not in busy_banks:
+            self.__begin_access__(self.write_buffer[0], tracker)
+            self.write_buffer[0]["countdown"] -= 1
+        if self.__buffer_blocked__():
+            self.write_buffer_stalls += 1
+
+        if self.dependence is not None:
+            # loads that left are only checked while an older Sd address is still unknown
+            oldest = unknown_stores[0]["seq"] if len(unknown_stores) > 0 else self.enqueued
+            self.spec_loads = [load for load in self.spec_loads if load["seq"] > oldest]
+
+    def __waits_on__(self, load, unknown_stores):
+        if self.dependence is None:
+            return len(unknown_stores) > 0
+        for store in unknown_stores:
+            if self.dependence.depends(load["pc"], store["pc"]):
+                return True
+        return False
 
-                else:   # entry got value but must pay transfer penalty
-                    if entry["countdown"] == self.fwd_cost:
-                        tracker.update("memory", entry)
-                    entry["countdown"] -= 1
+    # a Sd got its address: a younger Ld to it that already took its value from memory or from an older Sd
+    #  read a stale value, the oldest such Ld is left for the BTB to replay
+    def __check_violation__(self, store):
+        victim = None
+        for load in list(self.queue_stations) + self.spec_loads:
+            if load["op"] == "Ld" and load["source"] is not None and load["source"] < store["seq"] < load["seq"] \
+                    and load["eff_addr"] == store["eff_addr"]:
+                if victim is None or load["seq"] < victim["seq"]:
+                    victim = load
+        if victim is None:
+            return
+        if self.trace.level >= INFO:
+            self.trace.emit(INFO, "violation", pc=victim["pc"], store_pc=store["pc"], addr=store["eff_addr"])
+        self.violations += 1
+        self.dependence.violation(victim["pc"], store["pc"])
+        if self.violation is None or victim["seq"] < self.violation["seq"]:
+            self.violation = victim
+
+    def __bank__(self, entry):
+        return (entry["eff_addr"] // self.interleave) % self.banks
+
+    # misses are tracked by line of the closest cache, by word without caches
+    def __line__(self, entry):
+        if self.caches is None:
+            return entry["eff_addr"]
+        return entry["eff_addr"] // self.caches.levels[0].line
+
+    # the youngest Sd older than l_instr to its address (queued, else buffered) if that Sd has its value,
+    #  else None. With memory ports a Sd in between whose address is unknown holds the Ld back like it
+    #  holds back its memory access
+    def __forwarding_store__(self, l_instr):
+        s_instr = None
+        for store in reversed(self.store_index.get(l_instr["eff_addr"], [])):
+            if store["seq"] < l_instr["seq"]:
+                s_instr = store
+                break
+        if s_instr is None:
+            s_instr = self.__buffered_store__(l_instr["eff_addr"])
+            if s_instr is None:
+                return None
+        if s_instr["vrt"] is None:
+            return None
+        if self.ports is not None:
+            unknown_stores = [entry for entry in self.queue_stations if entry["op"] == "Sd" and
+                              entry["eff_addr"] is None and s_instr["seq"] < entry["seq"] < l_instr["seq"]]
+            if self.__waits_on__(l_instr, unknown_stores):
+                return None
+        return s_instr
+
+    # the youngest buffered Sd to eff_addr, None without one
+    def __buffered_store__(self, eff_addr):
+        for store in reversed(self.write_buffer):
+            if store["eff_addr"] == eff_addr:
+                return store
+        return None
+
+    # a committed Sd moves from the queue to the write buffer. It replaces a buffered store to its
+    #  word that has not started draining, the older value would only be overwritten in memory
+    def __buffer_store__(self, entry):
+        self.queue_stations.remove(entry)
+        self.__unindex_store__(entry)
+        self.num_stats_free += 1
+        for i, store in enumerate(self.write_buffer):
+            if store["eff_addr"] == entry["eff_addr"] and not store["in_mem"]:
+                self.write_buffer[i] = entry
+                self.coalesced += 1
+                return
+        self.write_buffer.append(entry)
+
+    def __buffer_room__(self, entry):
+        if self.write_buffer_size is None or len(self.write_buffer) < self.write_buffer_size:
+            return True
+        for store in self.write_buffer:
+            if store["eff_addr"] == entry["eff_addr"] and not store["in_mem"]:
+                return True
+        return False
 
-        self.__reposition_alu_ptr__(data_fwd_idex)
+    # the ROB head is a Sd that is ready to commit but the write buffer has no room for it
+    def __buffer_blocked__(self):
+        if self.write_buffer_size is None or self.reorder_buffer.front == -1:
+            return False
+        q_lead = self.queue_stations.front()
+        return q_lead is not None and q_lead["op"] == "Sd" and \
+               q_lead["rob_ptr"] == self.reorder_buffer.rob[self.reorder_buffer.front]["tag"] and \
+               q_lead["eff_addr"] is not None and q_lead["vrt"] is not None and not self.__buffer_room__(q_lead)
+
+    # an entry got its address: stores become visible to forwarding, loads start looking
+    def __index_entry__(self, entry):
+        if entry["op"] == "Sd":
+            insert_in_order(self.store_index.setdefault(entry["eff_addr"], []), entry)
+        elif entry["vrt"] is None:
+            insert_in_order(self.addr_loads, entry)
+
+    def __unindex_store__(self, entry):
+        stores = self.store_index[entry["eff_addr"]]
+        remove_entry(stores, entry)
+        if len(stores) == 0:
+            del self.store_index[entry["eff_addr"]]
+
+    def __reindex__(self):
+        self.store_index = {}
+        self.addr_loads = []
+        self.forwarded = [entry for entry in self.queue_stations if lsq_fwd_ready(entry)]
+        for entry in self.queue_stations:
+            if entry["eff_addr"] is not None:
+                self.__index_entry__(entry)
+
+    # first memory cycle of an entry, the caches (if any) decide how long it takes
+    def __begin_access__(self, entry, tracker):
+        entry["in_mem"] = True
+        tracker.update("memory", entry)
+        if self.caches is not None:
+            entry["countdown"] = max(self.caches.access(entry["op"], entry["eff_addr"]), 1)
 
 
     def deliver(self):
         return self.result_buffer.pop(0)
 
+    def port_counters(self):
+        counters = {"bank_conflicts":self.bank_conflicts, "port_stalls":self.port_stalls}
+        if self.mshrs is not None:
+            counters.update(mshr_merges=self.mshr_merges, mshr_stalls=self.mshr_stalls)
+        if self.dependence is not None:
+            counters.update(violations=self.violations)
+        if self.write_buffer_size is not None:
+            counters.update(coalesced_stores=self.coalesced, write_buffer_stalls=self.write_buffer_stalls)
+        return counters
+
+
+    # number of upcoming cycles where tick() would only count down the alu/memory
+    def idle_cycles(self):
+        idle = IDLE_FOREVER
+        if len(self.write_buffer) > 0:
+            store = self.write_buffer[0]
+            if not store["in_mem"] or store["countdown"] <= 0:
+                return 0  # the oldest store may start draining, or writes memory
+            idle = store["countdown"]
+        if self.num_stats_free == self.queue_sz:
+            return idle
+        if self.enqueue_buf is not None:
+            return 0
+
+        targeted = set()
+        for mem_alu in self.mem_alus:
+            if mem_alu["busy"]:
+                # the tick that brings the countdown to 0 writes the eff_addr
+                idle = min(idle, max(mem_alu["countdown"] - 1, 0))
+                targeted.add(mem_alu["target"])
+        if len(targeted) < len(self.mem_alus):
+            for entry in self.queue_stations:
+                if entry["vrs"] is not None and entry["eff_addr"] is None and entry["slot"] not in targeted:
+                    return 0  # alu picks up a new entry
+
+        if len(self.forwarded) > 0:
+            return 0  # forwarded loads pay a 1 cycle penalty, then leave
+        for l_instr in self.addr_loads:
+            if self.__forwarding_store__(l_instr) is not None:
+                return 0
+
+        if self.ports is not None:
+            for entry in self.queue_stations:
+                if entry["in_mem"]:
+                    if entry["countdown"] <= 0:
+                        return 0  # memory response
+                    idle = min(idle, entry["countdown"])
+                elif lsq_entry_ready(entry) and not lsq_fwd_ready(entry):
+                    return 0  # may start on a free port
+            return idle
+
+        queue_leader = self.queue_stations.front()
+        if lsq_entry_ready(queue_leader):
+            countdown = queue_leader["countdown"]
+            if countdown <= 0 or not queue_leader["in_mem"]:
+                return 0  # memory response or first memory cycle (tracked)
+            idle = min(idle, countdown)
+        return idle
+
+
+    def fast_forward(self, cycles):
+        if len(self.write_buffer) > 0:
+            self.write_buffer[0]["countdown"] -= cycles  # idle_cycles() only skips while it drains
+            if self.__buffer_blocked__():
+                self.write_buffer_stalls += cycles
+        if self.num_stats_free == self.queue_sz:
+            return
+        for mem_alu in self.mem_alus:
+            if mem_alu["busy"]:
+                mem_alu["countdown"] -= cycles
+        if self.ports is not None:
+            for entry in self.queue_stations:
+                if entry["in_mem"]:
+                    entry["countdown"] -= cycles
+            return
+        queue_leader = self.queue_stations.front()
+        if not lsq_fwd_ready(queue_leader) and lsq_entry_ready(queue_leader):
+            queue_leader["countdown"] -= cycles
+
 
     def mem_commit(self, rob_loc):
-        for stat in self.queue_stations:
+        for stat in list(self.queue_stations):
             # if committed ROB entry matches q entry ROB ptr, permission given to go to mem on entry
             if rob_loc == stat["rob_ptr"]:
                 stat["commit"] = True
+                if self.write_buffer_size is not None:
+                    self.__buffer_store__(stat)
 
     def check_mem_commit(self, rob_loc):
-        q_lead = self.queue_stations[0]
+        q_lead = self.queue_stations.front()
         if q_lead["rob_ptr"] == rob_loc:
-            return q_lead["eff_addr"] is not None and q_lead["vrt"] is not None
+            return q_lead["eff_addr"] is not None and q_lead["vrt"] is not None and self.__buffer_room__(q_lead)
         return False
 
     def read_cdb(self, bus_data, tracker=None):
@@ -207,33 +593,63 @@ class LoadStoreQueue:
             if lsq_entry["qrt"] == bus_data["dest"]:
                 lsq_entry["vrt"] = bus_data["value"]
 
+    # called by the CDB wakeup index when a tag an entry waits on is broadcast
+    def wakeup(self, station, field, value):
+        station[field] = value
+
     # clear held values
     def reset(self, mem_reset=False):
-        self.queue_stations = []
+        self.queue_stations = EntryRing(self.queue_sz)
+        self.__reindex__()
         self.result_buffer = []
-        self.rb_history = None
-        self.lsq_history = None
-        self.mem_alu = {"target":-1, "busy":False, "countdown":None}
+        self.write_buffer = []
+        self.mem_alus = [idle_alu() for _ in self.mem_alus]
+        self.spec_loads = []
+        self.violation = None
         if mem_reset:
             self.mem_unit.reset()
 
-    # branch prediction state save
-    def save_state(self):
-        self.rb_history = self.result_buffer.copy()
-        self.lsq_histroy = self.queue_stations.copy()
-
-    # branch prediction rollback
-    def rewind(self):
-        rb_restore = self.rb_history.copy()
-        lsq_restore = self.lsq_history.copy()
-        self.reset()
-        self.queue_stations = lsq_restore
-        self.result_buffer = rb_restore
-
-    # keeps alu operating on the right element of the queue
-    def __reposition_alu_ptr__(self, popped_idex):
-        if popped_idex < self.mem_alu["target"]:
-            self.mem_alu["target"] -= 1
+    # branch mispredict: drop entries of squashed instructions (a Ld's qrt / a Sd's rob_ptr is in tags),
+    #  returns the dropped entries. A Sd's qrt is the tag of its data, which may since have been reused
+    def squash(self, tags):
+        squashed = [entry for entry in self.queue_stations if lsq_entry_tag(entry) in tags]
+        if self.enqueue_buf is not None and lsq_entry_tag(self.enqueue_buf) in tags:
+            squashed.append(self.enqueue_buf)
+            self.enqueue_buf = None
+        self.spec_loads = [load for load in self.spec_loads if load["qrt"] not in tags]
+        if self.violation is not None and self.violation["qrt"] in tags:
+            self.violation = None
+        if len(squashed) == 0:
+            self.result_buffer = [res for res in self.result_buffer if res["dest"] not in tags]
+            return squashed
+
+        for entry in squashed:
+            if "slot" not in entry:
+                continue  # the squashed enqueue_buf never made it into the ring
+            for i, mem_alu in enumerate(self.mem_alus):
+                if mem_alu["busy"] and mem_alu["target"] == entry["slot"]:
+                    self.mem_alus[i] = idle_alu()
+            self.queue_stations.remove(entry)
+        self.__reindex__()
+        self.num_stats_free += len(squashed)
+        self.result_buffer = [res for res in self.result_buffer if res["dest"] not in tags]
+        return squashed
+
+    # a load down a mispredicted path may compute any address, it waits at the head of the
+    #  queue for its branch instead of faulting. So does a load whose address may come from a value
+    #  that will be replayed (an older Sd address is unknown). Non-speculative bad accesses still fault
+    def __wrong_path_fault__(self, entry):
+        if self.mem_unit.valid(entry["eff_addr"]):
+            return False
+        if self.dependence is not None:
+            if self.violation is not None:
+                return True
+            for store in self.queue_stations:
+                if store["seq"] > entry["seq"]:
+                    break
+                if store["op"] == "Sd" and store["eff_addr"] is None:
+                    return True
+        return self.reorder_buffer.speculative(entry["qrt"])
 
 
     def __str__(self):
@@ -242,17 +658,92 @@ class LoadStoreQueue:
         out_str+="-----------------------------------------------------------------------------\n"
 
         for stat in self.queue_stations:
-            out_str += " " + stat["op"] + "  |  " + stat["qrs"] + "  |  " + \
-                       stat["qrt"] + "  |  " + str(stat["vrs"]) + "  |  " +  \
+            out_str += " " + stat["op"] + "  |  " + operand_name(stat["qrs"]) + "  |  " + \
+                       operand_name(stat["qrt"]) + "  |  " + str(stat["vrs"]) + "  |  " +  \
                        str(stat["vrt"]) + "  |   " + str(stat["eff_addr"]) + "  |  " + \
                        str(stat["commit"]) + "   |    " + str(stat["countdown"]) + \
                        "     |   " + str(stat["imm"]) + "\n"
 
         out_str += "-----------------------------------------------------------------------------\n"
         out_str += "Results Buffer: {}".format(self.result_buffer)
+        if self.write_buffer_size is not None:
+            out_str += "\nWrite Buffer: {}".format([(store["eff_addr"], store["vrt"]) for store in self.write_buffer])
         return out_str
 
 
+# =====================CIRCULAR ENTRY QUEUE====================
+class EntryRing:
+    """ Fixed-capacity queue of LSQ entries in program order. Each entry takes a free slot when it is
+        pushed, its slot (entry["slot"], its handle) never changes while the entry is queued and goes
+        back on the free list when it leaves. Slots are linked in program order, so pushing, removing
+        an entry from anywhere and stepping to the next entry are all O(1)
+    """
+    def __init__(self, capacity):
+        self.slots = [None] * capacity
+        self.next = [-1] * capacity  # slot of the next younger entry, -1 for the tail
+        self.prev = [-1] * capacity  # slot of the next older entry, -1 for the head
+        self.free = list(range(capacity - 1, -1, -1))  # free slots, the lowest on top
+        self.head = -1
+        self.tail = -1
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        slot = self.head
+        while slot != -1:
+            entry = self.slots[slot]
+            slot = self.next[slot]  # read before yielding, the caller may remove the entry
+            yield entry
+
+    def full(self):
+        return len(self.free) == 0
+
+    def push(self, entry):
+        slot = self.free.pop()
+        entry["slot"] = slot
+        self.slots[slot] = entry
+        self.prev[slot] = self.tail
+        self.next[slot] = -1
+        if self.tail == -1:
+            self.head = slot
+        else:
+            self.next[self.tail] = slot
+        self.tail = slot
+        self.count += 1
+
+    def front(self):
+        if self.head == -1:
+            return None
+        return self.slots[self.head]
+
+    def at(self, slot):
+        return self.slots[slot]
+
+    # the next queued entry behind entry, None if it is the last
+    def next_after(self, entry):
+        slot = self.next[entry["slot"]]
+        if slot == -1:
+            return None
+        return self.slots[slot]
+
+    def remove(self, entry):
+        slot = entry["slot"]
+        before, after = self.prev[slot], self.next[slot]
+        if before == -1:
+            self.head = after
+        else:
+            self.next[before] = after
+        if after == -1:
+            self.tail = before
+        else:
+            self.prev[after] = before
+        self.slots[slot] = None
+        self.free.append(slot)
+        self.count -= 1
+
+
 # =====================RULES FOR CHECKING QUEUE ENTRY STATUS====================
 # stand alone rule about commit readiness
 def commit_check(register):
@@ -282,17 +773,180 @@ def lsq_fwd_ready(entry):
     return entry["eff_addr"] is not None and entry["vrt"] is not None
 
 
-def entry_str_fwd_ready(entry):
-    return entry["op"] == "Sd" and entry["vrt"] is not None and entry["eff_addr"] is not None
+def lsq_entry_tag(entry):
+    # ROB tag of the instruction that owns the entry. A committed Sd has left the ROB, its tag may
+    #  belong to a younger instruction by now
+    if entry["op"] == "Sd":
+        return None if entry["commit"] else entry["rob_ptr"]
+    return entry["qrt"]
+
+
+# a free address generation unit
+def idle_alu():
+    return {"target":-1, "busy":False, "countdown":None}
+
+
+# entry lists kept in queue order (by "seq"), entries are matched by identity
+def insert_in_order(entries, entry):
+    i = len(entries)
+    while i > 0 and entries[i - 1]["seq"] > entry["seq"]:
+        i -= 1
+    entries.insert(i, entry)
 
 
-def entry_ld_fwd_ready(entry, ref_addr):
-    return entry["op"] == "Ld" and entry["eff_addr"] == ref_addr and entry["vrt"] is None
+def remove_entry(entries, entry):
+    for i in range(len(entries)):
+        if entries[i] is entry:
+            del entries[i]
+            return
 # =============================================================================
 
 
 
 # Memory management class
+PAGE_WORDS = 4096
+DENSE_WORDS = 1 << 16  # memories up to this many words stay a plain list
+INT_WORD, FLOAT_WORD, OBJECT_WORD = 0, 1, 2
+DUMP_MAGIC = b"TOMPAGE1"
+DUMP_PAGE = struct.Struct("<QI")  # first word index, words in the page
+
+
+class Page:
+    def __init__(self, data=None, kinds=None, objects=None):
+        self.data = bytearray(PAGE_WORDS * 8) if data is None else data
+        self.kinds = bytearray(PAGE_WORDS) if kinds is None else kinds
+        self.objects = {} if objects is None else objects  # slot -> value for OBJECT_WORD slots
+        self.ints = memoryview(self.data).cast("q")
+        self.floats = memoryview(self.data).cast("d")
+
+    def get(self, slot):
+        kind = self.kinds[slot]
+        if kind == INT_WORD:
+            return self.ints[slot]
+        if kind == FLOAT_WORD:
+            return self.floats[slot]
+        return self.objects[slot]
+
+    def set(self, slot, value):
+        self.objects.pop(slot, None)
+        if type(value) is float:
+            self.kinds[slot] = FLOAT_WORD
+            self.floats[slot] = value
+        elif type(value) is int and -(1 << 63) <= value < (1 << 63):
+            self.kinds[slot] = INT_WORD
+            self.ints[slot] = value
+        else:
+            self.kinds[slot] = OBJECT_WORD
+            self.ints[slot] = 0
+            self.objects[slot] = value
+
+    # memoryviews don't pickle (checkpoints), the bytes behind them do
+    def __reduce__(self):
+        return (Page, (bytearray(self.data), bytearray(self.kinds), dict(self.objects)))
+
+
+class PagedStore:
+    """ Sparse word array, indexed like the list it replaces
+    """
+    def __init__(self, words):
+        self.words = words
+        self.pages = {}  # page number -> Page, only pages that were written
+
+    def __len__(self):
+        return self.words
+
+    def __getitem__(self, word):
+        page = self.pages.get(word // PAGE_WORDS)
+        if page is None:
+            return 0
+        return page.get(word % PAGE_WORDS)
+
+    def __setitem__(self, word, value):
+        page = self.pages.get(word // PAGE_WORDS)
+        if page is None:
+            page = self.pages[word // PAGE_WORDS] = Page()
+        page.set(word % PAGE_WORDS, value)
+
+    # (word, value) of every non-zero word, in address order
+    def nonzero(self):
+        for number in sorted(self.pages):
+            page = self.pages[number]
+            for slot in range(PAGE_WORDS):
+                value = page.get(slot)
+                if value != 0:
+                    yield number * PAGE_WORDS + slot, value
+
+    def load_image(self, path, base=0, kind="int"):
+        """ Raw little-endian 8-byte words from path placed from word 'base' on, or a file written by dump()
+        """
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        with open(path, "rb") as image_file:
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image:
+                if image[:len(DUMP_MAGIC)] == DUMP_MAGIC:
+                    self.__load_dump__(image)
+                    return
+                if size % 8 != 0:
+                    raise ValueError("Memory image {} is {} bytes, not a whole number of 8-byte words".format(path, size))
+                word_kind = FLOAT_WORD if kind == "float" else INT_WORD
+                word, end = base, base + size // 8
+                while word < end:
+                    # one page at a time, the bytes go straight into the page
+                    number, slot = divmod(word, PAGE_WORDS)
+                    count = min(PAGE_WORDS - slot, end - word)
+                    chunk = image[(word - base) * 8:(word - base + count) * 8]
+                    if chunk.count(0) != len(chunk):
+                        self.__load_words__(number, slot, chunk, word_kind)
+                    word += count
+
+    def __load_words__(self, number, slot, chunk, kind):
+        count = len(chunk) // 8
+        page = self.pages.get(number)
+        if page is None:
+            page = self.pages[number] = Page()
+            page.data[slot * 8:(slot + count) * 8] = chunk
+            page.kinds[slot:slot + count] = bytes([kind]) * count
+            return
+        # a page the input file already wrote to keeps its words where the image holds 0
+        words = memoryview(chunk).cast("d" if kind == FLOAT_WORD else "q")
+        for i in range(count):
+            if words[i] != 0:
+                page.set(slot + i, words[i])
+
+    def __load_dump__(self, image):
+        offset = len(DUMP_MAGIC)
+        while offset < len(image):
+            first, count = DUMP_PAGE.unpack_from(image, offset)
+            offset += DUMP_PAGE.size
+            kinds = image[offset:offset + count]
+            offset += count
+            if count == PAGE_WORDS and first % PAGE_WORDS == 0 and first // PAGE_WORDS not in self.pages:
+                # dump() writes whole pages, they are taken over as they are
+                self.pages[first // PAGE_WORDS] = Page(bytearray(image[offset:offset + count * 8]), bytearray(kinds))
+                offset += count * 8
+                continue
+            words = struct.unpack_from("<{}q".format(count), image, offset)
+            floats = struct.unpack_from("<{}d".format(count), image, offset)
+            offset += count * 8
+            for i in range(count):
+                if kinds[i] == FLOAT_WORD:
+                    self[first + i] = floats[i]
+                elif words[i] != 0:
+                    self[first + i] = words[i]
+
+    def dump(self, path):
+        """ Writes the touched pages only, load_image() reads them back. Object words are written as 0
+        """
+        with open(path, "wb") as dump_file:
+            dump_file.write(DUMP_MAGIC)
+            for number in sorted(self.pages):
+                page = self.pages[number]
+                dump_file.write(DUMP_PAGE.pack(number * PAGE_WORDS, PAGE_WORDS))
+                dump_file.write(page.kinds.replace(bytes([OBJECT_WORD]), bytes([INT_WORD])))
+                dump_file.write(page.data)
+
+
 class Memory:
     def __init__(self, size_bytes, word_len=4, mem_config=None, verbose=False):
         self.mem_sz = size_bytes
@@ -309,7 +963,9 @@ class Memory:
 
     # force initialize values into the memory block
     def init_mem(self, mem_arr):
-        if mem_arr is None:
+        if mem_arr is None and self.mem_sz // self.word_len > DENSE_WORDS:
+            self.memory = PagedStore(self.mem_sz // self.word_len)
+        elif mem_arr is None:
             self.memory = [0x0] * int(self.mem_sz / self.word_len)
             if self.verbose:
                 print("[MEMRY]: Init'd clean memory. # Words: " + str(len(self.memory)))
@@ -322,6 +978,10 @@ class Memory:
                           "Size Param changed.")
             self.memory = mem_arr
 
+    # whether access() would take this address
+    def valid(self, byte_addr):
+        return byte_addr % self.word_len == 0 and 0 <= byte_addr <= self.mem_sz - 1
+
     # completely async., completes function as called, at call.
     def access(self, io, byte_addr, value):
         # VALIDITY CHECKS
@@ -337,15 +997,25 @@ class Memory:
         if io == "Ld":
             if self.verbose:
                 print("[MEMRY]: Accessed Load at EFF ADDR: " + hex(byte_addr))
-            return self.memory[int(byte_addr / self.word_len)]
+            return self.memory[byte_addr // self.word_len]
 
         elif io == "Sd":
             if self.verbose:
                 print("[MEMRY]: Storing value {} at {}", str(value), hex(byte_addr))
-            self.memory[int(byte_addr / self.word_len)] = value
+            self.memory[byte_addr // self.word_len] = value
 
         return None
 
+    # writes the touched pages (non-zero words of a list memory) to path, see PagedStore.dump()
+    def dump(self, path):
+        store = self.memory
+        if not isinstance(store, PagedStore):
+            store = PagedStore(len(self.memory))
+            for idex, value in enumerate(self.memory):
+                if value != 0:
+                    store[idex] = value
+        store.dump(path)
+
     # clears memory to zeros
     def reset(self):
         self.init_mem(None)
@@ -353,10 +1023,13 @@ class Memory:
     # prints current contents of memory
     def __str__(self):
         output = "\n\n===Current Memory Configuration===\n"
-        for idex in range(len(self.memory)):
-            if self.memory[idex] != 0:
-                addr = idex * self.word_len
-                output += "MEM[" + str(addr) + "]="+str(self.memory[idex])+"\t"
+        if isinstance(self.memory, PagedStore):
+            words = self.memory.nonzero()
+        else:
+            words = ((idex, value) for idex, value in enumerate(self.memory) if value != 0)
+        for idex, value in words:
+            addr = idex * self.word_len
+            output += "MEM[" + str(addr) + "]="+str(value)+"\t"
         output += "\n=================================\n"
         return output
 
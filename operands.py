@@ -0,0 +1,72 @@
+"""
+  Operand encoding shared by the whole pipeline
+  - Registers and ROB tags travel as small ints: operand = (number << 2) | kind
+        R3    -> (3 << 2) | INT_REG
+        F20   -> (20 << 2) | FP_REG
+        ROB12 -> (12 << 2) | ROB_TAG    (ROB tags are numbered from 1, slot = number - 1)
+        BTB   -> BTB_DEST               (branch results are addressed to the BTB)
+        BTB2  -> (2 << 2) | SPECIAL     (outstanding branch 2 when branches speculate)
+  - Classifying an operand is a mask: (operand & KIND_MASK) == ROB_TAG
+  - Names only come back out through operand_name() when something gets printed
+"""
+
+INT_REG = 0
+FP_REG = 1
+ROB_TAG = 2
+SPECIAL = 3
+KIND_MASK = 3
+KIND_BITS = 2
+
+BTB_DEST = SPECIAL  # number 0 of the special kind
+R0 = INT_REG        # hard-wired zero register
+KIND_PREFIX = {INT_REG:"R", FP_REG:"F", ROB_TAG:"ROB"}
+
+
+def encode_operand(name):
+    """ "R3"/"F20"/"ROB12"/"BTB" -> operand int
+    """
+    if name.startswith("ROB"):
+        return (int(name[3:]) << KIND_BITS) | ROB_TAG
+    elif name == "BTB":
+        return BTB_DEST
+    elif name.startswith("BTB"):
+        return branch_tag(int(name[3:]))
+    elif name[0] == "R":
+        return (int(name[1:]) << KIND_BITS) | INT_REG
+    elif name[0] == "F":
+        return (int(name[1:]) << KIND_BITS) | FP_REG
+    raise ValueError("Not a register or ROB tag: {}".format(name))
+
+
+def operand_name(operand):
+    """ operand int -> "R3"/"F20"/"ROB12"/"BTB". None and non-operands pass through
+    """
+    if type(operand) is not int:
+        return operand
+    if operand == BTB_DEST:
+        return "BTB"
+    if operand & KIND_MASK == SPECIAL:
+        return "BTB" + str(operand >> KIND_BITS)
+    return KIND_PREFIX[operand & KIND_MASK] + str(operand >> KIND_BITS)
+
+
+def rob_tag(number):
+    """ Tag of the ROB entry named ROB<number>, stored in slot number - 1
+    """
+    return (number << KIND_BITS) | ROB_TAG
+
+
+def rob_slot(tag):
+    return (tag >> KIND_BITS) - 1
+
+
+def branch_tag(slot):
+    """ Result tag of the branch held in BTB checkpoint slot 'slot', slot 0 is plain BTB_DEST
+    """
+    return (slot << KIND_BITS) | SPECIAL
+
+
+def named(operand_dict):
+    """ Copy of a dict keyed by operands with the keys turned back into names
+    """
+    return {operand_name(key):value for key, value in operand_dict.items()}
@@ -0,0 +1,240 @@
+"""
+  Offline branch predictor evaluation
+  - Replays a branch trace written by processor.py --branch-trace=path through many predictor
+    configurations at once and reports the mispredict rate of each, without a timing simulation
+  - Configurations of one kind share stacked NumPy tables (one row per configuration), so every
+    trace record updates all of them with a handful of array operations
+  - Same predictors, indexing and target cache rule as predictors.py, so the counts match what
+    the BTB reports when each branch resolves before the next is predicted (--spec=0 or 1).
+    With more branches in flight the BTB predicts from older history and may differ slightly
+  - Needs NumPy, the simulator itself does not
+
+  Usage: python predictor_eval.py --trace branches.bin --predictor "gshare entries=1024 history=10"
+                                  [--predictor ...] [--grid gshare entries=64,256,1024 history=4-12:4 btb=16,64]
+                                  [--out=file.csv|file.json]
+"""
+import csv
+import itertools
+import json
+import sys
+import numpy as np
+from predictors import BRANCH_RECORD, WEAKLY_NOT_TAKEN, COUNTER_MAX, parse_predictor
+from sweep import parse_values
+
+TRACE_DTYPE = np.dtype([("pc", "<u4"), ("taken", "u1"), ("target", "<u4")])
+DEFAULTS = {"onebit":{"entries":8}, "bimodal":{"entries":1024}, "gshare":{"entries":1024, "history":10},
+            "local":{"entries":1024, "history":10}, "tournament":{"entries":1024, "history":10}}
+
+assert TRACE_DTYPE.itemsize == BRANCH_RECORD.size
+
+
+def load_trace(path):
+    return np.fromfile(path, dtype=TRACE_DTYPE)
+
+
+def counters_update(counters, taken):
+    # taken is a bool per row
+    return np.where(taken, np.minimum(counters + 1, COUNTER_MAX), np.maximum(counters - 1, 0))
+
+
+class OneBitTables:
+    def __init__(self, configs):
+        self.entries = np.array([config["entries"] for config in configs], dtype=np.int64)
+        self.rows = np.arange(len(configs))
+        self.table = np.zeros((len(configs), self.entries.max()), dtype=bool)
+
+    def index(self, pc):
+        return pc % self.entries
+
+    def predict(self, pc):
+        return self.table[self.rows, self.index(pc)]
+
+    def update(self, pc, taken):
+        self.table[self.rows, self.index(pc)] = taken
+
+
+class BimodalTables:
+    def __init__(self, configs):
+        self.entries = np.array([config["entries"] for config in configs], dtype=np.int64)
+        self.rows = np.arange(len(configs))
+        self.table = np.full((len(configs), self.entries.max()), WEAKLY_NOT_TAKEN, dtype=np.int8)
+
+    def index(self, pc):
+        return (pc >> 2) % self.entries
+
+    def predict(self, pc):
+        return self.table[self.rows, self.index(pc)] > WEAKLY_NOT_TAKEN
+
+    def update(self, pc, taken):
+        i = self.index(pc)
+        self.table[self.rows, i] = counters_update(self.table[self.rows, i], taken)
+
+
+class GShareTables(BimodalTables):
+    def __init__(self, configs):
+        super().__init__(configs)
+        self.history_mask = np.array([(1 << config["history"]) - 1 for config in configs], dtype=np.int64)
+        self.history = np.zeros(len(configs), dtype=np.int64)
+
+    def index(self, pc):
+        return ((pc >> 2) ^ self.history) % self.entries
+
+    def update(self, pc, taken):
+        super().update(pc, taken)
+        self.history = ((self.history << 1) | taken) & self.history_mask
+
+
+class LocalTables:
+    def __init__(self, configs):
+        self.entries = np.array([config["entries"] for config in configs], dtype=np.int64)
+        self.history_mask = np.array([(1 << config["history"]) - 1 for config in configs], dtype=np.int64)
+        self.rows = np.arange(len(configs))
+        self.histories = np.zeros((len(configs), self.entries.max()), dtype=np.int64)
+        self.table = np.full((len(configs), int(self.history_mask.max()) + 1), WEAKLY_NOT_TAKEN, dtype=np.int8)
+
+    def index(self, pc):
+        return self.histories[self.rows, (pc >> 2) % self.entries]
+
+    def predict(self, pc):
+        return self.table[self.rows, self.index(pc)] > WEAKLY_NOT_TAKEN
+
+    def update(self, pc, taken):
+        i = self.index(pc)
+        self.table[self.rows, i] = counters_update(self.table[self.rows, i], taken)
+        h = (pc >> 2) % self.entries
+        self.histories[self.rows, h] = ((self.histories[self.rows, h] << 1) | taken) & self.history_mask
+
+
+class TournamentTables:
+    def __init__(self, configs):
+        self.entries = np.array([config["entries"] for config in configs], dtype=np.int64)
+        self.rows = np.arange(len(configs))
+        self.global_tables = GShareTables(configs)
+        self.local_tables = LocalTables(configs)
+        self.choosers = np.full((len(configs), self.entries.max()), WEAKLY_NOT_TAKEN, dtype=np.int8)
+
+    def predict(self, pc):
+        use_global = self.choosers[self.rows, (pc >> 2) % self.entries] > WEAKLY_NOT_TAKEN
+        return np.where(use_global, self.global_tables.predict(pc), self.local_tables.predict(pc))
+
+    def update(self, pc, taken):
+        global_right = self.global_tables.predict(pc) == taken
+        local_right = self.local_tables.predict(pc) == taken
+        i = (pc >> 2) % self.entries
+        moved = counters_update(self.choosers[self.rows, i], global_right)
+        self.choosers[self.rows, i] = np.where(global_right != local_right, moved, self.choosers[self.rows, i])
+        self.global_tables.update(pc, taken)
+        self.local_tables.update(pc, taken)
+
+
+class TargetCaches:
+    """ Rows without a target cache (btb=0) always hit
+    """
+    def __init__(self, configs):
+        self.entries = np.array([max(config.get("btb", 0), 1) for config in configs], dtype=np.int64)
+        self.enabled = np.array(["btb" in config for config in configs])
+        self.rows = np.arange(len(configs))
+        self.pcs = np.full((len(configs), self.entries.max()), -1, dtype=np.int64)
+
+    def hit(self, pc):
+        return ~self.enabled | (self.pcs[self.rows, (pc >> 2) % self.entries] == pc)
+
+    def insert(self, pc):
+        self.pcs[self.rows, (pc >> 2) % self.entries] = pc
+
+
+TABLES = {"onebit":OneBitTables, "bimodal":BimodalTables, "gshare":GShareTables,
+          "local":LocalTables, "tournament":TournamentTables}
+
+
+def evaluate(trace, configs):
+    """ Mispredict count per config (in configs order) for a trace from load_trace()
+    """
+    mispredicts = np.zeros(len(configs), dtype=np.int64)
+    for kind, tables_cls in TABLES.items():
+        members = [i for i, config in enumerate(configs) if config["kind"] == kind]
+        if len(members) == 0:
+            continue
+        group = [dict(DEFAULTS[kind], **configs[i]) for i in members]
+        tables = tables_cls(group)
+        targets = TargetCaches(group)
+        missed = np.zeros(len(group), dtype=np.int64)
+        for pc, taken in zip(trace["pc"].astype(np.int64).tolist(), trace["taken"].astype(bool).tolist()):
+            prediction = tables.predict(pc) & targets.hit(pc)
+            missed += prediction != taken
+            tables.update(pc, taken)
+            if taken:
+                targets.insert(pc)
+        mispredicts[members] = missed
+    return mispredicts
+
+
+def config_name(config):
+    return " ".join([config["kind"]] + ["{}={}".format(name, config[name]) for name in ["entries", "history", "btb"]
+                                        if name in config])
+
+
+def grid(kind, settings):
+    """ "gshare", ["entries=64,256", "history=4-8:4"] -> one config per combination
+    """
+    names = []
+    values = []
+    for setting in settings:
+        name, spec = setting.split("=", 1)
+        names.append(name)
+        values.append(parse_values(spec))
+    return [parse_predictor(" ".join([kind] + ["{}={}".format(n, v) for n, v in zip(names, point)]))
+            for point in itertools.product(*values)]
+
+
+def write_results(rows, out_file, fmt):
+    if fmt == "json":
+        json.dump(rows, out_file, indent=1)
+        out_file.write("\n")
+        return
+    writer = csv.DictWriter(out_file, fieldnames=["predictor", "branches", "mispredicts", "rate"])
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "--trace":
+        print("Usage: python predictor_eval.py --trace <branch trace> [--predictor SPEC ...] [--grid KIND name=values ...] [--out=path] [--json]")
+        print("SPEC is a predictor line as in the input file, e.g. \"gshare entries=1024 history=10 btb=64\"")
+        print("--grid KIND name=values... adds every combination, values as in sweep.py (1,2,4 or 4-12:2)")
+    else:
+        configs = []
+        out_path = None
+        fmt = "csv"
+        i = 3
+        while i < len(sys.argv):
+            if sys.argv[i] == "--predictor":
+                i += 1
+                configs.append(parse_predictor(sys.argv[i]))
+            elif sys.argv[i] == "--grid":
+                settings = []
+                kind = sys.argv[i + 1]
+                i += 2
+                while i < len(sys.argv) and not sys.argv[i].startswith("--"):
+                    settings.append(sys.argv[i])
+                    i += 1
+                configs += grid(kind, settings)
+                continue
+            elif "--out" in sys.argv[i]:
+                out_path = sys.argv[i].split("=", 1)[1]
+                if out_path.endswith(".json"):
+                    fmt = "json"
+            elif sys.argv[i] == "--json":
+                fmt = "json"
+            i += 1
+
+        trace = load_trace(sys.argv[2])
+        mispredicts = evaluate(trace, configs)
+        rows = [{"predictor":config_name(config), "branches":len(trace), "mispredicts":int(missed),
+                 "rate":round(int(missed) / len(trace), 6) if len(trace) > 0 else 0.0}
+                for config, missed in zip(configs, mispredicts)]
+        if out_path is None:
+            write_results(rows, sys.stdout, fmt)
+        else:
+            with open(out_path, "w", newline="") as out_file:
+                write_results(rows, out_file, fmt)
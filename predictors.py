@@ -0,0 +1,292 @@
+"""
+  Branch direction predictors and the branch target cache used by the BTB
+  - Every predictor has predict(pc) -> taken and update(pc, taken), update is called once per
+    resolved branch with its actual outcome
+  - index(pc) and rows() expose the table for printing, rows() yields (entry, state)
+  - OneBitPredictor(8) is the original 8-entry table indexed by pc % 8 that flips on a mispredict
+  - Counter tables hold 2-bit saturating counters: 0,1 predict not taken, 2,3 predict taken
+  - Histories are updated when a branch resolves, so a prediction made while older branches are
+    still in flight sees the history of the resolved ones only
+
+  Selected from the input file by an optional header line (on one of the blank lines of the header):
+    Branch predictor = gshare entries=1024 history=10 btb=64
+  kinds: onebit, bimodal, gshare, local, tournament. btb=# adds a target cache of # entries
+
+  Branch traces: the BTB can record every resolved branch as a packed little-endian
+  (uint32 pc, uint8 taken, uint32 taken target) record, in program order, see predictor_eval.py
+
+  Memory dependence predictors decide whether a Ld may start before an older Sd knows its address
+  (the LSQ replays the Ld when it guessed wrong), selected by a header line like
+    Load speculation = store-sets entries=1024
+  kinds: store-sets, blind (never waits)
+"""
+import struct
+
+WEAKLY_NOT_TAKEN = 1
+COUNTER_MAX = 3
+
+
+def counter_taken(counter):
+    return counter > WEAKLY_NOT_TAKEN
+
+
+def counter_update(counter, taken):
+    if taken:
+        return min(counter + 1, COUNTER_MAX)
+    return max(counter - 1, 0)
+
+
+class OneBitPredictor:
+    """ Last outcome per entry, indexed by pc % entries
+    """
+    def __init__(self, entries=8):
+        self.entries = entries
+        self.table = [False] * entries
+
+    def index(self, pc):
+        return pc % self.entries
+
+    def predict(self, pc):
+        return self.table[self.index(pc)]
+
+    def update(self, pc, taken):
+        self.table[self.index(pc)] = taken
+
+    def rows(self):
+        return enumerate(self.table)
+
+
+class BimodalPredictor:
+    """ One 2-bit counter per entry, indexed by the word address of the branch
+    """
+    def __init__(self, entries=1024):
+        self.entries = entries
+        self.table = [WEAKLY_NOT_TAKEN] * entries
+
+    def index(self, pc):
+        return (pc >> 2) % self.entries
+
+    def predict(self, pc):
+        return counter_taken(self.table[self.index(pc)])
+
+    def update(self, pc, taken):
+        i = self.index(pc)
+        self.table[i] = counter_update(self.table[i], taken)
+
+    def rows(self):
+        return enumerate(self.table)
+
+
+class GSharePredictor:
+    """ 2-bit counters indexed by the branch address xor the last 'history' global outcomes
+    """
+    def __init__(self, entries=1024, history=10):
+        self.entries = entries
+        self.history_mask = (1 << history) - 1
+        self.history = 0
+        self.table = [WEAKLY_NOT_TAKEN] * entries
+
+    def index(self, pc):
+        return ((pc >> 2) ^ self.history) % self.entries
+
+    def predict(self, pc):
+        return counter_taken(self.table[self.index(pc)])
+
+    def update(self, pc, taken):
+        i = self.index(pc)
+        self.table[i] = counter_update(self.table[i], taken)
+        self.history = ((self.history << 1) | taken) & self.history_mask
+
+    def rows(self):
+        return enumerate(self.table)
+
+
+class LocalPredictor:
+    """ Per-branch histories ('entries' of them, indexed by branch address) of 'history' outcomes
+        each, the history picks one of 2^history shared 2-bit counters
+    """
+    def __init__(self, entries=1024, history=10):
+        self.entries = entries
+        self.history_mask = (1 << history) - 1
+        self.histories = [0] * entries
+        self.table = [WEAKLY_NOT_TAKEN] * (1 << history)
+
+    def index(self, pc):
+        return self.histories[(pc >> 2) % self.entries]
+
+    def predict(self, pc):
+        return counter_taken(self.table[self.index(pc)])
+
+    def update(self, pc, taken):
+        i = self.index(pc)
+        self.table[i] = counter_update(self.table[i], taken)
+        h = (pc >> 2) % self.entries
+        self.histories[h] = ((self.histories[h] << 1) | taken) & self.history_mask
+
+    def rows(self):
+        return enumerate(self.table)
+
+
+class TournamentPredictor:
+    """ gshare and local predictors with a table of 2-bit choosers indexed by branch address,
+        a chooser moves towards gshare (up) or local (down) when only one of them was right
+    """
+    def __init__(self, entries=1024, history=10):
+        self.entries = entries
+        self.global_predictor = GSharePredictor(entries, history)
+        self.local_predictor = LocalPredictor(entries, history)
+        self.choosers = [WEAKLY_NOT_TAKEN] * entries
+
+    def index(self, pc):
+        return (pc >> 2) % self.entries
+
+    def predict(self, pc):
+        if counter_taken(self.choosers[self.index(pc)]):
+            return self.global_predictor.predict(pc)
+        return self.local_predictor.predict(pc)
+
+    def update(self, pc, taken):
+        global_right = self.global_predictor.predict(pc) == taken
+        local_right = self.local_predictor.predict(pc) == taken
+        if global_right != local_right:
+            i = self.index(pc)
+            self.choosers[i] = counter_update(self.choosers[i], global_right)
+        self.global_predictor.update(pc, taken)
+        self.local_predictor.update(pc, taken)
+
+    def rows(self):
+        return enumerate(self.choosers)
+
+
+class TargetCache:
+    """ Direct-mapped cache of taken-branch targets. A taken prediction can only redirect fetch
+        when the branch hits here, a miss falls through to pc + 4
+    """
+    def __init__(self, entries=64):
+        self.entries = entries
+        self.pcs = [None] * entries
+        self.targets = [None] * entries
+
+    def lookup(self, pc):
+        i = (pc >> 2) % self.entries
+        if self.pcs[i] == pc:
+            return self.targets[i]
+        return None
+
+    def insert(self, pc, target):
+        i = (pc >> 2) % self.entries
+        self.pcs[i] = pc
+        self.targets[i] = target
+
+
+PREDICTORS = {"onebit":OneBitPredictor, "bimodal":BimodalPredictor, "gshare":GSharePredictor,
+              "local":LocalPredictor, "tournament":TournamentPredictor}
+
+
+def parse_predictor(spec):
+    """ "gshare entries=1024 history=10 btb=64" -> {"kind":"gshare", "entries":1024, "history":10, "btb":64}
+    """
+    fields = spec.split()
+    config = {"kind":fields[0].lower()}
+    if config["kind"] not in PREDICTORS:
+        raise ValueError("Unknown branch predictor: {}".format(fields[0]))
+    for field in fields[1:]:
+        name, value = field.split("=")
+        if name not in ["entries", "history", "btb"]:
+            raise ValueError("Unknown branch predictor setting: {}".format(name))
+        config[name] = int(value)
+    return config
+
+
+def make_predictor(config=None):
+    """ (direction predictor, target cache or None) for a config from parse_predictor().
+        None gives the original 8-entry one-bit table without a target cache
+    """
+    if config is None:
+        return OneBitPredictor(), None
+    settings = {name:value for name, value in config.items() if name in ["entries", "history"]}
+    if config["kind"] in ["onebit", "bimodal"]:
+        settings.pop("history", None)
+    target_cache = TargetCache(config["btb"]) if "btb" in config else None
+    return PREDICTORS[config["kind"]](**settings), target_cache
+
+
+class StoreSetPredictor:
+    """ Store sets: a table indexed by the word address of a Ld or Sd holds its store set id (-1 = none).
+        A Ld waits for the older Sd of its own set whose address is unknown and passes all others.
+        A violation puts the Ld and the Sd it passed in one set, the smaller id when both had one
+    """
+    def __init__(self, entries=1024):
+        self.entries = entries
+        self.table = [-1] * entries
+        self.next_id = 0
+
+    def index(self, pc):
+        return (pc >> 2) % self.entries
+
+    def depends(self, load_pc, store_pc):
+        store_set = self.table[self.index(load_pc)]
+        return store_set != -1 and store_set == self.table[self.index(store_pc)]
+
+    def violation(self, load_pc, store_pc):
+        load_i, store_i = self.index(load_pc), self.index(store_pc)
+        load_set, store_set = self.table[load_i], self.table[store_i]
+        if load_set == -1 and store_set == -1:
+            load_set = store_set = self.next_id
+            self.next_id += 1
+        elif load_set == -1 or store_set == -1:
+            load_set = store_set = max(load_set, store_set)
+        else:
+            load_set = store_set = min(load_set, store_set)
+        self.table[load_i] = load_set
+        self.table[store_i] = store_set
+
+
+class BlindPredictor:
+    """ Every Ld passes every Sd with an unknown address, violations teach it nothing
+    """
+    def depends(self, load_pc, store_pc):
+        return False
+
+    def violation(self, load_pc, store_pc):
+        return
+
+
+DEPENDENCE_PREDICTORS = {"store-sets":StoreSetPredictor, "blind":BlindPredictor}
+
+
+def parse_dependence(spec):
+    """ "store-sets entries=1024" -> {"kind":"store-sets", "entries":1024}
+    """
+    fields = spec.split()
+    config = {"kind":fields[0].lower()}
+    if config["kind"] not in DEPENDENCE_PREDICTORS:
+        raise ValueError("Unknown memory dependence predictor: {}".format(fields[0]))
+    for field in fields[1:]:
+        name, value = field.split("=")
+        if name != "entries" or config["kind"] != "store-sets":
+            raise ValueError("Unknown {} setting: {}".format(config["kind"], name))
+        config[name] = int(value)
+    return config
+
+
+def make_dependence(config):
+    """ Memory dependence predictor for a config from parse_dependence()
+    """
+    settings = {name:value for name, value in config.items() if name != "kind"}
+    return DEPENDENCE_PREDICTORS[config["kind"]](**settings)
+
+
+BRANCH_RECORD = struct.Struct("<IBI")
+
+
+def pack_branch(pc, taken, target):
+    return BRANCH_RECORD.pack(pc, taken, target)
+
+
+def read_branch_trace(path):
+    """ List of (pc, taken, target) from a trace written by the BTB
+    """
+    with open(path, "rb") as trace_file:
+        data = trace_file.read()
+    return [(pc, bool(taken), target) for pc, taken, target in BRANCH_RECORD.iter_unpack(data)]
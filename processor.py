@@ -1,36 +1,75 @@
 # Main driver and heartbeat code
+import gzip
+import os
+import pickle
 import sys
+import tracing
 from RAT import RegisterAliasTable
+from cache import make_caches
 from cdb import CommonDataBus
 from functional_units import *
 from memory import *
-from reading_input import input_parser
+from predictors import make_dependence
+from program import load_program
+from reading_input import parse_ports
 from time_table import TimingTable
 
 
 
 class Processor:
-    def __init__(self, config_file, verbose=False, pipe_cd=10):
+    def __init__(self, config_file, verbose=False, pipe_cd=10, fast_forward=False, program_cache=None, program=None,
+                 max_branches=0, branch_trace=None, mem_dump=None):
 
-        # Parse input from the configuration file
+        # Parse input from the configuration file, program_cache is a directory for decoded programs.
+        #  program can hand in an already loaded (config, program) pair from load_program()
         self.output_trgt = config_file
-        initr = input_parser(config_file)
+        if program is None:
+            program = load_program(config_file, cache_dir=program_cache)
+        initr, program = program
 
         # meta data
         self.cycle_count = 0
         self.end_cycle = 0
         self.pipe_cd = pipe_cd
         self.verbose = verbose
+        self.fast_forward = fast_forward  # jump over cycles where units only count down
+        self.skipped_cycles = 0
+        self.committed_count = 0
+        self.finished = False
 
         # Initialize components
         self.tracker = TimingTable(self.cycle_count)
-        self.instr_buf = InstructionBuffer(config_file)
+        self.instr_buf = InstructionBuffer(config_file, program=program)
         self.reg_alias_tbl = RegisterAliasTable(register_qty=16)
         self.reorder_buf = ROB(int(initr.ROBe), 16, 16) # Number of INT ARF and FP ARF currently hardcoded
         self.reorder_buf.register_arfs(initr.ARFI, initr.ARFF)
 
-        # Register all functional units
-        self.func_units = [LoadStoreQueue(256, initr.LSU["nrg"], initr.LSU["cim"], initr.LSU["cie"], self.reorder_buf, initr.CBDe, wl=1, config=initr.memory)]
+        # Register all functional units. Memory is the 256 words from the input file unless the
+        #  header gives a memory size, then it's sparse and may start from a binary image
+        mem_size, memory = 256, initr.memory
+        if initr.mem_size is not None:
+            mem_size, memory = initr.mem_size, PagedStore(initr.mem_size)
+            for addr, value in initr.memory.items():
+                memory[addr] = value
+            if initr.mem_image is not None:
+                image = initr.mem_image
+                memory.load_image(os.path.join(os.path.dirname(config_file), image["path"]), image["base"], image["kind"])
+        self.func_units = [LoadStoreQueue(mem_size, initr.LSU["nrg"], initr.LSU["cim"], initr.LSU["cie"], self.reorder_buf, initr.CBDe, wl=1, config=memory)]
+        # L1/L2 caches from the header make the memory latency vary per access ("Cycles in Mem" is then a miss to memory)
+        self.func_units[0].caches = make_caches({"L1":initr.l1_cache, "L2":initr.l2_cache}, int(initr.LSU["cim"]))
+        # Memory ports from the header let several accesses be in flight, the load/store unit's
+        #  # of FUs then counts its address generation units. Miss registers make them non-blocking,
+        #  a memory dependence predictor lets loads start before older store addresses are known and
+        #  a write buffer drains committed stores on the ports the loads leave free
+        if initr.mem_ports is not None or initr.mshrs is not None or initr.load_speculation is not None \
+                or initr.write_buffer is not None:
+            lsq, ports = self.func_units[0], initr.mem_ports or parse_ports("1")
+            lsq.ports, lsq.banks, lsq.interleave = ports["ports"], ports["banks"], ports["interleave"]
+            lsq.mem_alus = [idle_alu() for _ in range(ports["agus"] or int(initr.LSU["nfu"]))]
+            lsq.mshrs = initr.mshrs
+            lsq.write_buffer_size = initr.write_buffer
+            if initr.load_speculation is not None:
+                lsq.dependence = make_dependence(initr.load_speculation)
 
         # Initialize and register multiple FUs
         int_adders = {}
@@ -46,18 +85,31 @@ class Processor:
             fp_mults[i] = FPMultiplier(int(initr.FPM["nrg"]), int(initr.FPM["cie"]), i, self.reorder_buf)
             self.func_units.append(fp_mults[i])
 
-        # Initialize BTB
-        # TODO: Pass a list of all IntAdders, FPAdders, FPMultipliers
+        # Units named on the input file's initiation interval line execute pipelined
+        for kind, row, units in [("INT", initr.intA, int_adders), ("FPA", initr.FPA, fp_adders), ("FPM", initr.FPM, fp_mults)]:
+            if kind in initr.intervals:
+                for unit in units.values():
+                    unit.initiation_interval = initr.intervals[kind] or int(row["cie"])
+
+        # Initialize BTB, max_branches > 0 lets fetch run past that many unresolved branches.
+        #  The branch predictor comes from the input file (the original 1-bit table if it names none)
         self.brnch_trnsl_buf = BTB(self.reorder_buf, self.reg_alias_tbl,
-                                   int_adders, fp_adders, fp_mults)
+                                   int_adders, fp_adders, fp_mults, max_branches=max_branches,
+                                   predictor=initr.predictor)
+        if initr.load_speculation is not None:
+            self.reorder_buf.idle_when_empty = True  # replays flush the ROB like mispredicts, see ROB
 
-        # Specify which units subscribe to the CDB
+        # Specify which units subscribe to the CDB. Reservation stations don't,
+        #  they register the tags they wait on with the bus wakeup index instead
         cdb_subs = [self.brnch_trnsl_buf, self.reorder_buf]
-        for opr in self.func_units:
-            cdb_subs.append(opr)
 
-        # Initialize the CDB
-        self.CDB = CommonDataBus(self.func_units, cdb_subs)
+        # Initialize the CDB, one bus and first come first served unless the input file says otherwise
+        self.CDB = CommonDataBus(self.func_units, cdb_subs, buses=int(initr.cdb_buses),
+                                 policy=initr.cdb_policy, rob=self.reorder_buf)
+        for opr in self.func_units:
+            opr.wakeup_index = self.CDB.wakeup_index
+            if opr is not self.func_units[0]:
+                opr.result_capacity = initr.result_entries  # the LSQ is bounded by the CDB entries already
 
         # finish references to all components still needing it.
         # ==========REGISTER ALIAS TABLE============
@@ -71,28 +123,61 @@ class Processor:
         self.reg_alias_tbl.num_int_adders = int(initr.intA["nfu"])
         self.reg_alias_tbl.num_fp_adders = int(initr.FPA["nfu"])
         self.reg_alias_tbl.num_fp_mults = int(initr.FPM["nfu"])
+        self.reg_alias_tbl.issue_width = int(initr.issue_width)
 
         # ========== REORDER BUFFER =============
         self.reorder_buf.RAT = self.reg_alias_tbl
         self.reorder_buf.LSQ = self.func_units[0]
 
+        # ========== BRANCH TRANSLATION BUFFER =============
+        self.brnch_trnsl_buf.lsq = self.func_units[0]
+        self.brnch_trnsl_buf.cdb = self.CDB
+        self.brnch_trnsl_buf.tracker = self.tracker
+        # branch_trace is a path the resolved branch outcomes are written to when the run finishes
+        self.branch_trace = branch_trace
+        if branch_trace is not None:
+            self.brnch_trnsl_buf.outcome_trace = bytearray()
+        self.mem_dump = mem_dump  # path the touched memory pages are written to when the run finishes
+
         if verbose:
             print("[PROC] Processor fully init'd")
 
 
-    def run_code(self, bp=False):
+    def run_code(self, bp=False, write_output=True, stop_at=None, checkpoint_file=None, checkpoint_every=None):
+        """ Runs the heartbeat until the program drains, or returns early once cycle stop_at is reached
+            (the run can be continued by calling run_code again, e.g. on a restored checkpoint).
+            With checkpoint_file and checkpoint_every, a checkpoint is rewritten every checkpoint_every cycles
+        """
         # run the heartbeat loop
         if self.verbose:
             print(self.instr_buf)
 
-        while(self.__continue__(self.pipe_cd)):
+        next_checkpoint = None
+        if checkpoint_file is not None and checkpoint_every:
+            next_checkpoint = self.cycle_count + checkpoint_every
+        while True:
+            if stop_at is not None and self.cycle_count >= stop_at:
+                return
+            if next_checkpoint is not None and self.cycle_count >= next_checkpoint:
+                self.save_checkpoint(checkpoint_file)
+                next_checkpoint = self.cycle_count + checkpoint_every
+            if not self.__continue__(self.pipe_cd):
+                break
+
+            # IDLE CYCLE FAST-FORWARD
+            if self.fast_forward and not bp:
+                self.__skip_idle__(stop_at)
+
             # TIME TABLE PREP
             self.cycle_count += 1
             self.tracker.current_cyc = self.cycle_count
+            tracing.tracer.cycle = self.cycle_count
 
             # FETCH/DECODE/ISSUE
             self.reg_alias_tbl.tick(self.tracker)
+            resolved = self.brnch_trnsl_buf.predicted
             self.brnch_trnsl_buf.tick(self.tracker)
+            self.committed_count += self.brnch_trnsl_buf.predicted - resolved  # branches commit in the BTB
 
             # EXECUTE
             for unit in self.func_units:
@@ -107,10 +192,13 @@ class Processor:
 
             # WRITE BACK
             self.CDB.tick(self.tracker)
-            print(self.CDB)
+            if self.verbose:
+                print(self.CDB)
 
             # COMMIT
             committed_instruction = self.reorder_buf.tick(self.tracker)
+            if committed_instruction is not None:
+                self.committed_count += 1
             if self.verbose:
                 print(self.reorder_buf)
 
@@ -124,12 +212,25 @@ class Processor:
                 print("===============================================================================================================================")
                 input("Break Pointing... Press Enter to step\n\n")
 
+        self.finished = True
+        if self.branch_trace is not None:
+            with open(self.branch_trace, "wb") as trace_file:
+                trace_file.write(self.brnch_trnsl_buf.outcome_trace)
+        if self.mem_dump is not None:
+            self.func_units[0].mem_unit.dump(self.mem_dump)
         if self.verbose:
             print("Exiting...")
+        if not write_output:
+            return
         output_str = self.tracker.file_str()
         output_str += "\n\n===Register Values===\n"
-        output_str += str(self.reorder_buf.int_arf)+"\n"+str(self.reorder_buf.fp_arf)
+        output_str += str(named(self.reorder_buf.int_arf))+"\n"+str(named(self.reorder_buf.fp_arf))
         output_str += str(self.reg_alias_tbl.func_units["LSQ"].mem_unit)
+        if self.func_units[0].caches is not None:
+            output_str += str(self.func_units[0].caches)
+        if self.func_units[0].ports is not None:
+            output_str += "\n===Memory Port Counters===\n" + ", ".join(
+                "{} {}".format(count, name.replace("_", " ")) for name, count in self.func_units[0].port_counters().items()) + "\n"
         file_nm = self.output_trgt.split(".")
 
         with open((file_nm[0]+"_output.txt"), "w") as out_file:
@@ -138,28 +239,117 @@ class Processor:
             out_file.close()
 
 
+    def save_checkpoint(self, path):
+        """ Writes the complete processor state (ROB, RAT, every unit, LSQ and memory, BTB, CDB,
+            timing table and cycle counters) to a gzipped pickle at path
+        """
+        with gzip.open(path, "wb") as ckpt_file:
+            pickle.dump(self, ckpt_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+    @staticmethod
+    def load_checkpoint(path):
+        """ Restores a processor saved by save_checkpoint, run_code() continues where it stopped
+        """
+        with gzip.open(path, "rb") as ckpt_file:
+            proc = pickle.load(ckpt_file)
+        tracing.tracer.cycle = proc.cycle_count
+        return proc
+
+
+    def stats(self):
+        """ Summary of a finished run. cycles is the cycle the last instruction committed,
+            without the flush window
+        """
+        cycles = self.end_cycle
+        caches = self.func_units[0].caches
+        return {"cycles":cycles,
+                "instructions":self.committed_count,
+                "ipc":self.committed_count / cycles if cycles > 0 else 0.0,
+                "branches":self.brnch_trnsl_buf.predicted,
+                "mispredicts":self.brnch_trnsl_buf.mispredicted,
+                "stalls":dict(self.reg_alias_tbl.stall_counts),
+                "caches":caches.counters() if caches is not None else {},
+                "memory_ports":self.func_units[0].port_counters() if self.func_units[0].ports is not None else {}}
+
+
+    # every component, in the order the heartbeat ticks them
+    def __components__(self):
+        return [self.reg_alias_tbl, self.brnch_trnsl_buf] + self.func_units + \
+               [self.CDB, self.reorder_buf]
+
+
+    def __skip_idle__(self, stop_at=None):
+        # never skip into the end-of-program flush window, it is counted in cycles
+        if self.__drained__():
+            return
+        idle = min(comp.idle_cycles() for comp in self.__components__())
+        if stop_at is not None:
+            idle = min(idle, stop_at - self.cycle_count)
+        if idle <= 0 or idle == IDLE_FOREVER:
+            return
+
+        for comp in self.__components__():
+            comp.fast_forward(idle)
+        self.cycle_count += idle
+        self.skipped_cycles += idle
+        if self.verbose:
+            print("[PROC] Fast-forwarded {} idle cycles to cycle {}".format(idle, self.cycle_count))
+
+
+    # program ran off its end and everything in flight is done. Branches still
+    #  unresolved mean the end may have been reached down a wrong path
+    def __drained__(self):
+        return self.reorder_buf.rob_empty and self.instr_buf.out_of_bounds_hit and \
+               len(self.brnch_trnsl_buf.branches) == 0
+
+
     def __continue__(self, flush_cycs):
-        trigger = self.reorder_buf.rob_empty and self.instr_buf.out_of_bounds_hit
+        trigger = self.__drained__()
         flush = False
         if self.end_cycle == 0 and trigger:
             self.end_cycle = self.cycle_count
         else:
             flush = self.cycle_count >= (self.end_cycle + flush_cycs)
         #print("[CONTINUE] rob:" + str(self.reorder_buf.rob_empty) + " i_buf:"+str(self.instr_buf.out_of_bounds_hit)+ " end:"+str(self.end_cycle)+ "cyc:"+str(self.cycle_count) + " flush:"+ str(flush))
-        return not (trigger and flush)
+        # committed stores still on their way to memory (a cache miss can outlast the flush window) hold the end
+        lsq = self.func_units[0]
+        stores_done = lsq.num_stats_free == lsq.queue_sz and len(lsq.write_buffer) == 0
+        return not (trigger and flush and stores_done)
 
 
 
 if __name__ == "__main__":
     # decode command line args
-    if len(sys.argv) < 3 or len(sys.argv) > 5:
-        print("Usage: python processor.py --input <filename> [--bp] [--clr=#]")
-        print("--input <filename> is required, --bp/--clr are optional")
+    if len(sys.argv) < 3 or sys.argv[1] != "--input":
+        print("Usage: python processor.py --input <filename> [--bp] [--clr=#] [--ff] [--trace=spec] [--trace-file=path] [--cache=dir] [--checkpoint=path] [--checkpoint-every=#] [--stop-at=#] [--resume=path] [--spec=#] [--branch-trace=path] [--mem-dump=path]")
+        print("--input <filename> is required, --bp/--clr/--ff/--trace are optional")
         print("--bp enables cycle breakpointing")
         print("--clr=# sets the amount of flush time ")
+        print("--ff fast-forwards over idle cycles (same output, less wall-clock)")
+        print("--trace=spec enables tracing, e.g. --trace=info or --trace=ROB=debug,LSQ=info")
+        print("--trace-file=path writes trace records as JSON lines instead of to the console")
+        print("--cache=dir keeps decoded programs in dir, repeat runs of the same file skip parsing")
+        print("--checkpoint=path saves the processor state to path every --checkpoint-every=# cycles (default 1000)")
+        print("--stop-at=# stops at cycle # and saves the checkpoint instead of finishing the run")
+        print("--resume=path continues from a saved checkpoint (<filename> is ignored)")
+        print("--spec=# lets fetch follow predictions past up to # unresolved branches (default 0: stall on each branch)")
+        print("--branch-trace=path records every resolved branch (pc, taken, target) to path for predictor_eval.py")
+        print("--mem-dump=path writes the touched memory pages to path at the end, a 'Memory image' header line reads them back")
     else:
         debug = False
         pipe_cd = 5
+        fast_fwd = False
+        trace_spec = None
+        trace_file = None
+        cache_dir = None
+        ckpt_file = None
+        ckpt_every = 1000
+        stop_at = None
+        resume_file = None
+        max_branches = 0
+        branch_trace = None
+        mem_dump = None
         if len(sys.argv) > 3:
             for i in range(3,len(sys.argv)):
                 if sys.argv[i] == "--bp":
@@ -167,7 +357,44 @@ if __name__ == "__main__":
                 elif "--clr" in sys.argv[i]:
                     clr_vals = sys.argv[i].split("=")
                     pipe_cd = int(clr_vals[1])
+                elif sys.argv[i] == "--ff":
+                    fast_fwd = True
+                elif "--mem-dump" in sys.argv[i]:
+                    mem_dump = sys.argv[i].split("=", 1)[1]
+                elif "--branch-trace" in sys.argv[i]:
+                    branch_trace = sys.argv[i].split("=", 1)[1]
+                elif "--trace-file" in sys.argv[i]:
+                    trace_file = sys.argv[i].split("=", 1)[1]
+                elif "--trace" in sys.argv[i]:
+                    trace_spec = sys.argv[i].split("=", 1)[1]
+                elif "--cache" in sys.argv[i]:
+                    cache_dir = sys.argv[i].split("=", 1)[1]
+                elif "--checkpoint-every" in sys.argv[i]:
+                    ckpt_every = int(sys.argv[i].split("=", 1)[1])
+                elif "--checkpoint" in sys.argv[i]:
+                    ckpt_file = sys.argv[i].split("=", 1)[1]
+                elif "--stop-at" in sys.argv[i]:
+                    stop_at = int(sys.argv[i].split("=", 1)[1])
+                elif "--resume" in sys.argv[i]:
+                    resume_file = sys.argv[i].split("=", 1)[1]
+                elif "--spec" in sys.argv[i]:
+                    max_branches = int(sys.argv[i].split("=", 1)[1])
+
+        if trace_spec is not None:
+            if trace_file is not None:
+                tracing.tracer.configure(trace_spec, sink=tracing.JsonLinesSink(trace_file))
+            else:
+                tracing.tracer.configure(trace_spec, sink=tracing.ConsoleSink())
 
         #init and run
-        my_processor = Processor(sys.argv[2], verbose=debug, pipe_cd=pipe_cd)
-        my_processor.run_code(bp=debug)
+        if resume_file is not None:
+            my_processor = Processor.load_checkpoint(resume_file)
+            my_processor.verbose = debug
+            my_processor.fast_forward = fast_fwd
+        else:
+            my_processor = Processor(sys.argv[2], verbose=debug, pipe_cd=pipe_cd, fast_forward=fast_fwd, program_cache=cache_dir,
+                                     max_branches=max_branches, branch_trace=branch_trace, mem_dump=mem_dump)
+        my_processor.run_code(bp=debug, stop_at=stop_at, checkpoint_file=ckpt_file, checkpoint_every=ckpt_every)
+        if not my_processor.finished and ckpt_file is not None:
+            my_processor.save_checkpoint(ckpt_file)
+        tracing.tracer.close()
@@ -0,0 +1,52 @@
+"""
+  Decoded program cache
+  - load_program(filename) reads the input file once and returns (config, program):
+    config is the input_parser for the header, program the tuple of DecodedInstruction
+    records that InstructionBuffer builds its instructions from
+  - With a cache_dir the pair is pickled under the sha256 of the file contents, so a
+    repeat run of an unchanged input file skips parsing and decoding entirely
+  - Cache files are written to a temp file and renamed into place, so processes of a
+    sweep can share one cache directory
+"""
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+from functional_units import decode_program
+from reading_input import input_parser
+
+# bump whenever the parser or the decoded form changes, old cache files are then ignored
+CACHE_VERSION = 10
+
+
+def decode_source(filename, text):
+    lines = io.StringIO(text, newline=None).readlines()
+    return input_parser(filename, lines=lines), decode_program(lines)
+
+
+def cache_path(cache_dir, data):
+    digest = hashlib.sha256(data).hexdigest()
+    return os.path.join(cache_dir, "{}.v{}.pickle".format(digest, CACHE_VERSION))
+
+
+def load_program(filename, cache_dir=None):
+    with open(filename, "rb") as in_file:
+        data = in_file.read()
+    if cache_dir is None:
+        return decode_source(filename, data.decode())
+
+    path = cache_path(cache_dir, data)
+    try:
+        with open(path, "rb") as cache_file:
+            return pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass  # missing or unreadable, decode again and rewrite it
+
+    decoded = decode_source(filename, data.decode())
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as tmp_file:
+        pickle.dump(decoded, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return decoded
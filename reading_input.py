@@ -1,11 +1,129 @@
 import re
+from cache import WRITE_POLICIES
+from predictors import parse_dependence, parse_predictor
+
+UNIT_KINDS = ["INT", "FPA", "FPM"]
+
+
+def parse_intervals(spec):
+    """ "FPM 1 FPA 2 INT unpipelined" -> {"FPM":1, "FPA":2, "INT":0}, 0 = one at a time (the latency)
+    """
+    fields = spec.split()
+    if len(fields) % 2 != 0:
+        raise ValueError("Initiation interval needs a value per unit: {}".format(spec.strip()))
+    intervals = {}
+    for kind, value in zip(fields[0::2], fields[1::2]):
+        if kind.upper() not in UNIT_KINDS:
+            raise ValueError("Unknown unit in initiation interval: {}".format(kind))
+        if value.lower() == "pipelined":
+            intervals[kind.upper()] = 1
+        elif value.lower() == "unpipelined":
+            intervals[kind.upper()] = 0
+        else:
+            intervals[kind.upper()] = int(value)
+    return intervals
+
+
+SIZE_SUFFIXES = {"K":1 << 10, "M":1 << 20, "G":1 << 30}
+
+
+def parse_size(spec):
+    """ "4G" -> 4294967296, "65536" -> 65536
+    """
+    spec = spec.strip().upper().rstrip("B")
+    if spec[-1:] in SIZE_SUFFIXES:
+        return int(spec[:-1]) * SIZE_SUFFIXES[spec[-1]]
+    return int(spec)
+
+
+def parse_image(spec):
+    """ "data.bin 4096 float" -> {"path":"data.bin", "base":4096, "kind":"float"}, base and kind are optional
+    """
+    fields = spec.split()
+    image = {"path":fields[0], "base":parse_size(fields[1]) if len(fields) > 1 else 0,
+             "kind":fields[2].lower() if len(fields) > 2 else "int"}
+    if image["kind"] not in ["int", "float"]:
+        raise ValueError("Memory image words are int or float, not {}".format(fields[2]))
+    return image
+
+
+def parse_cache(spec):
+    """ "size=32K ways=8 line=64 latency=2 policy=write-back" -> settings dict, missing ones take defaults
+    """
+    config = {"size":32 << 10, "ways":4, "line":64, "latency":1, "policy":"write-back"}
+    for field in spec.split():
+        name, value = field.split("=")
+        if name not in config:
+            raise ValueError("Unknown cache setting: {}".format(name))
+        config[name] = value.strip().lower() if name == "policy" else parse_size(value)
+    if config["policy"] not in WRITE_POLICIES:
+        raise ValueError("Unknown cache write policy: {}".format(config["policy"]))
+    if min(config["size"], config["ways"], config["line"], config["latency"]) < 1:
+        raise ValueError("Cache size, ways, line and latency must be at least 1: {}".format(spec.strip()))
+    if config["size"] < config["ways"] * config["line"]:
+        raise ValueError("Cache size {} is smaller than one set of ways * line".format(config["size"]))
+    if config["size"] % (config["ways"] * config["line"]) != 0:
+        raise ValueError("Cache size {} is not a multiple of ways * line".format(config["size"]))
+    return config
+
+
+def parse_ports(spec):
+    """ "2 banks=4 interleave=1 agus=2" -> {"ports":2, "banks":4, "interleave":1, "agus":2}, agus None = the
+        load/store unit's # of FUs
+    """
+    fields = spec.split()
+    ports = {"ports":int(fields[0]), "banks":1, "interleave":1, "agus":None}
+    for field in fields[1:]:
+        name, value = field.split("=")
+        if name not in ports or name == "ports":
+            raise ValueError("Unknown memory port setting: {}".format(name))
+        ports[name] = int(value)
+    if min(ports["ports"], ports["banks"], ports["interleave"]) < 1:
+        raise ValueError("Memory ports, banks and interleave must be at least 1: {}".format(spec.strip()))
+    return ports
+
+
+# Optional "Name = value" settings. They go on the blank header lines (line 6 or 11),
+#  several to a line separated by ';'. name -> (attribute, default, parse)
+OPTIONS = {"branch predictor":("predictor", None, parse_predictor),
+           "issue width":("issue_width", 1, int),
+           "cdb buses":("cdb_buses", 1, int),
+           "cdb policy":("cdb_policy", "fifo", str.strip),
+           "result buffer entries":("result_entries", None, int),
+           "initiation interval":("intervals", {}, parse_intervals),
+           "memory size":("mem_size", None, parse_size),
+           "memory image":("mem_image", None, parse_image),
+           "l1 cache":("l1_cache", None, parse_cache),
+           "l2 cache":("l2_cache", None, parse_cache),
+           "memory ports":("mem_ports", None, parse_ports),
+           "mshrs":("mshrs", None, int),
+           "load speculation":("load_speculation", None, parse_dependence),
+           "write buffer":("write_buffer", None, int)}
+
+# the two original header lines, read in this order whatever their value
+LEGACY_ENTRIES = ["rob entries", "cdb buffer entries"]
+
+
+def parse_option(option):
+    """ "Issue width = 2" -> ("issue width", " 2"), a misspelled or unknown option is an error
+    """
+    if "=" not in option:
+        raise ValueError("Header option needs a value: {}".format(option.strip()))
+    name, value = option.split("=", 1)
+    if name.strip().lower() not in OPTIONS:
+        raise ValueError("Unknown header option: {}".format(name.strip()))
+    return name.strip().lower(), value
 
 class input_parser():
-    def __init__(self, filename):
+    def __init__(self, filename, lines=None):
         # open text_file-- feel dree to adjust file path to fit your computer
         # readInput = open("input.txt", "r")  # this is what it was before
-        readInput = open(filename, "r")
-        f = readInput.readlines()
+        # lines can be handed in by a caller that already read the file
+        if lines is None:
+            readInput = open(filename, "r")
+            f = readInput.readlines()
+        else:
+            f = lines
 
         # set counters
         tRow = 0  # start counting rows of table at 0 because the first one is a header
@@ -17,6 +135,8 @@ class input_parser():
         # set expected entries
         self.ROBe = 0
         self.CBDe = 0
+        for attribute, default, _ in OPTIONS.values():
+            setattr(self, attribute, default)
         # Seeds for register, memory adresses and instruction lists
         limit = 100
         self.regNames = [-1]*limit  # str
@@ -50,27 +170,20 @@ class input_parser():
                 # table values
                 data = v[1::]  # removing the labels (first column) in the text file
                 if tRow > 0:  # not evaluating the header
-                    nrg = data[0]  # number of registers
-                    cie = data[1]  # cycles in ex.
-                    cim = data[2]  # cycles in memory
-                    nfu = data[3]  # number of floating units
+                    # grabs numbers in table row corresponding to col labels
+                    row = {"nrg":data[0],  # number of registers
+                           "cie":data[1],  # cycles in ex.
+                           "cim":data[2],  # cycles in memory
+                           "nfu":data[3]}  # number of floating units
                     # create dictionary for each reservation station
                     if tRow == 1:
-                        self.intA = {}  # create empty dictionary called interger adder
-                        for number in ["nrg", "cie", "cim", "nfu"]:  # grabs numbers in table row corresponding to col labels
-                            self.intA[number] = eval(number)
+                        self.intA = row  # interger adder
                     elif tRow == 2:
-                        self.FPA = {}  # create empty dictionary floating point adder
-                        for number in ["nrg", "cie", "cim", "nfu"]:
-                            self.FPA[number] = eval(number)
+                        self.FPA = row  # floating point adder
                     elif tRow == 3:
-                        self.FPM = {}  # Floating point multiplier
-                        for number in ["nrg", "cie", "cim", "nfu"]:
-                            self.FPM[number] = eval(number)
+                        self.FPM = row  # Floating point multiplier
                     elif tRow == 4:
-                        self.LSU = {}  #
-                        for number in ["nrg", "cie", "cim", "nfu"]:
-                            self.LSU[number] = eval(number)
+                        self.LSU = row
                 tRow += 1  # read next line in table
             else:  # analyzing all the lines that were not separated by tabs
                 v = line.strip().split(',')
@@ -101,7 +214,12 @@ class input_parser():
                     r1m2 += 1  # switching to r1m2=2, meaning second row which is memory
                 else:
                     v = line.strip().split('=')
-                    if len(v) > 1:
+                    if len(v) > 1 and v[0].strip().lower() not in LEGACY_ENTRIES:
+                        for option in line.strip().split(';'):
+                            name, value = parse_option(option)
+                            attribute, _, parse = OPTIONS[name]
+                            setattr(self, attribute, parse(value))
+                    elif len(v) > 1:
                         if entry == 1:
                             self.ROBe = v[1]
                         else:
@@ -114,7 +232,8 @@ class input_parser():
         register_line = f[8]
         memory_string = memory_line.strip("\n").split(",")
         register_string = register_line.strip("\n").split(",")
-        self.memory = [0] * 256
+        # a memory size on the header makes memory sparse, then only the initialized words are kept
+        self.memory = [0] * 256 if self.mem_size is None else {}
         self.registers = {}
         for val in memory_string:
             temp = re.findall(r'\d+', val.split("=")[0])
@@ -0,0 +1,171 @@
+"""
+  Configuration sweep runner
+  - Runs one program over the Cartesian product of config table values and writes
+    one row per point: total cycles, IPC, branch mispredicts and the issue stall counts per cause,
+    plus hits, misses and writebacks per cache level when the input file configures caches, and
+    bank conflicts, port stalls and miss register and write buffer counts when it configures memory
+    ports, MSHRs or a write buffer
+  - Parameters are named UNIT.column for the table (UNIT: INT, FPA, FPM, LSQ and
+    column: nrg, cie, cim, nfu) plus ROB (ROB entries), CDB (CDB buffer entries), WIDTH (issue width)
+    and BUSES (CDB buses)
+  - Values are a comma separated list and/or inclusive ranges: 1,2,4 or 1-4 or 16-64:16
+  - The program is decoded once in the parent, points are fanned out over a process pool
+
+  Usage: python sweep.py --input prog.txt --param INT.nfu=1-3 --param ROB=16,32 [--jobs=N] [--out=file.csv|file.json] [--ff]
+"""
+import copy
+import csv
+import itertools
+import json
+import multiprocessing
+import sys
+from processor import Processor
+from program import load_program
+
+TABLE_ROWS = {"INT":"intA", "FPA":"FPA", "FPM":"FPM", "LSQ":"LSU"}
+TABLE_COLUMNS = ["nrg", "cie", "cim", "nfu"]
+SCALARS = {"ROB":"ROBe", "CDB":"CBDe", "WIDTH":"issue_width", "BUSES":"cdb_buses"}
+STALL_CAUSES = ["BTB", "ROB", "LSQ", "INT", "FPA", "FPM"]
+
+
+def parse_values(spec):
+    """ "1,2,8-10" -> [1, 2, 8, 9, 10], "16-64:16" -> [16, 32, 48, 64]
+    """
+    values = []
+    for item in spec.split(","):
+        if "-" in item:
+            bounds, _, step = item.partition(":")
+            low, high = bounds.split("-")
+            values += list(range(int(low), int(high) + 1, int(step) if step else 1))
+        else:
+            values.append(int(item))
+    return values
+
+
+def check_param(name):
+    if name in SCALARS:
+        return
+    unit, _, column = name.partition(".")
+    if unit not in TABLE_ROWS or column not in TABLE_COLUMNS:
+        raise ValueError("Unknown sweep parameter: {}".format(name))
+
+
+def apply_point(config, point):
+    """ Copy of the parsed input file with the point's values filled in (as the strings the parser produces)
+    """
+    config = copy.deepcopy(config)
+    for name, value in point.items():
+        if name in SCALARS:
+            setattr(config, SCALARS[name], str(value))
+        else:
+            unit, column = name.split(".")
+            getattr(config, TABLE_ROWS[unit])[column] = str(value)
+    return config
+
+
+# per-worker state, set once by __init_worker__ so the decoded program isn't re-sent per point
+_worker = {}
+
+
+def __init_worker__(filename, decoded, pipe_cd, fast_forward):
+    _worker.update(filename=filename, decoded=decoded, pipe_cd=pipe_cd, fast_forward=fast_forward)
+
+
+def run_point(point):
+    config, program = _worker["decoded"]
+    row = dict(point)
+    try:
+        proc = Processor(_worker["filename"], pipe_cd=_worker["pipe_cd"], fast_forward=_worker["fast_forward"],
+                         program=(apply_point(config, point), program))
+        proc.run_code(write_output=False)
+    except Exception as err:
+        row["error"] = "{}: {}".format(type(err).__name__, err)
+        return row
+    stats = proc.stats()
+    row["cycles"] = stats["cycles"]
+    row["instructions"] = stats["instructions"]
+    row["ipc"] = round(stats["ipc"], 6)
+    row["branches"] = stats["branches"]
+    row["mispredicts"] = stats["mispredicts"]
+    for cause in STALL_CAUSES:
+        row["stall_" + cause] = stats["stalls"][cause]
+    for level, counters in stats["caches"].items():
+        for name, count in counters.items():
+            row["{}_{}".format(level, name)] = count
+    row.update(stats["memory_ports"])
+    return row
+
+
+def sweep(filename, params, jobs=None, pipe_cd=5, fast_forward=True, program_cache=None):
+    """ params maps parameter name -> list of values. Returns one result row per point, in product order
+    """
+    for name in params:
+        check_param(name)
+    decoded = load_program(filename, cache_dir=program_cache)
+    names = list(params)
+    points = [dict(zip(names, values)) for values in itertools.product(*[params[name] for name in names])]
+    initargs = (filename, decoded, pipe_cd, fast_forward)
+    if jobs == 1:
+        __init_worker__(*initargs)
+        return [run_point(point) for point in points]
+    with multiprocessing.Pool(jobs, initializer=__init_worker__, initargs=initargs) as pool:
+        return pool.map(run_point, points, chunksize=1)
+
+
+def write_results(rows, params, out_file, fmt):
+    if fmt == "json":
+        json.dump(rows, out_file, indent=1)
+        out_file.write("\n")
+        return
+    columns = list(params) + ["cycles", "instructions", "ipc", "branches", "mispredicts"] + ["stall_" + cause for cause in STALL_CAUSES]
+    for row in rows:
+        columns += [name for name in row if name not in columns and name != "error"]  # cache counters, if any
+    columns.append("error")
+    writer = csv.DictWriter(out_file, fieldnames=columns, restval="")
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "--input":
+        print("Usage: python sweep.py --input <filename> --param NAME=values [--param ...] [--jobs=N] [--out=path] [--json] [--clr=#] [--no-ff] [--cache=dir]")
+        print("NAME is ROB, CDB, WIDTH, BUSES or UNIT.column with UNIT in INT/FPA/FPM/LSQ and column in nrg/cie/cim/nfu")
+        print("values are a list and/or inclusive ranges, e.g. 1,2,4 or 1-4 or 16-64:16")
+        print("--jobs=N sets the process pool size (default: one per core)")
+        print("--out=path writes the table to path instead of stdout, a .json path or --json writes JSON instead of CSV")
+    else:
+        params = {}
+        jobs = None
+        out_path = None
+        fmt = "csv"
+        pipe_cd = 5
+        fast_fwd = True
+        cache_dir = None
+        i = 3
+        while i < len(sys.argv):
+            if sys.argv[i] == "--param":
+                i += 1
+                name, values = sys.argv[i].split("=", 1)
+                params[name] = parse_values(values)
+            elif "--jobs" in sys.argv[i]:
+                jobs = int(sys.argv[i].split("=", 1)[1])
+            elif "--out" in sys.argv[i]:
+                out_path = sys.argv[i].split("=", 1)[1]
+                if out_path.endswith(".json"):
+                    fmt = "json"
+            elif sys.argv[i] == "--json":
+                fmt = "json"
+            elif "--clr" in sys.argv[i]:
+                pipe_cd = int(sys.argv[i].split("=", 1)[1])
+            elif sys.argv[i] == "--no-ff":
+                fast_fwd = False
+            elif "--cache" in sys.argv[i]:
+                cache_dir = sys.argv[i].split("=", 1)[1]
+            i += 1
+
+        rows = sweep(sys.argv[2], params, jobs=jobs, pipe_cd=pipe_cd, fast_forward=fast_fwd, program_cache=cache_dir)
+        if out_path is None:
+            write_results(rows, params, sys.stdout, fmt)
+        else:
+            with open(out_path, "w", newline="") as out_file:
+                write_results(rows, params, out_file, fmt)
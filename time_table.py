@@ -3,19 +3,30 @@
   - Timing Table hooks into the tick function through a common .update() interface
   - Class manages and tracks instructions throughout their time in the processor
   - Class manages loops by tracking transitions for each instruction
+  - In-flight rows are indexed by (pc, next expected stage) so an update only
+    looks at the rows that can take that transition, committed rows drop out
 """
+from bisect import insort
+from collections import deque
+from tracing import channel, INFO, DEBUG
 
 
 class TimingTable:
     def __init__(self, initial_clock):
         self.tracked_instructions = []    #every cycle we've ever seen.
         self.current_cyc = initial_clock  #processor updates this timely.
+        self.pending = {}                 #(pc, next stage) -> row indexes, oldest issue first
+        self.trace = channel("TIME")
 
     def update(self, tag, data):
         """ Update needs the tag ("issue" || "execute" || "memory" || "wrtback" || "commit")
             and the data (Instruction || {"pc":INT})
         """
-        print("Tracker received data: {}".format(data))
+        if self.trace.level >= DEBUG:
+            if tag == "issue":
+                self.trace.emit(DEBUG, tag, pc=data.pc, instr=data)
+            else:
+                self.trace.emit(DEBUG, tag, pc=data["pc"])
         if tag == "issue":
             # if instruction is being issued, its new - so save it straight away
             #  'data' should be the
@@ -23,22 +34,37 @@ class TimingTable:
                                              "issue":self.current_cyc, \
                                              "execute":"--", "memory":"--", \
                                              "wrtback":"--", "commit":"--"})
+            self.__track__(len(self.tracked_instructions) - 1)
         elif tag == "branch-resolve":
             # not needed currently
-            print("branch correctly predicted.")
-        elif tag == "branch-rewind":
-            # not needed currently
-            print("branch not correctly predicted, remove some tracked instructions")
+            return
         else:
             # find the 1st instance of the instruction w/ both right PC and matching
             #  stage transition (We expect these to be dictionaries with a "pc" entry)
-            for line in self.tracked_instructions:
-                if line["instr"].pc == data["pc"]:
-                    if self.__verify_tx__(line["instr"].op, line["state"], tag):
-                        line["state"] = tag
-                        line[tag] = self.current_cyc
-                        return
-            print("Odd... not tracking this instruction:{} {}".format(tag, data))
+            waiting = self.pending.get((data["pc"], tag))
+            if not waiting:
+                if self.trace.level >= INFO:
+                    self.trace.emit(INFO, "untracked", stage=tag, pc=data["pc"])
+                return
+            idex = waiting.popleft()
+            if len(waiting) == 0:
+                del self.pending[(data["pc"], tag)]
+            line = self.tracked_instructions[idex]
+            line["state"] = tag
+            line[tag] = self.current_cyc
+            self.__track__(idex)
+
+
+    def squash(self, mark):
+        """ Branch mispredict: rows from 'mark' on were issued down the wrong path, forget them
+        """
+        del self.tracked_instructions[mark:]
+        for key in list(self.pending):
+            waiting = deque(idex for idex in self.pending[key] if idex < mark)
+            if len(waiting) > 0:
+                self.pending[key] = waiting
+            else:
+                del self.pending[key]
 
 
     def __str__(self):
@@ -64,8 +90,21 @@ class TimingTable:
 
 
 
-    def __verify_tx__(self, op, state_c, state_n):
-        # looks at tx's for each instruction & decides if this is correct tx in pipeline
+    def __track__(self, idex):
+        # files the row under the next stage it expects, committed rows are dropped
+        line = self.tracked_instructions[idex]
+        stage = self.__next_stage__(line["instr"].op, line["state"])
+        if stage is None:
+            return
+        waiting = self.pending.setdefault((line["instr"].pc, stage), deque())
+        if len(waiting) == 0 or waiting[-1] < idex:
+            waiting.append(idex)
+        else:
+            insort(waiting, idex)  # a younger copy of this pc got here first
+
+
+    def __next_stage__(self, op, state_c):
+        # looks at tx's for each instruction & gives the next stage in the pipeline
         tx_order = None
         if op =="Sd":
             tx_order = ["issue", "execute", "memory", "commit"]
@@ -74,10 +113,7 @@ class TimingTable:
         else:
             tx_order = ["issue", "execute", "wrtback", "commit"]
 
-        idex_state_c = tx_order.index(state_c)
-        idex_state_n = tx_order.index(state_n)
-
-        # if the new and current indexes are directly next to each other in the
-        #   transition order, then the transition is correct, otherwise it couldn't
-        #   be this instruction
-        return (idex_state_n - idex_state_c) == 1
+        idex_state_n = tx_order.index(state_c) + 1
+        if idex_state_n == len(tx_order):
+            return None
+        return tx_order[idex_state_n]
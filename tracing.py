@@ -0,0 +1,134 @@
+"""
+  Structured tracing for the simulator
+  - Every component holds a Channel from channel("NAME") and guards each event:
+        if self.trace.level >= INFO:
+            self.trace.emit(INFO, "rob_full", pc=pc)
+    so with tracing off a call site costs one attribute compare. Records are only
+    built and formatted by the sink, never at the call site.
+  - Levels are set per component (or "all") with configure("ROB=debug,LSQ=info")
+  - Sinks: NullSink (default), RingSink (last N records in memory),
+    JsonLinesSink (one JSON object per line) and ConsoleSink (readable stdout)
+"""
+import json
+from collections import deque
+
+OFF = 0
+INFO = 1
+DEBUG = 2
+LEVEL_NAMES = {"off":OFF, "info":INFO, "debug":DEBUG}
+
+
+class NullSink:
+    def write(self, cycle, component, level, event, fields):
+        return
+
+    def close(self):
+        return
+
+
+class RingSink:
+    """ Keeps the last 'capacity' records in memory, untouched until read back
+    """
+    def __init__(self, capacity=4096):
+        self.ring = deque(maxlen=capacity)
+
+    def write(self, cycle, component, level, event, fields):
+        self.ring.append((cycle, component, level, event, fields))
+
+    def records(self):
+        return [make_record(*rec) for rec in self.ring]
+
+    def close(self):
+        return
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.out_file = open(path, "w")
+
+    def write(self, cycle, component, level, event, fields):
+        self.out_file.write(json.dumps(make_record(cycle, component, level, event, fields), default=str) + "\n")
+
+    def close(self):
+        self.out_file.close()
+
+
+class ConsoleSink:
+    def write(self, cycle, component, level, event, fields):
+        field_str = " ".join("{}={}".format(key, val) for key, val in fields.items())
+        print("[{}] {} {} {}".format(cycle, component, event, field_str))
+
+    def close(self):
+        return
+
+
+def make_record(cycle, component, level, event, fields):
+    record = {"cycle":cycle, "component":component, "event":event}
+    record.update(fields)
+    return record
+
+
+class Channel:
+    """ Per-component handle. Call sites must check .level before calling emit()
+    """
+    def __init__(self, tracer, component):
+        self.tracer = tracer
+        self.component = component
+        self.level = OFF
+
+    def emit(self, level, event, **fields):
+        self.tracer.sink.write(self.tracer.cycle, self.component, level, event, fields)
+
+    def __reduce__(self):
+        # checkpoints keep only the name, a restored component rebinds to the running tracer
+        return (channel, (self.component,))
+
+
+class Tracer:
+    def __init__(self, sink=None):
+        self.sink = NullSink() if sink is None else sink
+        self.channels = {}   # component name -> Channel
+        self.default_level = OFF
+        self.cycle = 0       # processor updates this every cycle
+
+    def channel(self, component):
+        if component not in self.channels:
+            self.channels[component] = Channel(self, component)
+            self.channels[component].level = self.default_level
+        return self.channels[component]
+
+    def set_level(self, component, level):
+        if component == "all":
+            self.default_level = level
+            for chan in self.channels.values():
+                chan.level = level
+        else:
+            self.channel(component).level = level
+
+    def configure(self, spec, sink=None):
+        """ spec is a comma separated list of COMPONENT=level (level: off|info|debug),
+            "all=info" sets every component. A bare level means "all=<level>"
+        """
+        if sink is not None:
+            self.sink.close()
+            self.sink = sink
+        for item in spec.split(","):
+            if item.strip() == "":
+                continue
+            if "=" in item:
+                component, level = item.split("=")
+            else:
+                component, level = "all", item
+            self.set_level(component.strip(), LEVEL_NAMES[level.strip().lower()])
+
+    def close(self):
+        self.sink.close()
+        self.sink = NullSink()
+
+
+# simulator wide tracer, components grab their channel at init
+tracer = Tracer()
+
+
+def channel(component):
+    return tracer.channel(component)